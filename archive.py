@@ -0,0 +1,195 @@
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from sqlalchemy import delete, text
+from sqlmodel import Session, select
+from config import Config
+from metrics import metrics
+import database
+from database import ClipboardHistory, HistoryPartition
+
+"""
+历史记录按月归档：早于 Config.ARCHIVE_AFTER_MONTHS 个月的记录移入只读的按月分区文件，
+主表（热分区）只保留近期数据，索引和页缓存都能留在内存中
+
+- 星标、收藏、还在等待文件的记录不归档；ID 最大的一条也留在主表，保证新记录的 ID 不会与分区中的重复
+- 分区文件与主表结构相同，文本全部 zlib 压缩，VACUUM 后设为只读；查询时以 immutable 方式打开
+  （见 database.query_history / partition_engine），按时间范围和游标只读取需要的分区
+- 复制在写线程之外进行（只读主库），最后在写线程中登记分区并删除主表中的记录；
+  期间这些记录被星标或删除时放弃本次归档
+- 归档的记录仍计入统计汇总；分区中的记录只读，不能再星标、修改或删除
+- 分区文件不在数据库快照中，需要单独备份 Config.ARCHIVE_DIR（写入后不再变化）
+"""
+
+def month_bounds(month: str) -> tuple:
+    """'YYYY-MM' 的 [开始, 结束) 毫秒时间戳（UTC）"""
+    start = datetime.strptime(month, "%Y-%m").replace(tzinfo=timezone.utc)
+    end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return int(start.timestamp() * 1000), int(end.timestamp() * 1000)
+
+def cutoff_month(after_months: int = None, now: datetime = None) -> str:
+    """早于该月份（不含）的记录可以归档：保留当月在内的最近 after_months 个月"""
+    after_months = Config.ARCHIVE_AFTER_MONTHS if after_months is None else after_months
+    now = now or datetime.now(timezone.utc)
+    index = now.year * 12 + now.month - 1 - (after_months - 1)
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+# 可以归档的记录（:start / :end 为月份的开始与结束时间戳）
+_ELIGIBLE = (
+    "ts >= :start AND ts < :end AND starred = 0 "
+    "AND uuid NOT IN (SELECT history_uuid FROM favorites) "
+    "AND id NOT IN (SELECT history_id FROM pending_files) "
+    "AND id < (SELECT MAX(id) FROM clipboardhistory)"
+)
+
+def archivable_months(db_path: str = None, before: str = None) -> list:
+    """[(月份, 可归档条数)]，只包括早于 before 的月份"""
+    before_ms = month_bounds(before or cutoff_month())[0]
+    conn = sqlite3.connect(f"file:{db_path or Config.DB_PATH}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(
+            "SELECT strftime('%Y-%m', ts / 1000, 'unixepoch') AS month, COUNT(*) FROM clipboardhistory "
+            f"WHERE {_ELIGIBLE} GROUP BY month ORDER BY month", {'start': 0, 'end': before_ms}
+        ).fetchall()
+    finally:
+        conn.close()
+    return [(month, count) for month, count in rows]
+
+def _copy_month(db_path: str, part_path: str, month: str) -> list:
+    """把该月可归档的记录复制到新的分区文件，返回复制的记录ID（只读主库，不阻塞写线程）"""
+    start, end = month_bounds(month)
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, isolation_level=None)
+    try:
+        conn.execute("ATTACH DATABASE ? AS part", (part_path,))
+        # 与主表相同的表结构与排序索引
+        table_sql = conn.execute(
+            "SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = 'clipboardhistory'"
+        ).fetchone()[0]
+        conn.execute(table_sql.replace("CREATE TABLE clipboardhistory", "CREATE TABLE part.clipboardhistory", 1))
+        for name, columns in (("ix_history_ts", "ts, id"), ("ix_history_type_ts", "type, ts, id"),
+                              ("ix_history_equipment_ts", "from_equipment, ts, id"),
+                              ("ix_history_root_ts", "root_id, ts, id")):
+            conn.execute(f"CREATE INDEX part.{name} ON clipboardhistory ({columns})")
+        conn.execute("BEGIN")
+        conn.execute(f"INSERT INTO part.clipboardhistory SELECT * FROM main.clipboardhistory WHERE {_ELIGIBLE}",
+                     {'start': start, 'end': end})
+        ids = [row[0] for row in conn.execute("SELECT id FROM part.clipboardhistory")]
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    return ids
+
+def _compact_partition(part_path: str):
+    """分区中的文本全部压缩存储（有收益时），再 VACUUM 成紧凑的单个文件"""
+    conn = sqlite3.connect(part_path, isolation_level=None)
+    try:
+        conn.execute("BEGIN")
+        rows = conn.execute(
+            "SELECT id, clipboard FROM clipboardhistory WHERE type = 'Text' AND body_codec IS NULL AND clipboard != ''"
+        ).fetchall()
+        for row_id, clipboard in rows:
+            encoded = clipboard.encode("utf-8")
+            compressed = zlib.compress(encoded, 9)
+            if len(compressed) < len(encoded):
+                conn.execute("UPDATE clipboardhistory SET clipboard = '', body = ?, body_codec = 'zlib' WHERE id = ?",
+                             (compressed, row_id))
+        conn.execute("COMMIT")
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        conn.close()
+
+def _partition_stats(part_path: str) -> dict:
+    conn = sqlite3.connect(f"file:{part_path}?mode=ro", uri=True)
+    try:
+        min_ts, max_ts, min_id, max_id, count = conn.execute(
+            "SELECT MIN(ts), MAX(ts), MIN(id), MAX(id), COUNT(*) FROM clipboardhistory"
+        ).fetchone()
+    finally:
+        conn.close()
+    return {'min_ts': min_ts, 'max_ts': max_ts, 'min_id': min_id, 'max_id': max_id, 'count': count}
+
+def register_partition(session, month: str, path: str, stats: dict, size: int, ids: list) -> int:
+    """
+    写线程操作：登记分区并从主表删除已归档的记录（不改动统计汇总，记录仍然存在）。
+    复制之后有记录被星标、收藏或删除时抛出 ValueError，整个归档作废
+    """
+    start, end = month_bounds(month)
+    session.flush()
+    eligible = session.execute(text(f"SELECT COUNT(*) FROM clipboardhistory WHERE {_ELIGIBLE}"),
+                               {'start': start, 'end': end}).scalar()
+    deleted = 0
+    for offset in range(0, len(ids), 500):
+        chunk = ids[offset:offset + 500]
+        deleted += session.exec(delete(ClipboardHistory).where(
+            ClipboardHistory.id.in_(chunk), ClipboardHistory.starred == False
+        )).rowcount
+    # 复制时可以归档的记录必须原样都在：数量对不上说明期间有星标、删除或新归档
+    if deleted != len(ids) or eligible != len(ids):
+        raise ValueError(f"归档期间有记录发生变化（复制 {len(ids)} 条，现在 {eligible} 条），请重试")
+    partition = HistoryPartition(month=month, path=path, size=size, **stats)
+    session.add(partition)
+    session.flush()
+    session.expire_all()
+    return partition.id
+
+def archive_month(month: str, db_path: str = None, archive_dir: str = None, writer=None) -> dict:
+    """
+    归档一个月份中可以归档的记录
+    :return: {'month', 'path', 'count', 'size', 'seconds'}；没有可归档的记录时 path 为 None
+    """
+    from db_writer import get_writer
+
+    db_path = db_path or Config.DB_PATH
+    archive_dir = archive_dir or Config.ARCHIVE_DIR
+    os.makedirs(archive_dir, exist_ok=True)
+    began = time.perf_counter()
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+    path = os.path.join(archive_dir, f"history-{month}-{stamp}.db")
+    tmp_path = os.path.join(archive_dir, f".history-{month}-{stamp}.tmp")
+    try:
+        ids = _copy_month(db_path, tmp_path, month)
+        if not ids:
+            os.remove(tmp_path)
+            return {'month': month, 'path': None, 'count': 0, 'size': 0, 'seconds': time.perf_counter() - began}
+        _compact_partition(tmp_path)
+        os.replace(tmp_path, path)
+        os.chmod(path, 0o444)
+        size = os.path.getsize(path)
+        (writer or get_writer()).submit(register_partition, month, path, _partition_stats(path), size, ids).result()
+    except BaseException:
+        for leftover in (tmp_path, path):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        raise
+    seconds = time.perf_counter() - began
+    metrics.inc("archive.partitions")
+    metrics.inc("archive.rows", len(ids))
+    metrics.observe("archive.seconds", seconds)
+    return {'month': month, 'path': path, 'count': len(ids), 'size': size, 'seconds': seconds}
+
+def archive_old_months(min_rows: int = 0, before: str = None) -> list:
+    """归档早于 before（默认按 Config.ARCHIVE_AFTER_MONTHS）的所有月份，可归档条数少于 min_rows 的月份跳过"""
+    results = []
+    for month, count in archivable_months(before=before):
+        if count >= min_rows:
+            results.append(archive_month(month))
+    return results
+
+def list_partition_rows() -> list:
+    """已登记的分区（按月份）"""
+    with Session(database.get_engine()) as session:
+        return session.exec(select(HistoryPartition).order_by(HistoryPartition.month, HistoryPartition.id)).all()
+
+def run_archiver(stop_event: threading.Event):
+    """后台循环：每 Config.ARCHIVE_INTERVAL 秒归档一次旧月份"""
+    while not stop_event.wait(Config.ARCHIVE_INTERVAL):
+        try:
+            for result in archive_old_months(min_rows=Config.ARCHIVE_MIN_ROWS):
+                print(f"已归档 {result['month']}: {result['count']} 条（{result['seconds']:.2f} 秒）")
+        except Exception as e:
+            metrics.inc("archive.errors")
+            print(f"历史归档失败: {e}")
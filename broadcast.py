@@ -0,0 +1,181 @@
+import hmac
+import secrets
+import threading
+import time
+from typing import Callable, Optional
+from config import Config
+from metrics import metrics
+
+"""
+Socket.IO 推送的合并与按视图订阅
+
+- 网页用 join 事件订阅一个视图（根目录、类型、来源设备、收藏夹的任意组合，都不指定时接收全部），
+  每个视图一个房间，只收到与该视图有关的新记录和变更
+- 新记录（history_update）与变更（history_delta）先放进待发送列表，每 Config.BROADCAST_INTERVAL 秒
+  合并发送一次：连续复制 50 条时每个房间只收到一条消息，网页只重新加载一次
+- 发送时按视图（而不是按客户端）匹配，开销与订阅的视图数有关，与连接的客户端数无关；
+  基准测试见 cli.py bench-broadcast
+- 新记录的报告（history_update）只接受连接时带了监控口令（Config.MONITOR_TOKEN）的客户端，网页发来的丢弃
+"""
+
+VIEW_FIELDS = ("root", "type", "device", "folder")
+_MONITOR_TOKEN = Config.MONITOR_TOKEN or secrets.token_urlsafe(24)
+
+def monitor_auth() -> dict:
+    """监控服务连接 Socket.IO 时带的认证数据"""
+    return {'token': _MONITOR_TOKEN}
+
+def is_monitor(auth) -> bool:
+    """连接的认证数据是否带了正确的监控口令（常数时间比较）"""
+    token = auth.get('token') if isinstance(auth, dict) else None
+    return isinstance(token, str) and hmac.compare_digest(token.encode("utf-8"), _MONITOR_TOKEN.encode("utf-8"))
+_UNROUTED = {"delete", "move", "uncollect"}  # 记录已删除或已离开原来的收藏夹，无法按视图判断，发给所有视图
+
+def normalize_view(data: Optional[dict]) -> dict:
+    """join 事件的参数 -> 视图 {root, type, device, folder}，没有指定的为 None"""
+    data = data or {}
+    view = {field: (str(data[field]) if data.get(field) not in (None, "") else None) for field in VIEW_FIELDS}
+    if view["folder"] is not None:
+        view["folder"] = int(view["folder"])
+    return view
+
+def view_room(view: dict) -> str:
+    """视图对应的房间名，如 "view:root=alice&type=Text"；不限条件的视图为 "view:*" """
+    parts = [f"{field}={view[field]}" for field in VIEW_FIELDS if view.get(field) is not None]
+    return "view:" + ("&".join(parts) or "*")
+
+def matches(view: dict, info: dict) -> bool:
+    """记录（{'root', 'type', 'device', 'folders'}）是否属于该视图；不知道的字段（旧版监控服务不报告）视为符合"""
+    for field in ("root", "type", "device"):
+        if view[field] is not None and info.get(field) is not None and view[field] != info[field]:
+            return False
+    return view["folder"] is None or view["folder"] in (info.get("folders") or ())
+
+class Broadcaster:
+    def __init__(self, socketio, lookup: Optional[Callable] = None, interval: float = None):
+        """
+        :param socketio: Flask-SocketIO 实例
+        :param lookup: lookup(ids) -> {ID: {'root', 'type', 'device', 'folders'}}，变更按视图分发时使用；
+                       不提供或查不到的记录发给所有视图
+        :param interval: 合并发送的间隔（秒），0 表示每个事件立即发送
+        """
+        self.socketio = socketio
+        self.lookup = lookup
+        self.interval = Config.BROADCAST_INTERVAL if interval is None else interval
+        self.views = {}  # 房间名 -> [视图, 订阅的客户端数]
+        self._clients = {}  # 客户端 sid -> 房间名
+        self._updates = []  # 待发送的新记录 [{'root', 'id', 'type', 'device'}]
+        self._deltas = []  # 待发送的变更 [[操作, ID 列表]]，相邻的同类操作合并，保持先后顺序
+        self._scheduled = False
+        self._lock = threading.Lock()
+        metrics.register("broadcast.views", lambda: len(self.views))
+        metrics.register("broadcast.clients", lambda: len(self._clients))
+
+    def subscribe(self, sid: str, data: Optional[dict] = None) -> tuple:
+        """客户端订阅一个视图（替换原来的订阅），返回 (原来的房间或 None, 新房间)"""
+        view = normalize_view(data)
+        room = view_room(view)
+        with self._lock:
+            old = self._release(sid)
+            self._clients[sid] = room
+            self.views.setdefault(room, [view, 0])[1] += 1
+        return old, room
+
+    def unsubscribe(self, sid: str) -> Optional[str]:
+        """客户端断开，返回它订阅的房间"""
+        with self._lock:
+            return self._release(sid)
+
+    def _release(self, sid: str) -> Optional[str]:
+        room = self._clients.pop(sid, None)
+        if room is not None:
+            self.views[room][1] -= 1
+            if self.views[room][1] <= 0:
+                del self.views[room]
+        return room
+
+    def publish_update(self, event: dict):
+        """新记录 {'root', 'id', 'type', 'device'}（可以只有 root），在下一次合并发送时推送"""
+        with self._lock:
+            self._updates.append(event)
+        metrics.inc("broadcast.events")
+        self._schedule()
+
+    def publish_delta(self, action: str, ids: list):
+        """一次操作的变更（星标、删除等），在下一次合并发送时推送"""
+        if not ids:
+            return
+        with self._lock:
+            if self._deltas and self._deltas[-1][0] == action:
+                self._deltas[-1][1].extend(ids)
+            else:
+                self._deltas.append([action, list(ids)])
+        metrics.inc("broadcast.events")
+        self._schedule()
+
+    def _schedule(self):
+        if self.interval <= 0:
+            self.flush()
+            return
+        with self._lock:
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self.socketio.start_background_task(self._flush_later)
+
+    def _flush_later(self):
+        self.socketio.sleep(self.interval)
+        self.flush()
+
+    def flush(self) -> int:
+        """把待发送的事件按房间合并后发送，返回发送的消息数（每个房间每种消息一条）"""
+        with self._lock:
+            updates, self._updates = self._updates, []
+            deltas, self._deltas = self._deltas, []
+            self._scheduled = False
+            views = {room: entry[0] for room, entry in self.views.items()}
+        if not views or not (updates or deltas):
+            return 0
+        began = time.perf_counter()
+        messages = 0
+        for room, events in self._route_updates(updates, views).items():
+            ids = list(dict.fromkeys(e['id'] for e in events if e.get('id') is not None))
+            self.socketio.emit('history_update', {'root': views[room]['root'], 'count': len(events),
+                                                  'ids': ids[:Config.BROADCAST_MAX_IDS]}, to=room)
+            messages += 1
+        for action, room_ids in self._route_deltas(deltas, views):
+            for room, ids in room_ids.items():
+                self.socketio.emit('history_delta', {'action': action, 'ids': ids}, to=room)
+                messages += 1
+        metrics.inc("broadcast.messages", messages)
+        metrics.observe("broadcast.flush.seconds", time.perf_counter() - began)
+        return messages
+
+    def _route_updates(self, updates: list, views: dict) -> dict:
+        """房间名 -> 属于该视图的新记录（新记录还不在任何收藏夹中）"""
+        routed = {}
+        for event in updates:
+            for room, view in views.items():
+                if matches(view, event):
+                    routed.setdefault(room, []).append(event)
+        return routed
+
+    def _route_deltas(self, deltas: list, views: dict) -> list:
+        """[(操作, {房间名: ID 列表})]，每条记录只发给包含它的视图"""
+        routed_ids = [i for action, ids in deltas if action not in _UNROUTED for i in ids]
+        infos = {}
+        if routed_ids and self.lookup is not None:
+            try:
+                infos = self.lookup(list(dict.fromkeys(routed_ids)))
+            except Exception as e:
+                print(f"查询变更记录的视图信息出错: {e}")
+        routed = []
+        for action, ids in deltas:
+            rooms = {}
+            for item_id in dict.fromkeys(ids):
+                info = None if action in _UNROUTED else infos.get(item_id)
+                for room, view in views.items():
+                    if info is None or matches(view, info):
+                        rooms.setdefault(room, []).append(item_id)
+            routed.append((action, rooms))
+        return routed
@@ -0,0 +1,423 @@
+import argparse
+import sys
+from config import Config
+
+"""
+命令行维护工具：python cli.py <命令> [参数]
+"""
+
+def format_size(size_bytes):
+    """将字节数格式化为带单位的易读字符串"""
+    units = ['B', 'KB', 'MB', 'GB']
+    unit_index = 0
+    size = size_bytes
+    while size >= 1024 and unit_index < len(units) - 1:
+        size /= 1024
+        unit_index += 1
+    return f"{size:.2f} {units[unit_index]}"
+
+def cmd_compact_report(args):
+    """在数据库副本上执行精简，输出前后大小对比"""
+    from database import compaction_report
+
+    report = compaction_report(args.db)
+    saved = report['size_before'] - report['size_after']
+    ratio = saved / report['size_before'] * 100 if report['size_before'] else 0
+    print(f"数据库: {args.db}")
+    print(f"结构版本: {report['schema_version']}")
+    print(f"记录数: {report['rows']}（压缩存储 {report['compressed_rows']} 条，迁移后补充精简 {report['changed_rows']} 条）")
+    print(f"精简前: {format_size(report['size_before'])}")
+    print(f"精简后: {format_size(report['size_after'])}（减少 {format_size(saved)}，{ratio:.1f}%）")
+
+def use_temp_storage(tmp_dir: str):
+    """基准测试使用临时目录中的数据库与备份目录，不影响正式数据"""
+    import os
+    Config.DB_PATH = os.path.join(tmp_dir, "db", "bench.db")
+    Config.BACKUP_DIR = os.path.join(tmp_dir, "backup")
+    Config.PACK_DIR = os.path.join(tmp_dir, "packs")
+
+def cmd_bench_ingest(args):
+    """对比逐条提交与写线程组提交的突发写入吞吐和单条延迟"""
+    import tempfile
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    with tempfile.TemporaryDirectory() as tmp:
+        use_temp_storage(tmp)
+        import database
+        from db_writer import DBWriter
+
+        engine = database.init_db()
+        payloads = [{"Type": "Text", "Clipboard": f"bench {i}", "From": "bench"} for i in range(args.items)]
+
+        def burst(ingest):
+            began = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.threads) as pool:
+                list(pool.map(ingest, payloads))
+            return args.items / (time.perf_counter() - began)
+
+        def single_latency(ingest, rounds=50):
+            samples = []
+            for i in range(rounds):
+                began = time.perf_counter()
+                ingest({"Type": "Text", "Clipboard": f"single {i} {time.time()}", "From": "bench"})
+                samples.append(time.perf_counter() - began)
+                time.sleep(0.005)
+            samples.sort()
+            return samples[len(samples) // 2] * 1000
+
+        direct = lambda data: database.add_history_item_from_json(data, engine)
+        writer = DBWriter(engine)
+        writer.start()
+        grouped = lambda data: writer.submit(database.ingest_history_item, data).result()
+
+        print(f"突发写入 {args.items} 条，{args.threads} 个并发提交线程")
+        print(f"逐条提交: {burst(direct):8.0f} 条/秒，单条延迟中位数 {single_latency(direct):.2f} ms")
+        print(f"组提交:   {burst(grouped):8.0f} 条/秒，单条延迟中位数 {single_latency(grouped):.2f} ms")
+        print(f"组提交批次: {writer.batches}，平均每批 {writer.items / max(writer.batches, 1):.1f} 条")
+        writer.stop()
+        engine.dispose()
+
+def _process_cpu_seconds(pid: int) -> float:
+    """进程累计 CPU 时间（用户态 + 内核态），读取 /proc，仅 Linux 可用"""
+    import os
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+# 在子进程中启动只提供下载的 Web 服务（eventlet），参数：数据库 备份目录 端口
+_BENCH_SERVER = """
+import sys
+from config import Config
+Config.DB_PATH, Config.BACKUP_DIR = sys.argv[1:3]
+import database
+database.init_db()
+import web_server
+web_server.socketio.run(web_server.app, host="127.0.0.1", port=int(sys.argv[3]), log_output=False)
+"""
+
+def cmd_bench_download(args):
+    """直接服务（send_file）时下载同一个备份文件的吞吐和服务进程 CPU 占用"""
+    import os
+    import subprocess
+    import tempfile
+    import time
+    import urllib.request
+
+    with tempfile.TemporaryDirectory() as tmp:
+        use_temp_storage(tmp)
+        import database
+        from sqlmodel import Session
+
+        engine = database.init_db()
+        os.makedirs(Config.BACKUP_DIR, exist_ok=True)
+        blob = os.path.join(Config.BACKUP_DIR, "bench.bin")
+        with open(blob, "wb") as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+        checksum = database.file_md5(blob)
+        with Session(engine) as session:
+            session.add(database.BackupFile(checksum=checksum, filepath=blob, size=os.path.getsize(blob)))
+            session.commit()
+        engine.dispose()
+
+        url = f"http://127.0.0.1:{args.port}/api/download?checksum={checksum}"
+        print(f"下载 {args.size_mb} MB 文件 {args.rounds} 次")
+        proc = subprocess.Popen([sys.executable, "-c", _BENCH_SERVER, Config.DB_PATH, Config.BACKUP_DIR, str(args.port)],
+                                cwd=Config.BASE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            for _ in range(100):
+                try:
+                    urllib.request.urlopen(f"http://127.0.0.1:{args.port}/api/metrics", timeout=1).close()
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            cpu_before = _process_cpu_seconds(proc.pid)
+            began = time.perf_counter()
+            received = 0
+            for _ in range(args.rounds):
+                with urllib.request.urlopen(url) as resp:
+                    while chunk := resp.read(1024 * 1024):
+                        received += len(chunk)
+            elapsed = time.perf_counter() - began
+            cpu = _process_cpu_seconds(proc.pid) - cpu_before
+        finally:
+            proc.terminate()
+            proc.wait(timeout=5)
+        gb = received / 1024 ** 3
+        print(f"send_file {received / 1024 ** 2 / elapsed:8.0f} MB/s，服务进程 CPU {cpu / gb:.2f} 秒/GB")
+
+def cmd_bench_broadcast(args):
+    """
+    大量客户端连接时，对比逐条推送给所有人（原来的做法）与按视图订阅、合并推送的开销和客户端收到的消息数。
+    客户端是进程内的 Socket.IO 测试客户端，测量的是服务端分发的开销，不含网络传输
+    """
+    import random
+    import tempfile
+    import time
+
+    with tempfile.TemporaryDirectory() as tmp:
+        use_temp_storage(tmp)
+        import database
+        database.init_db()
+        import web_server
+
+        types = ("Text", "Image", "File")
+        devices = [f"device-{i}" for i in range(args.devices)]
+        views = [{}] + [{'type': t, 'device': d} for t in types for d in devices]
+        clients = []
+        for index in range(args.clients):
+            client = web_server.socketio.test_client(web_server.app)
+            client.emit('join', views[index % len(views)])
+            client.get_received()
+            clients.append(client)
+        rng = random.Random(0)
+        events = [{'id': i, 'type': rng.choice(types), 'device': rng.choice(devices)} for i in range(args.events)]
+        print(f"{args.clients} 个客户端，{len(views)} 种视图，突发 {args.events} 条新记录")
+
+        def per_event_to_all():
+            for event in events:
+                web_server.socketio.emit('history_update', {'root': None})
+
+        def per_event_by_view():
+            web_server.broadcaster.interval = 0
+            for event in events:
+                web_server.notify_history_update(None, event)
+
+        def coalesced_by_view():
+            web_server.broadcaster.interval = Config.BROADCAST_INTERVAL
+            for event in events:
+                web_server.notify_history_update(None, event)
+            web_server.broadcaster.flush()  # 不等定时器，直接发送合并后的消息
+
+        for name, run in (("逐条推送给所有人", per_event_to_all), ("按视图逐条推送", per_event_by_view),
+                          ("按视图合并推送", coalesced_by_view)):
+            began = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - began
+            received = sum(len(client.get_received()) for client in clients)
+            print(f"{name:10s} {elapsed * 1000:9.1f} ms，每个事件 {elapsed / len(events) * 1000:7.2f} ms，"
+                  f"客户端共收到 {received} 条消息（平均每个 {received / len(clients):.1f} 条）")
+        for client in clients:
+            client.disconnect()
+
+def cmd_scrub(args):
+    """立即执行一轮备份文件校验（从上次的进度继续），输出各状态的文件数"""
+    import time
+    from sqlmodel import Session
+    from database import get_engine
+    from scrubber import BackupScrubber, status_counts
+
+    scrubber = BackupScrubber(mb_per_sec=args.mb_per_sec, iops=args.iops)
+    began = time.perf_counter()
+    scrubber.run_pass()
+    with Session(get_engine()) as session:
+        counts = status_counts(session)
+    print(f"校验完成，耗时 {time.perf_counter() - began:.2f} 秒")
+    for status, count in sorted(counts.items()):
+        print(f"{status}: {count}")
+
+def cmd_export(args):
+    """流式导出历史记录到文件（默认输出到标准输出）"""
+    from export import export_stream
+
+    filters = {
+        'type': args.type,
+        'source': args.source,
+        'start_date': args.start_date,
+        'end_date': args.end_date,
+        'starred': args.starred,
+    }
+    chunks, _, _ = export_stream(args.format, filters)
+    out = open(args.out, 'wb') if args.out else sys.stdout.buffer
+    written = 0
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+            written += len(chunk)
+    finally:
+        if args.out:
+            out.close()
+    if args.out:
+        print(f"已导出到 {args.out}（{format_size(written)}）")
+
+def cmd_stats(args):
+    """输出统计汇总；--verify 与历史表逐项核对，--rebuild 由历史表重建"""
+    from sqlmodel import Session
+    from database import get_engine, history_stats, rebuild_rollups, verify_rollups
+
+    engine = get_engine()
+    if args.rebuild:
+        with engine.begin() as conn:
+            rebuild_rollups(conn)
+        print("已由历史表重建统计汇总")
+    if args.verify:
+        with engine.connect() as conn:
+            mismatches = verify_rollups(conn)
+        for key, stored, actual in mismatches:
+            print(f"不一致 {key}: 汇总 {stored}，实际 {actual}")
+        print(f"核对完成，{len(mismatches)} 项不一致")
+        if mismatches:
+            return 1
+    with Session(engine) as session:
+        stats = history_stats(session, {'root': args.root, 'start_date': args.start_date, 'end_date': args.end_date})
+    totals = stats['totals']
+    print(f"记录数: {totals['count']}（星标 {totals['starred']}），内容 {format_size(totals['bytes'])}")
+    for title, groups in (("按同步目录", stats['by_root']), ("按类型", stats['by_type']), ("按来源", stats['by_source'])):
+        print(title)
+        for key, values in sorted(groups.items(), key=lambda item: -item[1]['count']):
+            print(f"  {key or '(未知)'}: {values['count']}，{format_size(values['bytes'])}")
+
+def cmd_snapshot(args):
+    """立即生成一个数据库快照（服务运行时也可以执行）"""
+    from snapshot import take_snapshot
+
+    result = take_snapshot(pages=args.pages, pause=args.pause)
+    print(f"快照: {result['path']}")
+    print(f"数据库 {format_size(result['db_size'])}，压缩后 {format_size(result['size'])}，"
+          f"{result['steps']} 步，耗时 {result['seconds']:.2f} 秒")
+
+def cmd_restore(args):
+    """检查快照完整性并恢复（恢复前先停止 start.py）"""
+    from snapshot import list_snapshots, restore_snapshot
+
+    path = args.snapshot or (list_snapshots() or [None])[-1]
+    if not path:
+        print("没有可用的快照")
+        return 1
+    result = restore_snapshot(path, check_only=args.check)
+    if result['problems']:
+        print(f"快照未通过完整性检查，未恢复: {path}")
+        for problem in result['problems']:
+            print(f"  {problem}")
+        return 1
+    if args.check:
+        print(f"快照完整: {path}")
+        return 0
+    print(f"已从 {path} 恢复到 {result['db_path']}")
+    if result['previous']:
+        print(f"原数据库保留为 {result['previous']}")
+
+def cmd_render_backfill(args):
+    """为已有的文本记录生成渲染缓存"""
+    from renderer import get_render_pool
+
+    pool = get_render_pool()
+    count = pool.backfill(args.limit)
+    pool.executor.shutdown(wait=True)
+    print(f"已渲染 {count} 条文本记录")
+
+def cmd_pack(args):
+    """把较早的小备份文件打包；--cleanup 只清理中断留下的已打包原文件"""
+    from packfile import Packer
+
+    packer = Packer()
+    removed = packer.remove_leftovers()
+    if removed:
+        print(f"清理了 {removed} 个已打包的原文件")
+    if args.cleanup:
+        return 0
+    print(f"已打包 {packer.run_once(args.limit)} 个备份文件")
+
+def cmd_archive(args):
+    """归档旧月份到只读分区；--list 列出已有分区，--dry-run 只列出可以归档的月份"""
+    from archive import archivable_months, archive_month, list_partition_rows
+
+    if args.list:
+        for partition in list_partition_rows():
+            print(f"{partition.month}: {partition.count} 条，{format_size(partition.size)}  {partition.path}")
+        return 0
+    months = archivable_months(before=args.before or None)
+    if args.month:
+        months = [(month, count) for month, count in months if month == args.month]
+    if args.dry_run or not months:
+        for month, count in months:
+            print(f"{month}: {count} 条可归档")
+        if not months:
+            print("没有可以归档的月份")
+        return 0
+    for month, _ in months:
+        result = archive_month(month)
+        if result['path']:
+            print(f"{month}: 归档 {result['count']} 条，{format_size(result['size'])}，"
+                  f"耗时 {result['seconds']:.2f} 秒  {result['path']}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SyncClipboard 历史记录维护工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("compact-report", help="报告精简 raw_content 与压缩大文本前后的数据库大小")
+    p.add_argument("--db", default=Config.DB_PATH, help="数据库文件（只读取，在副本上操作）")
+    p.set_defaults(func=cmd_compact_report)
+
+    p = sub.add_parser("bench-ingest", help="对比逐条提交与组提交的写入吞吐")
+    p.add_argument("--items", type=int, default=2000, help="突发写入条数")
+    p.add_argument("--threads", type=int, default=8, help="并发提交线程数")
+    p.set_defaults(func=cmd_bench_ingest)
+
+    p = sub.add_parser("bench-download", help="测量直接服务下载的吞吐和 CPU 占用")
+    p.add_argument("--size-mb", type=int, default=256, help="测试文件大小（MB）")
+    p.add_argument("--rounds", type=int, default=3, help="下载次数")
+    p.add_argument("--port", type=int, default=5055, help="测试服务端口")
+    p.set_defaults(func=cmd_bench_download)
+
+    p = sub.add_parser("bench-broadcast", help="大量客户端连接时，对比逐条推送与按视图合并推送的开销")
+    p.add_argument("--clients", type=int, default=2000, help="连接的客户端数")
+    p.add_argument("--events", type=int, default=50, help="突发的新记录数")
+    p.add_argument("--devices", type=int, default=5, help="来源设备数（客户端按类型与设备分成不同视图）")
+    p.set_defaults(func=cmd_bench_broadcast)
+
+    p = sub.add_parser("scrub", help="立即校验备份文件与校验和是否一致")
+    p.add_argument("--mb-per-sec", type=float, default=0, help="读取速度上限（MB/s），默认不限")
+    p.add_argument("--iops", type=float, default=0, help="每秒 IO 次数上限，默认不限")
+    p.set_defaults(func=cmd_scrub)
+
+    p = sub.add_parser("export", help="流式导出历史记录（NDJSON / CSV / 带备份文件的 ZIP）")
+    p.add_argument("--format", choices=["ndjson", "csv", "zip"], default="ndjson", help="导出格式")
+    p.add_argument("--out", help="输出文件，默认输出到标准输出")
+    p.add_argument("--type", default="", help="只导出该类型（Text / Image / File / Group）")
+    p.add_argument("--source", default="", help="只导出该来源设备")
+    p.add_argument("--start-date", default="", help="开始日期 YYYY-MM-DD（含）")
+    p.add_argument("--end-date", default="", help="结束日期 YYYY-MM-DD（含）")
+    p.add_argument("--starred", action="store_true", help="只导出星标记录")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("stats", help="统计记录数与内容大小（来自统计汇总表）")
+    p.add_argument("--start-date", default="", help="开始日期 YYYY-MM-DD（含）")
+    p.add_argument("--end-date", default="", help="结束日期 YYYY-MM-DD（含）")
+    p.add_argument("--root", default="", help="只统计一个同步目录（根目录ID）")
+    p.add_argument("--verify", action="store_true", help="与历史表逐项核对汇总是否准确")
+    p.add_argument("--rebuild", action="store_true", help="由历史表重建汇总")
+    p.set_defaults(func=cmd_stats)
+
+    p = sub.add_parser("snapshot", help="在线生成数据库快照（不需要停止服务）")
+    p.add_argument("--pages", type=int, default=None, help="每步复制的页数，默认 Config.SNAPSHOT_PAGES")
+    p.add_argument("--pause", type=float, default=None, help="每步之间暂停的秒数，默认 Config.SNAPSHOT_PAUSE")
+    p.set_defaults(func=cmd_snapshot)
+
+    p = sub.add_parser("restore", help="检查快照完整性后恢复数据库（需先停止服务）")
+    p.add_argument("snapshot", nargs="?", help="快照文件，默认最新的一个")
+    p.add_argument("--check", action="store_true", help="只检查完整性，不恢复")
+    p.set_defaults(func=cmd_restore)
+
+    p = sub.add_parser("render-backfill", help="为已有的文本记录生成渲染缓存（代码高亮、JSON、Markdown、链接）")
+    p.add_argument("--limit", type=int, default=None, help="最多处理的条数（从最新的开始）")
+    p.set_defaults(func=cmd_render_backfill)
+
+    p = sub.add_parser("pack", help="把较早的小备份文件合并进打包文件")
+    p.add_argument("--limit", type=int, default=None, help="最多打包的文件数")
+    p.add_argument("--cleanup", action="store_true", help="只清理中断留下的已打包原文件")
+    p.set_defaults(func=cmd_pack)
+
+    p = sub.add_parser("archive", help="把旧月份的记录移入只读的按月分区文件")
+    p.add_argument("--before", default="", help="只归档早于该月份 YYYY-MM 的记录，默认按 Config.ARCHIVE_AFTER_MONTHS")
+    p.add_argument("--month", default="", help="只归档这一个月份 YYYY-MM")
+    p.add_argument("--dry-run", action="store_true", help="只列出可以归档的月份与条数")
+    p.add_argument("--list", action="store_true", help="列出已有的分区")
+    p.set_defaults(func=cmd_archive)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
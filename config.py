@@ -7,20 +7,110 @@ class Config:
     # JSON 文件路径
     SYNC_CLIPBOARD_JSON_FILE = "SyncClipboard.json" # 同步文件名
     SYNC_CLIPBOARD_JSON_PATH = os.path.join(BASE_DIR, SYNC_CLIPBOARD_JSON_FILE) # 主同步文件路径
+    # 多个同步目录：{根目录ID: 同步目录}，一个进程同时监控（见 sync_roots.py）；为空时只监控上面的目录，ID 为 "default"
+    # 例如 {"default": BASE_DIR, "alice": "/srv/sync/alice"}；原来的目录请保留 "default"，已有记录都属于它
+    SYNC_ROOTS = {}
     
 
     # 数据库配置
     DB_PATH = os.path.join(BASE_DIR, "db", "clipboard_history.db")
     DB_LOG_ENABLED = True  # 是否启用数据库日志
+    TEXT_DEDUP_WINDOW = 24 * 60 * 60  # 文本去重窗口（秒）：窗口内重复复制只累加次数（时间、来源设备取最近一次），0 为不去重
+    TEXT_COMPRESS_THRESHOLD = 4096  # 文本超过该字节数时压缩存储
+    TEXT_COMPRESS_LEVEL = 6  # zlib 压缩级别（1-9）
+    TEXT_PREVIEW_CHARS = 500  # 列表中文本预览的最多字符数，完整内容按需读取（/api/history/<id>/content）
+    WRITER_QUEUE_SIZE = 1000  # 写线程队列长度，满时提交方阻塞
+    WRITER_BATCH_SIZE = 200  # 一次组提交最多包含的操作数
+    WRITER_MAX_DELAY_MS = 0  # 凑批最多等待的毫秒数；0 表示只合并已在排队的操作，不增加单条延迟
+    PIPELINE_WORKERS = {"detect": 1, "parse": 1, "link": 2, "commit": 1, "notify": 1}  # 写入流水线各阶段线程数
+    PIPELINE_QUEUE_SIZE = 256  # 写入流水线每个工作线程的队列长度
+    EXPORT_BATCH_SIZE = 500  # 导出时每批从数据库取出的记录数
+    EXPORT_CHUNK_SIZE = 1024 * 1024  # 导出输出块大小（字节），也是读取备份文件的块大小
+
+    # 服务监管配置（见 supervisor.py）
+    SUPERVISOR_HEALTH_INTERVAL = 5  # 健康检查间隔（秒）
+    SUPERVISOR_UNHEALTHY_LIMIT = 3  # 连续几次检查不健康后重启该服务
+    SUPERVISOR_BACKOFF_MIN = 1.0  # 崩溃后第一次重启前等待的秒数，之后每次加倍
+    SUPERVISOR_BACKOFF_MAX = 60.0  # 重启等待的最长秒数
+    SUPERVISOR_STABLE_SECONDS = 60  # 运行超过这么久再崩溃时，重启等待从最短开始
+    SHUTDOWN_DEADLINE = 10.0  # 退出时等待已接收的写入排空的最长秒数
+
+    # 文件监控配置
+    WATCH_MODE = "auto"  # inotify / polling / auto（网络文件系统上自动改用轮询）
+    NETWORK_FS_TYPES = ("nfs", "nfs4", "cifs", "smb3", "smbfs", "9p", "ceph", "glusterfs", "afs")  # 视为网络文件系统的类型（fuse.* 也算）
+    POLL_MIN_INTERVAL = 0.1  # 轮询最短间隔（秒），检测到变化后恢复到该间隔
+    POLL_MAX_INTERVAL = 2.0  # 轮询最长间隔（秒），空闲时逐步退避到该间隔
+    POLL_BACKOFF = 1.5  # 每次空闲轮询后间隔乘以该系数
+    FILE_SETTLE_SECONDS = 0.5  # file/ 下的文件多久没有再变化才认为写完，开始计算校验和并备份
 
     # 备份配置
     BACKUP_DIR_FOLDER = "backup"  # 当前文件夹下，备份文件夹名称
 
     BACKUP_DIR = os.path.join(BASE_DIR, BACKUP_DIR_FOLDER)
     
+    # WebDAV 配置（内置同步服务，SyncClipboard 服务器地址填 http://<主机>:<端口>/dav）
+    WEBDAV_ENABLED = False  # 是否提供内置 WebDAV 服务（需同时设置用户名和密码，否则不会启用）
+    WEBDAV_PREFIX = "/dav"  # WebDAV 路径前缀
+    WEBDAV_USERNAME = ""  # 用户名（HTTP Basic 认证）
+    WEBDAV_PASSWORD = ""  # 密码
+    WEBDAV_CHUNK_SIZE = 1024 * 1024  # 接收上传时每次读取的字节数
+
+    # 备份校验配置
+    SCRUB_ENABLED = True  # 是否在后台定期校验备份文件
+    SCRUB_MB_PER_SEC = 20  # 校验读取速度上限（MB/s），0 为不限
+    SCRUB_IOPS = 50  # 校验每秒 IO 次数上限，0 为不限
+    SCRUB_BATCH_SIZE = 50  # 每块校验的文件数（每块提交一次进度）
+    SCRUB_CHUNK_SIZE = 1024 * 1024  # 每次读取的字节数
+    SCRUB_PASS_INTERVAL = 24 * 60 * 60  # 一轮校验完成后，隔多久（秒）开始下一轮
+
+    # 备份打包配置（较早的小备份文件合并进追加写入的打包文件，见 packfile.py）
+    PACK_ENABLED = True  # 是否定期打包
+    PACK_DIR = os.path.join(BASE_DIR, "packs")  # 打包文件目录（不放在备份目录下：文件夹大小监控只按单个文件删除，打包文件不能参与）
+    PACK_MAX_BLOB_BYTES = 256 * 1024  # 不超过该字节数的备份文件才打包
+    PACK_MIN_AGE = 7 * 24 * 60 * 60  # 备份文件修改后至少过了这么久（秒）才打包
+    PACK_MAX_BYTES = 256 * 1024 * 1024  # 打包文件达到该字节数后不再追加，开始新的打包文件
+    PACK_BATCH_SIZE = 500  # 每批打包的文件数（每批 fsync 并提交一次）
+    PACK_INTERVAL = 60 * 60  # 后台打包间隔（秒）
+
+    # 文本渲染缓存配置（代码高亮、JSON、Markdown、链接，写入后在后台预先渲染）
+    RENDER_WORKERS = 2  # 后台渲染线程数
+    RENDER_CACHE_MAX_BYTES = 64 * 1024 * 1024  # 渲染缓存总大小上限，超过时淘汰最早生成的
+    RENDER_MAX_BYTES = 512 * 1024  # 超过该字节数的文本不渲染（按纯文本显示）
+    RENDER_GUESS_BYTES = 8 * 1024  # 识别代码语言时只分析开头的字节数
+    RENDER_MIN_CONFIDENCE = 0.3  # 代码语言识别的最低可信度（Pygments analyse_text 得分）
+    RENDER_STYLE = "default"  # Pygments 配色
+
+    # 数据库快照配置（在线备份，不需要停止服务）
+    SNAPSHOT_ENABLED = True  # 是否定期生成数据库快照
+    SNAPSHOT_DIR = os.path.join(BASE_DIR, "db", "snapshots")  # 快照目录（gzip 压缩）
+    SNAPSHOT_INTERVAL = 6 * 60 * 60  # 快照间隔（秒）
+    SNAPSHOT_KEEP = 7  # 保留最近的快照数
+    SNAPSHOT_PAGES = 256  # 每步复制的数据库页数
+    SNAPSHOT_PAUSE = 0.005  # 每步之间让出的秒数，让写入和查询继续进行
+
+    # 历史归档配置（旧月份移入只读的按月分区文件，见 archive.py）
+    ARCHIVE_ENABLED = True  # 是否定期归档旧月份
+    ARCHIVE_DIR = os.path.join(BASE_DIR, "db", "archive")  # 分区文件目录（不在快照中，需单独备份）
+    ARCHIVE_AFTER_MONTHS = 3  # 主表保留最近几个月（含当月）
+    ARCHIVE_MIN_ROWS = 100  # 可归档记录少于该条数的月份暂不归档，避免产生很多小文件
+    ARCHIVE_INTERVAL = 24 * 60 * 60  # 归档检查间隔（秒）
+
     # 网页配置
     TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
     STATIC_DIR = os.path.join(BASE_DIR, "static")
+    WEB_HOST = "0.0.0.0"  # 监听地址
+    WEB_PORT = 5000  # 监听端口
+    HISTORY_PAGE_SIZE = 30  # 主页每页条数（首页随页面直出）
+    DOWNLOAD_OFFLOAD = ""  # 下载发送方式: "" / "x-accel-redirect" / "x-sendfile"，见 file_serving.py
+    DOWNLOAD_ACCEL_PREFIX = "/_backup/"  # x-accel-redirect 模式下 nginx internal location 的前缀
+    DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # 读取打包文件发送下载时每块的最大字节数
+    STARTUP_BUDGET_SECONDS = 3.0  # 启动预算：从冷启动到首个请求成功返回的最长时间（秒）
+    BULK_MAX_IDS = 1000  # 按ID批量获取、批量操作时一次最多的记录数
+    BROADCAST_INTERVAL = 0.5  # 推送合并间隔（秒）：期间的新记录与变更合并成每个视图一条消息，0 为立即推送
+    BROADCAST_MAX_IDS = 200  # 一条 history_update 消息中最多带的新记录ID数（超过时网页按 count 重新加载）
+    # 监控服务连接 Socket.IO 时的口令，只有带了口令的连接能报告新记录；单独运行监控服务（history_service.py）时
+    # 两边设为相同的值，留空时每次启动随机生成（只有同一进程内的监控能通过）
+    MONITOR_TOKEN = ""
     
     # 历史文件删除配置
     MAX_FOLDER_SIZE = "1G"  # 支持的单位: B, K, KB, M, MB, G, GB (不区分大小写)
@@ -39,4 +129,5 @@ if __name__ == "__main__":
     print("监控文件夹:", Config.FOLDER_TO_MONITOR)
     print("最大文件夹大小:", Config.MAX_FOLDER_SIZE)
     print("检查间隔:", Config.CHECK_INTERVAL, "秒")
+    print("Web 端口:", Config.WEB_PORT)
     print("配置加载成功")
\ No newline at end of file
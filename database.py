@@ -1,14 +1,41 @@
 
 import os
-from sqlalchemy import DateTime, Text, delete, func
+from sqlalchemy import DateTime, LargeBinary, Text, Index, delete, event, func, text, tuple_
+from sqlalchemy.orm import defer
 from sqlmodel import SQLModel, create_engine, Session, Field, Column, ForeignKey, select, UniqueConstraint
 from typing import Optional
-from datetime import datetime
+from datetime import datetime, timezone
 from config import Config
+from metrics import metrics
+from sync_roots import DEFAULT_ROOT, files_dir
 import shutil
 import uuid as uuid_lib
 import hashlib
 import json
+import heapq
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import quote
+
+def now_ms() -> int:
+    """当前 UTC 时间的毫秒时间戳（用于排序和范围查询）"""
+    return int(time.time() * 1000)
+
+def ms_to_str(ts: int) -> str:
+    """毫秒时间戳转为展示用的时间字符串（UTC）"""
+    return datetime.fromtimestamp(ts / 1000, tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def date_to_ms(date_str: str) -> int:
+    """'YYYY-MM-DD' 转为当天 0 点（UTC）的毫秒时间戳"""
+    return int(datetime.strptime(date_str, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+def ms_to_day(ts: int) -> str:
+    """毫秒时间戳所在的日期 'YYYY-MM-DD'（UTC，与日期筛选一致）"""
+    return datetime.fromtimestamp(ts / 1000, tz=timezone.utc).strftime('%Y-%m-%d')
+
+DAY_MS = 24 * 60 * 60 * 1000
 
 class BaseTable(SQLModel):
     """所有数据库表的基础模型（非表模型，仅用于继承）"""
@@ -24,7 +51,7 @@ class ClipboardHistory(BaseTable, table=True):
     # __tablename__ = "ClipboardHistory"  # 显式指定表名
     raw_content: str = Field(
         sa_column=Column(Text), # 将 raw_content 定义为 TEXT 类型（适合存储长文本）
-        description="原始JSON内容"
+        description="原始JSON中未单独成列的字段（如 File），完整内容见 full_raw_content()"
     )
     uuid: str = Field(
         default_factory=lambda: str(uuid_lib.uuid4()),  # 自动生成UUID
@@ -32,7 +59,7 @@ class ClipboardHistory(BaseTable, table=True):
         unique=True,
         description="全局唯一标识符"
     )
-    clipboard: str = Field(description="剪贴板内容")
+    clipboard: str = Field(description="剪贴板内容（大文本压缩后存入 body，此列为空）")
     type: str = Field(nullable=False, description="记录类型: Text/Image/File")
     from_equipment: Optional[str] = Field(
         default=None, 
@@ -45,17 +72,49 @@ class ClipboardHistory(BaseTable, table=True):
     timestamp: datetime = Field(
         default_factory=datetime.utcnow,  # 自动设置当前时间
         sa_column=Column(DateTime(timezone=True)),
-        description="记录时间"
+        description="首次记录时间"
     )
     checksum: Optional[str] = Field(
         default=None,
         description="文件内容的MD5校验和",
         index=True  # 创建索引加速查询
     )
-    
-    class Config:
-        # 为时间戳字段创建索引，优化按时间筛选的性能
-        indexes = [("timestamp_index", "timestamp")]
+    ts: int = Field(
+        default_factory=now_ms,
+        nullable=False,
+        description="排序用时间戳（UTC 毫秒，重复复制时更新为最后一次），列表与筛选都按 (ts, id) 倒序"
+    )
+    starred: bool = Field(default=False, nullable=False, description="是否星标")
+    content_hash: Optional[str] = Field(default=None, description="文本内容的MD5（仅 Text 类型，用于去重）")
+    occurrences: int = Field(default=1, nullable=False, description="去重窗口内重复复制的次数")
+    body: Optional[bytes] = Field(
+        default=None,
+        sa_column=Column(LargeBinary),
+        description="压缩后的大文本内容"
+    )
+    body_codec: Optional[str] = Field(default=None, description="body 的压缩方式（zlib），为空表示未压缩")
+    content_length: Optional[int] = Field(
+        default=None,
+        description="内容字节数：文本为 UTF-8 编码长度，文件为文件大小（文件还没到达时为空）"
+    )
+    root_id: str = Field(
+        default=DEFAULT_ROOT, nullable=False, sa_column_kwargs={"server_default": DEFAULT_ROOT},
+        description="所属同步目录（根目录）ID，见 sync_roots.py"
+    )
+    preview: Optional[str] = Field(
+        default=None,
+        description="文本开头最多 Config.TEXT_PREVIEW_CHARS 个字符，列表只返回它，完整内容按需读取"
+    )
+
+    # 组合索引：每种筛选条件都以 (ts, id) 结尾，既能定位又能直接按顺序分页
+    __table_args__ = (
+        Index("ix_history_ts", "ts", "id"),
+        Index("ix_history_type_ts", "type", "ts", "id"),
+        Index("ix_history_equipment_ts", "from_equipment", "ts", "id"),
+        Index("ix_history_starred_ts", "starred", "ts", "id"),
+        Index("ix_history_content_hash", "content_hash", "ts"),
+        Index("ix_history_root_ts", "root_id", "ts", "id"),
+    )
 
 # 备份文件表
 class BackupFile(BaseTable, table=True):
@@ -72,6 +131,30 @@ class BackupFile(BaseTable, table=True):
         description="备份文件绝对路径"
     )
     size: int = Field(description="文件大小(字节)")
+    status: str = Field(
+        default="unverified", nullable=False, sa_column_kwargs={"server_default": "unverified"},
+        description="校验状态：unverified / ok / corrupt（内容与校验和不符）/ missing（文件丢失）"
+    )
+    verified_at: Optional[int] = Field(default=None, description="最近一次校验的毫秒时间戳")
+    pack_id: Optional[int] = Field(default=None, description="所在打包文件的ID（backup_packs.id），未打包时为空")
+    pack_offset: Optional[int] = Field(default=None, description="内容在打包文件中的起始偏移")
+
+    __table_args__ = (
+        Index("ix_backup_files_status", "status"),
+        Index("ix_backup_files_pack", "pack_id", "size"),
+    )
+
+# 备份打包文件：较早的小备份文件合并进追加写入的打包文件（见 packfile.py），
+# size 是已提交的长度，之后的内容是中断的打包留下的，下次追加前截掉
+class BackupPack(SQLModel, table=True):
+
+    __tablename__ = "backup_packs"  # 显式指定表名
+    id: Optional[int] = Field(default=None, primary_key=True)
+    path: str = Field(nullable=False, description="打包文件绝对路径")
+    size: int = Field(default=0, nullable=False, description="已提交的字节数")
+    count: int = Field(default=0, nullable=False, description="打包的文件数")
+    sealed: bool = Field(default=False, nullable=False, description="已写满，不再追加")
+    created_at: int = Field(default_factory=now_ms, nullable=False, description="创建时间（毫秒时间戳）")
 
 # 收藏记录表
 class Favorite(BaseTable, table=True):
@@ -95,227 +178,1614 @@ class Favorite(BaseTable, table=True):
     # 唯一约束防止重复收藏（同一记录不能在同一个收藏夹收藏多次）
     __table_args__ = (
         UniqueConstraint('history_uuid', 'folder_id', name='_favorite_unique'),
+        Index("ix_favorites_folder", "folder_id", "id"),
     )
 
 # 收藏夹表
 class Folder(BaseTable, table=True):
 
     name: str = Field(nullable=False, description="收藏夹名称")
-    parent_id: int = Field(
-        default=0,
+    parent_id: Optional[int] = Field(
+        default=None,
         foreign_key="folder.id",  # 自引用外键，实现多级结构
-        description="父收藏夹ID（0为根）"
+        description="父收藏夹ID（根收藏夹为空）"
     )
     path: Optional[str] = Field(
         default=None, 
         description="完整路径（如/a/b/）"
     )
+    item_count: int = Field(
+        default=0, nullable=False, sa_column_kwargs={"server_default": "0"},
+        description="直接收藏在本收藏夹的条目数"
+    )
+    total_count: int = Field(
+        default=0, nullable=False, sa_column_kwargs={"server_default": "0"},
+        description="本收藏夹及所有子收藏夹的条目总数"
+    )
 
-def init_db(): # 初始化数据库
-    # 确保数据库目录存在
-    db_dir = os.path.dirname(Config.DB_PATH) # 获取父目录
-    if not os.path.exists(db_dir):
-        os.makedirs(db_dir, exist_ok=True)  # 递归创建目录
-        print(f"Created database directory: {db_dir}")
-    
-    # 确保备份目录存在
-    bkp_dir =Config.BACKUP_DIR
-    if not os.path.exists(bkp_dir):
-        os.makedirs(bkp_dir, exist_ok=True)  # 递归创建目录
-        print(f"Created database directory: {bkp_dir}")
+# 收藏夹闭包表：每对 (祖先, 后代) 一行（包含自身，depth=0），子树查询与移动都只需一条索引查询
+class FolderClosure(SQLModel, table=True):
+
+    __tablename__ = "folder_closure"  # 显式指定表名
+    ancestor_id: int = Field(primary_key=True, foreign_key="folder.id", description="祖先收藏夹ID")
+    descendant_id: int = Field(primary_key=True, foreign_key="folder.id", description="后代收藏夹ID")
+    depth: int = Field(nullable=False, description="层级差（自身为0）")
+
+    __table_args__ = (
+        Index("ix_folder_closure_descendant", "descendant_id", "depth"),
+    )
 
+# 备份校验进度（单行）：校验按ID分块进行，重启后从上次的位置继续
+class ScrubState(SQLModel, table=True):
 
-    db_exists = os.path.exists(Config.DB_PATH)
+    __tablename__ = "scrub_state"  # 显式指定表名
+    id: int = Field(default=1, primary_key=True)
+    last_id: int = Field(default=0, nullable=False, description="本轮已校验到的 backup_files.id")
+    pass_started_at: Optional[int] = Field(default=None, description="本轮开始的毫秒时间戳")
+    passes: int = Field(default=0, nullable=False, description="已完成的轮数")
 
-    # 创建SQLite数据库引擎
-    # echo=True 参数启用SQL日志（生产环境应设为False）
-    sqlite_url = f"sqlite:///{Config.DB_PATH}"  # 数据库连接地址
-    engine = create_engine(sqlite_url, echo=Config.DB_LOG_ENABLED)  # 创建引擎
-    
-    # 创建所有表（如果不存在）
-    SQLModel.metadata.create_all(engine)
-    
-    # 初始化收藏夹根目录（仅当首次创建数据库时）
-    if not db_exists:
+# 等待文件到达的记录：SyncClipboard.json 先于 file/ 中的文件到达时登记，文件落地后补上备份
+class PendingFile(SQLModel, table=True):
+
+    __tablename__ = "pending_files"  # 显式指定表名
+    id: Optional[int] = Field(default=None, primary_key=True)
+    history_id: int = Field(foreign_key="clipboardhistory.id", nullable=False, description="等待文件的历史记录ID")
+    file_name: str = Field(nullable=False, description="file/ 中的文件名")
+    checksum: Optional[str] = Field(default=None, description="JSON 中给出的校验和（Group 类型要等文件到达后才能计算）")
+    ts: int = Field(default_factory=now_ms, nullable=False, description="登记时间（毫秒时间戳）")
+    root_id: str = Field(
+        default=DEFAULT_ROOT, nullable=False, sa_column_kwargs={"server_default": DEFAULT_ROOT},
+        description="文件所在的同步目录（根目录）ID"
+    )
+
+    __table_args__ = (
+        Index("ix_pending_files_name", "file_name"),
+    )
+
+# 统计汇总表：按 (根目录, 日期, 来源设备, 类型) 累计条数、字节数与星标数，
+# 与历史记录的写入、删除、星标变化在同一事务中更新，统计和筛选计数都不用扫描历史表
+class HistoryRollup(SQLModel, table=True):
+
+    __tablename__ = "history_rollup"  # 显式指定表名
+    root_id: str = Field(default=DEFAULT_ROOT, primary_key=True, description="同步目录（根目录）ID")
+    day: str = Field(primary_key=True, description="UTC 日期 YYYY-MM-DD")
+    from_equipment: str = Field(default="", primary_key=True, description="来源设备（未知为空字符串）")
+    type: str = Field(primary_key=True, description="记录类型")
+    count: int = Field(default=0, nullable=False, description="记录数")
+    bytes: int = Field(default=0, nullable=False, description="内容字节数合计")
+    starred_count: int = Field(default=0, nullable=False, description="星标记录数")
+
+# 文本渲染缓存：按内容哈希保存预先渲染好的 HTML 片段（代码高亮、JSON、Markdown、链接），
+# 总大小超过 Config.RENDER_CACHE_MAX_BYTES 时从最早生成的开始淘汰（见 renderer.py）
+class RenderCache(SQLModel, table=True):
+
+    __tablename__ = "render_cache"  # 显式指定表名
+    content_hash: str = Field(primary_key=True, description="文本内容的MD5（与 clipboardhistory.content_hash 相同）")
+    kind: str = Field(nullable=False, description="分类：code / json / markdown / url / plain")
+    language: Optional[str] = Field(default=None, description="代码语言（Pygments 词法分析器名称）")
+    html: str = Field(default="", sa_column=Column(Text, nullable=False), description="渲染好的 HTML 片段（内容已转义）")
+    size: int = Field(default=0, nullable=False, description="html 的字节数")
+    created_at: int = Field(default_factory=now_ms, nullable=False, description="生成时间（毫秒时间戳）")
+
+    __table_args__ = (
+        Index("ix_render_cache_created", "created_at"),
+    )
+
+# 历史分区目录：早于 Config.ARCHIVE_AFTER_MONTHS 个月的记录按月移入只读的分区文件（见 archive.py），
+# 主表只保留近期数据与星标/收藏的记录；查询时按时间范围与游标只读取需要的分区
+class HistoryPartition(SQLModel, table=True):
+
+    __tablename__ = "history_partition"  # 显式指定表名
+    id: Optional[int] = Field(default=None, primary_key=True)
+    month: str = Field(nullable=False, description="分区月份 YYYY-MM（UTC）；同一月份可以分几次归档")
+    path: str = Field(nullable=False, description="分区文件绝对路径")
+    min_ts: int = Field(nullable=False, description="分区内最早记录的 ts")
+    max_ts: int = Field(nullable=False, description="分区内最晚记录的 ts")
+    min_id: int = Field(nullable=False, description="分区内最小的记录ID")
+    max_id: int = Field(nullable=False, description="分区内最大的记录ID")
+    count: int = Field(nullable=False, description="记录数")
+    size: int = Field(nullable=False, description="分区文件字节数")
+    created_at: int = Field(default_factory=now_ms, nullable=False, description="归档时间（毫秒时间戳）")
+
+    __table_args__ = (
+        Index("ix_history_partition_ts", "max_ts", "min_ts"),
+    )
+
+# 数据库结构版本表（记录已执行的迁移）
+class SchemaVersion(SQLModel, table=True):
+
+    __tablename__ = "schema_version"  # 显式指定表名
+    version: int = Field(primary_key=True, description="迁移版本号")
+    name: str = Field(nullable=False, description="迁移说明")
+    applied_at: datetime = Field(
+        default_factory=datetime.utcnow,
+        sa_column=Column(DateTime(timezone=True)),
+        description="执行时间"
+    )
+
+###################
+## 数据库迁移
+###################
+
+def _column_exists(conn, table: str, column: str) -> bool:
+    """检查表中是否已存在某列（旧库升级与新库建表共用同一套迁移）"""
+    rows = conn.exec_driver_sql(f"PRAGMA table_info({table})").fetchall()
+    return any(row[1] == column for row in rows)
+
+def _add_column_if_missing(conn, table: str, column: str, ddl: str):
+    """列不存在时才添加，保证迁移可重复执行"""
+    if not _column_exists(conn, table, column):
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+# 迁移 1 的表结构（第一个版本发布时的样子）。不能用当前模型 create_all：
+# 否则新库与旧库在迁移 1 之后就不一样了，后面的迁移在旧库上会用到还不存在的列
+_V1_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS clipboardhistory (id INTEGER NOT NULL, raw_content TEXT, uuid VARCHAR NOT NULL, "
+    "clipboard VARCHAR NOT NULL, type VARCHAR NOT NULL, from_equipment VARCHAR, tag VARCHAR, timestamp DATETIME, "
+    "checksum VARCHAR, PRIMARY KEY (id), UNIQUE (uuid))",
+    "CREATE INDEX IF NOT EXISTS ix_clipboardhistory_checksum ON clipboardhistory (checksum)",
+    "CREATE TABLE IF NOT EXISTS backup_files (id INTEGER NOT NULL, checksum VARCHAR NOT NULL, "
+    "filepath VARCHAR NOT NULL, size INTEGER NOT NULL, PRIMARY KEY (id))",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_backup_files_checksum ON backup_files (checksum)",
+    "CREATE TABLE IF NOT EXISTS folder (id INTEGER NOT NULL, name VARCHAR NOT NULL, parent_id INTEGER, "
+    "path VARCHAR, PRIMARY KEY (id), FOREIGN KEY(parent_id) REFERENCES folder (id))",
+    "CREATE TABLE IF NOT EXISTS favorites (id INTEGER NOT NULL, history_uuid VARCHAR NOT NULL, "
+    "folder_id INTEGER NOT NULL, created_at DATETIME, PRIMARY KEY (id), "
+    "CONSTRAINT _favorite_unique UNIQUE (history_uuid, folder_id), "
+    "FOREIGN KEY(history_uuid) REFERENCES clipboardhistory (uuid), FOREIGN KEY(folder_id) REFERENCES folder (id))",
+)
+
+def _migration_001_initial(conn):
+    """建立基础表结构，并初始化收藏夹根目录"""
+    for statement in _V1_SCHEMA:
+        conn.exec_driver_sql(statement)
+    # 旧版本建表时 parent_id 为 NOT NULL，根收藏夹无法写入，需要按新结构重建 folder 表
+    columns = conn.exec_driver_sql("PRAGMA table_info(folder)").fetchall()
+    if any(col[1] == "parent_id" and col[3] for col in columns):
+        # 先建新表再改名（而不是先改旧表名），这样 favorites 等表对 folder 的外键引用保持不变
+        conn.exec_driver_sql(
+            "CREATE TABLE folder_new (id INTEGER NOT NULL, name VARCHAR NOT NULL, parent_id INTEGER, "
+            "path VARCHAR, PRIMARY KEY (id), FOREIGN KEY(parent_id) REFERENCES folder (id))"
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO folder_new (id, name, parent_id, path) "
+            "SELECT id, name, NULLIF(parent_id, 0), path FROM folder"
+        )
+        conn.exec_driver_sql("DROP TABLE folder")
+        conn.exec_driver_sql("ALTER TABLE folder_new RENAME TO folder")
+    root = conn.exec_driver_sql("SELECT id FROM folder WHERE parent_id IS NULL LIMIT 1").first()
+    if root is None:
+        # 使用 None 而不是 0 作为外键，避免约束报错；路径格式为 /ID/，例如 /1/
+        result = conn.exec_driver_sql("INSERT INTO folder (name, parent_id, path) VALUES ('Root', NULL, '/')")
+        root_id = result.lastrowid
+        conn.exec_driver_sql("UPDATE folder SET path = ? WHERE id = ?", (f"/{root_id}/", root_id))
+
+def _create_index(conn, name: str, table: str, columns: str):
+    """补建索引（旧库 create_all 不会给已有表加索引）；名称与模型 __table_args__ 保持一致"""
+    conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+
+def _migration_002_history_ts(conn):
+    """增加数值时间戳与星标列，回填旧数据，并建立筛选用组合索引"""
+    _add_column_if_missing(conn, "clipboardhistory", "ts", "INTEGER NOT NULL DEFAULT 0")
+    _add_column_if_missing(conn, "clipboardhistory", "starred", "BOOLEAN NOT NULL DEFAULT 0")
+    conn.exec_driver_sql(
+        "UPDATE clipboardhistory "
+        "SET ts = CAST((julianday(timestamp) - 2440587.5) * 86400000 AS INTEGER) "
+        "WHERE ts = 0 AND timestamp IS NOT NULL"
+    )
+    _create_index(conn, "ix_history_ts", "clipboardhistory", "ts, id")
+    _create_index(conn, "ix_history_type_ts", "clipboardhistory", "type, ts, id")
+    _create_index(conn, "ix_history_equipment_ts", "clipboardhistory", "from_equipment, ts, id")
+    _create_index(conn, "ix_history_starred_ts", "clipboardhistory", "starred, ts, id")
+
+def text_hash(text: str) -> str:
+    """文本内容的去重哈希"""
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+# SyncClipboard.json 中已经单独成列的字段，raw_content 中不再重复保存
+RAW_COLUMN_FIELDS = {"Type": "type", "Clipboard": "clipboard", "From": "from_equipment", "Tag": "tag"}
+
+def compact_raw_content(data: dict) -> str:
+    """只保留未单独成列的字段"""
+    return json.dumps({k: v for k, v in data.items() if k not in RAW_COLUMN_FIELDS}, ensure_ascii=False)
+
+def pack_text(text: str) -> tuple:
+    """
+    超过阈值且压缩有收益的文本压缩存储
+    :return: (clipboard 列内容, body, body_codec)
+    """
+    encoded = text.encode("utf-8")
+    if len(encoded) > Config.TEXT_COMPRESS_THRESHOLD:
+        compressed = zlib.compress(encoded, Config.TEXT_COMPRESS_LEVEL)
+        if len(compressed) < len(encoded):
+            return "", compressed, "zlib"
+    return text, None, None
+
+def text_content(item) -> str:
+    """读取完整剪贴板内容，压缩存储的在这里才解压"""
+    if item.body_codec == "zlib":
+        return zlib.decompress(item.body).decode("utf-8")
+    return item.clipboard
+
+def text_preview(text: str) -> str:
+    """列表中显示的文本预览（开头 Config.TEXT_PREVIEW_CHARS 个字符）"""
+    return text[:Config.TEXT_PREVIEW_CHARS]
+
+def stored_preview(item) -> str:
+    """
+    记录的文本预览；没有预先保存的（迁移 13 之前生成的分区）由内容得到，
+    压缩存储的只解压开头（每个字符最多 4 字节）
+    """
+    if item.preview is not None:
+        return item.preview
+    if item.body_codec == "zlib":
+        head = zlib.decompressobj().decompress(item.body, Config.TEXT_PREVIEW_CHARS * 4)
+        return text_preview(head.decode("utf-8", errors="ignore"))
+    return text_preview(item.clipboard or "")
+
+def iter_text_bytes(clipboard: str, body: Optional[bytes], body_codec: Optional[str], start: int, end: int,
+                    chunk_size: int = 64 * 1024):
+    """
+    UTF-8 编码后完整内容的 [start, end) 字节，分块产出；
+    压缩存储的边解压边跳过 start 之前的部分，不把整个文本解压到内存
+    """
+    if body_codec != "zlib":
+        encoded = clipboard.encode("utf-8")
+        for offset in range(start, min(end, len(encoded)), chunk_size):
+            yield encoded[offset:min(offset + chunk_size, end)]
+        return
+    decompressor = zlib.decompressobj()
+    position = 0
+    pending = body
+    while position < end and (pending or not decompressor.eof):
+        chunk = decompressor.decompress(pending, chunk_size)
+        pending = decompressor.unconsumed_tail
+        if not chunk:
+            break
+        chunk_end = position + len(chunk)
+        if chunk_end > start:
+            yield chunk[max(0, start - position):min(len(chunk), end - position)]
+        position = chunk_end
+
+def full_raw_content(item) -> dict:
+    """由各列与 raw_content 还原完整的 SyncClipboard.json 内容"""
+    try:
+        data = json.loads(item.raw_content) if item.raw_content else {}
+    except json.JSONDecodeError:
+        data = {}
+    for key, column in RAW_COLUMN_FIELDS.items():
+        if key in data:
+            continue  # 旧数据（未精简）已包含该字段
+        value = text_content(item) if column == "clipboard" else getattr(item, column)
+        if value is not None:
+            data[key] = value
+    return data
+
+def _migration_003_text_dedup(conn):
+    """增加文本去重所需的内容哈希与重复次数，并为已有文本记录回填哈希"""
+    _add_column_if_missing(conn, "clipboardhistory", "content_hash", "VARCHAR")
+    _add_column_if_missing(conn, "clipboardhistory", "occurrences", "INTEGER NOT NULL DEFAULT 1")
+    rows = conn.exec_driver_sql(
+        "SELECT id, clipboard FROM clipboardhistory WHERE type = 'Text' AND content_hash IS NULL"
+    ).fetchall()
+    if rows:
+        conn.exec_driver_sql(
+            "UPDATE clipboardhistory SET content_hash = ? WHERE id = ?",
+            [(text_hash(clipboard or ""), row_id) for row_id, clipboard in rows]
+        )
+    _create_index(conn, "ix_history_content_hash", "clipboardhistory", "content_hash, ts")
+
+def compact_history_rows(conn, batch_size: int = 500) -> int:
+    """
+    精简旧记录：raw_content 去掉已成列的字段，大文本压缩存入 body。
+    按 id 分批处理，可重复执行，返回修改的行数
+    """
+    changed = 0
+    last_id = 0
+    while True:
+        rows = conn.exec_driver_sql(
+            "SELECT id, type, clipboard, raw_content, body_codec FROM clipboardhistory "
+            "WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            break
+        updates = []
+        for row_id, item_type, clipboard, raw_content, body_codec in rows:
+            last_id = row_id
+            try:
+                data = json.loads(raw_content) if raw_content else {}
+                new_raw = compact_raw_content(data) if isinstance(data, dict) else raw_content
+            except json.JSONDecodeError:
+                new_raw = raw_content
+            new_clipboard, body, codec = clipboard, None, body_codec
+            if item_type == "Text" and body_codec is None and clipboard:
+                new_clipboard, body, codec = pack_text(clipboard)
+            if new_raw != raw_content or codec != body_codec:
+                updates.append((new_raw, new_clipboard, body, codec, row_id))
+        if updates:
+            conn.exec_driver_sql(
+                "UPDATE clipboardhistory SET raw_content = ?, clipboard = ?, "
+                "body = COALESCE(?, body), body_codec = ? WHERE id = ?", updates
+            )
+            changed += len(updates)
+    return changed
+
+def _migration_004_compact_bodies(conn):
+    """raw_content 去重并压缩已有的大文本"""
+    _add_column_if_missing(conn, "clipboardhistory", "body", "BLOB")
+    _add_column_if_missing(conn, "clipboardhistory", "body_codec", "VARCHAR")
+    compact_history_rows(conn)
+
+def compaction_report(db_path: str) -> dict:
+    """
+    在数据库副本上执行迁移、精简与 VACUUM，报告前后大小（原文件不受影响）
+    """
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        copy_path = os.path.join(tmp, "report.db")
+        shutil.copy2(db_path, copy_path)
+        before = os.path.getsize(copy_path)
+        engine = create_engine(f"sqlite:///{copy_path}", echo=False)
+        version = run_migrations(engine)
+        with engine.begin() as conn:
+            changed = compact_history_rows(conn)
+            rows = conn.exec_driver_sql("SELECT COUNT(*) FROM clipboardhistory").scalar()
+            compressed = conn.exec_driver_sql(
+                "SELECT COUNT(*) FROM clipboardhistory WHERE body_codec IS NOT NULL"
+            ).scalar()
+        with engine.connect() as conn:
+            conn.exec_driver_sql("VACUUM")
+        engine.dispose()
+        after = os.path.getsize(copy_path)
+    return {
+        'schema_version': version,
+        'rows': rows,
+        'compressed_rows': compressed,
+        'changed_rows': changed,
+        'size_before': before,
+        'size_after': after,
+    }
+
+def _migration_005_folder_closure(conn):
+    """收藏夹闭包表与条目计数：由 parent_id 回填闭包关系，由 favorites 回填计数"""
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS folder_closure (ancestor_id INTEGER NOT NULL, descendant_id INTEGER NOT NULL, "
+        "depth INTEGER NOT NULL, PRIMARY KEY (ancestor_id, descendant_id), "
+        "FOREIGN KEY(ancestor_id) REFERENCES folder (id), FOREIGN KEY(descendant_id) REFERENCES folder (id))"
+    )
+    _create_index(conn, "ix_folder_closure_descendant", "folder_closure", "descendant_id, depth")
+    _create_index(conn, "ix_favorites_folder", "favorites", "folder_id, id")
+    _add_column_if_missing(conn, "folder", "item_count", "INTEGER NOT NULL DEFAULT 0")
+    _add_column_if_missing(conn, "folder", "total_count", "INTEGER NOT NULL DEFAULT 0")
+    conn.exec_driver_sql(
+        "INSERT OR IGNORE INTO folder_closure (ancestor_id, descendant_id, depth) "
+        "WITH RECURSIVE tree(ancestor_id, descendant_id, depth) AS ("
+        "  SELECT id, id, 0 FROM folder "
+        "  UNION ALL "
+        "  SELECT tree.ancestor_id, folder.id, tree.depth + 1 FROM tree JOIN folder ON folder.parent_id = tree.descendant_id"
+        ") SELECT ancestor_id, descendant_id, depth FROM tree"
+    )
+    conn.exec_driver_sql(
+        "UPDATE folder SET item_count = (SELECT COUNT(*) FROM favorites WHERE favorites.folder_id = folder.id)"
+    )
+    conn.exec_driver_sql(
+        "UPDATE folder SET total_count = (SELECT COALESCE(SUM(f.item_count), 0) FROM folder_closure c "
+        "JOIN folder f ON f.id = c.descendant_id WHERE c.ancestor_id = folder.id)"
+    )
+
+def _migration_006_backup_scrub(conn):
+    """备份文件校验状态与校验进度"""
+    _add_column_if_missing(conn, "backup_files", "status", "VARCHAR NOT NULL DEFAULT 'unverified'")
+    _add_column_if_missing(conn, "backup_files", "verified_at", "INTEGER")
+    _create_index(conn, "ix_backup_files_status", "backup_files", "status")
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS scrub_state (id INTEGER NOT NULL, last_id INTEGER NOT NULL, "
+        "pass_started_at INTEGER, passes INTEGER NOT NULL, PRIMARY KEY (id))"
+    )
+
+def _migration_007_pending_files(conn):
+    """等待文件到达的记录"""
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS pending_files (id INTEGER NOT NULL, history_id INTEGER NOT NULL, "
+        "file_name VARCHAR NOT NULL, checksum VARCHAR, ts INTEGER NOT NULL, PRIMARY KEY (id), "
+        "FOREIGN KEY(history_id) REFERENCES clipboardhistory (id))"
+    )
+    _create_index(conn, "ix_pending_files_name", "pending_files", "file_name")
+
+def _migration_008_history_rollup(conn):
+    """内容字节数与统计汇总表：回填已有记录的字节数，再由历史表重建汇总"""
+    _add_column_if_missing(conn, "clipboardhistory", "content_length", "INTEGER")
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS history_rollup (day VARCHAR NOT NULL, from_equipment VARCHAR NOT NULL, "
+        "type VARCHAR NOT NULL, count INTEGER NOT NULL, bytes INTEGER NOT NULL, starred_count INTEGER NOT NULL, "
+        "PRIMARY KEY (day, from_equipment, type))"
+    )
+    conn.exec_driver_sql(
+        "UPDATE clipboardhistory SET content_length = length(CAST(clipboard AS BLOB)) "
+        "WHERE type = 'Text' AND body_codec IS NULL AND content_length IS NULL"
+    )
+    # 压缩存储的大文本要解压才知道长度（数量不多）
+    rows = conn.exec_driver_sql(
+        "SELECT id, body FROM clipboardhistory WHERE body_codec = 'zlib' AND content_length IS NULL"
+    ).fetchall()
+    for row_id, body in rows:
+        conn.exec_driver_sql("UPDATE clipboardhistory SET content_length = ? WHERE id = ?",
+                             (len(zlib.decompress(body)), row_id))
+    conn.exec_driver_sql(
+        "UPDATE clipboardhistory SET content_length = "
+        "(SELECT size FROM backup_files WHERE backup_files.checksum = clipboardhistory.checksum) "
+        "WHERE checksum IS NOT NULL AND content_length IS NULL"
+    )
+    # 此时历史表还没有 root_id 列（迁移 10 才添加），按发布时的汇总结构（不含根目录）重建；迁移 10 再按根目录重建。
+    # 只有在迁移 10 之后重新执行时历史表才有 root_id
+    if _column_exists(conn, "clipboardhistory", "root_id") and _column_exists(conn, "history_rollup", "root_id"):
+        rebuild_rollups(conn)
+    else:
+        conn.exec_driver_sql("DELETE FROM history_rollup")
+        conn.exec_driver_sql(
+            "INSERT INTO history_rollup (day, from_equipment, type, count, bytes, starred_count) "
+            "SELECT strftime('%Y-%m-%d', ts / 1000, 'unixepoch'), COALESCE(from_equipment, ''), type, "
+            "COUNT(*), COALESCE(SUM(content_length), 0), COALESCE(SUM(starred), 0) "
+            "FROM clipboardhistory GROUP BY 1, 2, 3"
+        )
+
+def _migration_009_render_cache(conn):
+    """文本渲染缓存"""
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS render_cache (content_hash VARCHAR NOT NULL, kind VARCHAR NOT NULL, "
+        "language VARCHAR, html TEXT NOT NULL, size INTEGER NOT NULL, created_at INTEGER NOT NULL, "
+        "PRIMARY KEY (content_hash))"
+    )
+    _create_index(conn, "ix_render_cache_created", "render_cache", "created_at")
+
+def _migration_010_sync_roots(conn):
+    """多同步目录：历史记录与等待文件的记录增加根目录ID，汇总表按根目录重建"""
+    _add_column_if_missing(conn, "clipboardhistory", "root_id", f"VARCHAR NOT NULL DEFAULT '{DEFAULT_ROOT}'")
+    _add_column_if_missing(conn, "pending_files", "root_id", f"VARCHAR NOT NULL DEFAULT '{DEFAULT_ROOT}'")
+    _create_index(conn, "ix_history_root_ts", "clipboardhistory", "root_id, ts, id")
+    # 主键增加了一列，SQLite 不能修改主键，重建汇总表
+    conn.exec_driver_sql("DROP TABLE IF EXISTS history_rollup")
+    conn.exec_driver_sql(
+        "CREATE TABLE history_rollup (root_id VARCHAR NOT NULL, day VARCHAR NOT NULL, "
+        "from_equipment VARCHAR NOT NULL, type VARCHAR NOT NULL, count INTEGER NOT NULL, bytes INTEGER NOT NULL, "
+        "starred_count INTEGER NOT NULL, PRIMARY KEY (root_id, day, from_equipment, type))"
+    )
+    rebuild_rollups(conn)
+
+def _migration_011_history_partition(conn):
+    """历史分区目录"""
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS history_partition (id INTEGER NOT NULL, month VARCHAR NOT NULL, "
+        "path VARCHAR NOT NULL, min_ts INTEGER NOT NULL, max_ts INTEGER NOT NULL, min_id INTEGER NOT NULL, "
+        "max_id INTEGER NOT NULL, count INTEGER NOT NULL, size INTEGER NOT NULL, created_at INTEGER NOT NULL, "
+        "PRIMARY KEY (id))"
+    )
+    _create_index(conn, "ix_history_partition_ts", "history_partition", "max_ts, min_ts")
+
+def _migration_012_backup_packs(conn):
+    """备份打包文件"""
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS backup_packs (id INTEGER NOT NULL, path VARCHAR NOT NULL, size INTEGER NOT NULL, "
+        "count INTEGER NOT NULL, sealed BOOLEAN NOT NULL, created_at INTEGER NOT NULL, PRIMARY KEY (id))"
+    )
+    _add_column_if_missing(conn, "backup_files", "pack_id", "INTEGER")
+    _add_column_if_missing(conn, "backup_files", "pack_offset", "INTEGER")
+    _create_index(conn, "ix_backup_files_pack", "backup_files", "pack_id, size")
+
+def _migration_013_text_preview(conn):
+    """文本预览：回填已有文本记录的预览，压缩存储的分批解压开头"""
+    _add_column_if_missing(conn, "clipboardhistory", "preview", "VARCHAR")
+    conn.exec_driver_sql(
+        "UPDATE clipboardhistory SET preview = substr(clipboard, 1, ?) "
+        "WHERE type = 'Text' AND body_codec IS NULL AND preview IS NULL", (Config.TEXT_PREVIEW_CHARS,)
+    )
+    last_id = 0
+    while True:
+        rows = conn.exec_driver_sql(
+            "SELECT id, body FROM clipboardhistory WHERE type = 'Text' AND body_codec = 'zlib' AND preview IS NULL "
+            "AND id > ? ORDER BY id LIMIT 200", (last_id,)
+        ).fetchall()
+        if not rows:
+            break
+        for row_id, body in rows:
+            head = zlib.decompressobj().decompress(body, Config.TEXT_PREVIEW_CHARS * 4)
+            conn.exec_driver_sql("UPDATE clipboardhistory SET preview = ? WHERE id = ?",
+                                 (text_preview(head.decode("utf-8", errors="ignore")), row_id))
+        last_id = rows[-1][0]
+
+# 按版本号顺序执行的迁移列表，只能追加，不能修改已发布的迁移
+MIGRATIONS = [
+    (1, "初始表结构", _migration_001_initial),
+    (2, "数值时间戳与筛选索引", _migration_002_history_ts),
+    (3, "文本去重", _migration_003_text_dedup),
+    (4, "精简原始内容并压缩大文本", _migration_004_compact_bodies),
+    (5, "收藏夹闭包表与计数", _migration_005_folder_closure),
+    (6, "备份文件校验", _migration_006_backup_scrub),
+    (7, "等待文件到达的记录", _migration_007_pending_files),
+    (8, "统计汇总表", _migration_008_history_rollup),
+    (9, "文本渲染缓存", _migration_009_render_cache),
+    (10, "多同步目录", _migration_010_sync_roots),
+    (11, "历史分区目录", _migration_011_history_partition),
+    (12, "备份打包文件", _migration_012_backup_packs),
+    (13, "文本预览", _migration_013_text_preview),
+]
+
+def run_migrations(engine) -> int:
+    """执行所有未应用的迁移，返回当前数据库版本"""
+    SchemaVersion.__table__.create(engine, checkfirst=True)
+    with engine.begin() as conn:
+        current = conn.exec_driver_sql("SELECT COALESCE(MAX(version), 0) FROM schema_version").scalar()
+    for version, name, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        # 每个迁移单独一个事务，失败时不会留下半完成的版本
+        with engine.begin() as conn:
+            migrate(conn)
+            conn.exec_driver_sql(
+                "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                (version, name, datetime.utcnow().isoformat(sep=" "))
+            )
+        current = version
+        if Config.DB_LOG_ENABLED:
+            print(f"已执行数据库迁移 {version}: {name}")
+    return current
+
+###################
+## 数据库引擎
+###################
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def _set_sqlite_pragma(dbapi_conn, connection_record):
+    """WAL 模式：写线程提交时读请求不被阻塞；NORMAL 同步在 WAL 下仍保证一致性"""
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+def init_db(): # 初始化数据库（目录、引擎、迁移），进程内只执行一次
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            return _engine
+
+        # 确保数据库目录与备份目录存在
+        for folder in (os.path.dirname(Config.DB_PATH), Config.BACKUP_DIR):
+            if not os.path.exists(folder):
+                os.makedirs(folder, exist_ok=True)  # 递归创建目录
+                print(f"Created directory: {folder}")
+
+        # 创建SQLite数据库引擎，所有模块共用同一个引擎（连接池）
+        sqlite_url = f"sqlite:///{Config.DB_PATH}"  # 数据库连接地址
+        engine = create_engine(sqlite_url, echo=Config.DB_LOG_ENABLED, connect_args={"check_same_thread": False})
+        event.listen(engine, "connect", _set_sqlite_pragma)
+
+        run_migrations(engine)
+        _engine = engine
+        return _engine
+
+def get_engine():
+    """获取共享数据库引擎，首次调用时完成初始化"""
+    if _engine is not None:
+        return _engine
+    return init_db()
+
+def find_repeated_text(session, content_hash: str, ts: Optional[int] = None,
+                       root_id: str = DEFAULT_ROOT) -> Optional[ClipboardHistory]:
+    """在去重窗口内查找同一根目录中内容相同的最新文本记录；窗口为 0 时不去重"""
+    if Config.TEXT_DEDUP_WINDOW <= 0:
+        return None
+    since = (ts or now_ms()) - Config.TEXT_DEDUP_WINDOW * 1000
+    return session.exec(
+        select(ClipboardHistory)
+        .where(ClipboardHistory.content_hash == content_hash, ClipboardHistory.ts >= since)
+        .where(ClipboardHistory.root_id == root_id)
+        .order_by(ClipboardHistory.ts.desc())
+        .limit(1)
+    ).first()
+
+def file_md5(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """分块计算文件MD5，大文件不会整体读入内存"""
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+def source_file_path(file_name: str, root_id: str = DEFAULT_ROOT) -> str:
+    """SyncClipboard 同步目录（根目录）下 file/ 中的文件路径"""
+    return os.path.join(files_dir(root_id), file_name)
+
+def copy_to_backup(src_path: str, file_name: str, checksum: str, link: bool = False) -> str:
+    """
+    复制到备份目录，文件名冲突且内容不同时加后缀，返回备份路径
+    :param link: 用硬链接代替复制（源文件之后只会被整体替换、不会原地修改时才可以用），
+                 无法硬链接（如跨文件系统）时仍然复制
+    """
+    os.makedirs(Config.BACKUP_DIR, exist_ok=True)
+    base, ext = os.path.splitext(file_name)
+    backup_path = os.path.join(Config.BACKUP_DIR, file_name)
+    count = 1
+    while os.path.exists(backup_path):
+        # 检查已存在的文件内容是否相同
+        if file_md5(backup_path) == checksum:
+            return backup_path
+        backup_path = os.path.join(Config.BACKUP_DIR, f"{base}_{count}{ext}")
+        count += 1
+    if link:
+        try:
+            os.link(src_path, backup_path)
+            return backup_path
+        except OSError:
+            pass
+    shutil.copy2(src_path, backup_path)
+    return backup_path
+
+def backup_exists(checksum: str, engine=None) -> bool:
+    """该校验和的文件是否已经登记过备份"""
+    with Session(engine or get_engine()) as session:
+        return session.exec(select(BackupFile.id).where(BackupFile.checksum == checksum)).first() is not None
+
+def stage_backup_file(data: dict, engine=None, checksum: Optional[str] = None,
+                      root_id: str = DEFAULT_ROOT) -> Optional[dict]:
+    """
+    备份 File/Image/Group 类型引用的文件。只做文件读写，不写数据库，
+    在写线程之外执行，避免大文件复制阻塞其他写入
+    :param checksum: 已经算好的文件 MD5（文件预处理时缓存的），Group 类型可以不再计算
+    :param root_id: JSON 所在的根目录，文件从该根目录的 file/ 中读取
+    :return: {'checksum', 'filepath', 'size'}；已有备份时 filepath 为 None；
+             源文件还没到达时另有 'pending': 文件名，由 ingest_history_item 登记等待；
+             无需备份（文本）时返回 None
+    """
+    item_type = data.get("Type", "")
+    file_name = data.get("File", "")
+    if item_type not in ("File", "Image", "Group") or not file_name:
+        return None
+
+    src_path = source_file_path(file_name, root_id)
+    if item_type == "Group":
+        # group类型（多文件压缩包），需要计算MD5
+        if not os.path.exists(src_path):
+            print(f"文件尚未到达，等待: {src_path}")
+            return {'checksum': None, 'filepath': None, 'size': None, 'pending': file_name}
+        checksum = checksum or file_md5(src_path)
+    else:
+        # clipboard字段本身就是MD5，无需再算
+        checksum = data.get("Clipboard", "")
+
+    if backup_exists(checksum, engine):
+        return {'checksum': checksum, 'filepath': None, 'size': None}
+    if not os.path.exists(src_path):
+        print(f"文件尚未到达，等待: {src_path}")
+        return {'checksum': checksum, 'filepath': None, 'size': None, 'pending': file_name}
+
+    backup_path = copy_to_backup(src_path, file_name, checksum)
+    return {'checksum': checksum, 'filepath': backup_path, 'size': os.path.getsize(backup_path)}
+
+def register_backup_file(session, backup: dict) -> bool:
+    """登记已放入备份目录的文件（写线程中执行），同一校验和已登记时返回 False"""
+    if not backup['filepath'] or session.exec(
+        select(BackupFile.id).where(BackupFile.checksum == backup['checksum'])
+    ).first() is not None:
+        return False
+    session.add(BackupFile(checksum=backup['checksum'], filepath=backup['filepath'], size=backup['size']))
+    session.flush()
+    return True
+
+def backup_size(session, checksum: Optional[str]) -> Optional[int]:
+    """已登记备份文件的大小，未登记时返回 None"""
+    if not checksum:
+        return None
+    return session.exec(select(BackupFile.size).where(BackupFile.checksum == checksum)).first()
+
+def ingest_history_item(session, data: dict, backup: Optional[dict] = None, ts: Optional[int] = None,
+                        root_id: str = DEFAULT_ROOT) -> int:
+    """
+    将SyncClipboard.json的内容写入会话（不提交），由写线程在组提交事务中调用，返回记录ID
+    :param data: 解析后的JSON字典
+    :param backup: stage_backup_file() 的结果（文件已复制好，这里只写元数据）
+    :param ts: 检测到变化时的毫秒时间戳，决定记录在列表中的顺序
+    :param root_id: JSON 所在的根目录，去重也只在同一根目录内进行
+    """
+    item_type = data.get("Type", "")
+    clipboard = data.get("Clipboard", "")
+    from_equipment = data.get("From", None)
+    tag = data.get("Tag", None)
+    raw_content = compact_raw_content(data)
+    ts = ts or now_ms()
+    checksum = None
+
+    # 文件/图片/压缩包：登记备份文件
+    content_length = None
+    if backup:
+        checksum = backup['checksum']
+        register_backup_file(session, backup)
+        content_length = backup['size'] or backup_size(session, checksum)
+
+    # 文本去重：窗口期内复制过相同内容时只增加次数，移动到最新位置，并记为最近一次复制的来源设备
+    content_hash = None
+    if item_type == "Text":
+        content_hash = text_hash(clipboard)
+        repeated = find_repeated_text(session, content_hash, ts, root_id)
+        if repeated is not None:
+            repeated.occurrences += 1
+            if ts > repeated.ts:
+                before = _rollup_key(repeated)
+                repeated.ts = ts
+                repeated.from_equipment = from_equipment
+                repeated.raw_content = raw_content
+                if tag is not None:  # 没有带标签时保留原来的（可能是手动设置的）
+                    repeated.tag = tag
+                # 换了一天或换了设备时，汇总也跟着移动
+                if _rollup_key(repeated) != before:
+                    _bump_rollup(session, *before, count=-1, size=-(repeated.content_length or 0),
+                                 starred=-int(bool(repeated.starred)))
+                    _rollup_item(session, repeated, 1)
+            session.add(repeated)
+            session.flush()
+            return repeated.id
+
+    # 写入历史表（大文本压缩存储）
+    body, body_codec, preview = None, None, None
+    if item_type == "Text":
+        content_length = len(clipboard.encode("utf-8"))
+        preview = text_preview(clipboard)
+        clipboard, body, body_codec = pack_text(clipboard)
+    history = ClipboardHistory(
+        raw_content=raw_content,
+        clipboard=clipboard,
+        type=item_type,
+        from_equipment=from_equipment,
+        tag=tag,
+        checksum=checksum,
+        content_hash=content_hash,
+        body=body,
+        body_codec=body_codec,
+        content_length=content_length,
+        preview=preview,
+        root_id=root_id,
+        ts=ts
+    )
+    session.add(history)
+    session.flush()  # 由调用方（写线程）统一提交
+    _rollup_item(session, history, 1)
+    if backup and backup.get('pending'):
+        session.add(PendingFile(history_id=history.id, file_name=backup['pending'], checksum=checksum, root_id=root_id))
+        session.flush()
+    return history.id
+
+def resolve_pending_files(session, file_name: str, backup: dict, root_id: str = DEFAULT_ROOT) -> int:
+    """
+    文件落地并完成备份后（写线程中执行）：登记备份，补全等待该文件的记录，返回补全的记录数
+    :param backup: {'checksum', 'filepath', 'size'}，filepath 为 None 表示已有备份
+    :param root_id: 文件所在的根目录，只补全该根目录中的记录
+    """
+    register_backup_file(session, backup)
+    pending = session.exec(
+        select(PendingFile).where(PendingFile.file_name == file_name, PendingFile.root_id == root_id)
+        .where((PendingFile.checksum == backup['checksum']) | (PendingFile.checksum == None))
+    ).all()
+    size = backup['size'] or backup_size(session, backup['checksum'])
+    for row in pending:
+        history = session.get(ClipboardHistory, row.history_id)
+        if history is not None:
+            if row.checksum is None:
+                history.checksum = backup['checksum']
+            if history.content_length is None and size is not None:
+                history.content_length = size
+                _bump_rollup(session, *_rollup_key(history), size=size)
+        session.delete(row)
+    session.flush()
+    return len(pending)
+
+def add_history_item_from_json(data: dict, engine=None, root_id: str = DEFAULT_ROOT):
+    """
+    将SyncClipboard.json的内容写入数据库，返回记录ID。
+    :param data: 解析后的JSON字典
+    :param engine: 可选，传入时在该引擎上直接单独提交（脚本/测试用）；否则交给共享写线程组提交
+    """
+    backup = stage_backup_file(data, engine, root_id=root_id)
+    if engine is not None:
         with Session(engine) as session:
-            # 创建根收藏夹
-            root_folder = Folder(name="Root", parent_id=None, path="/") # 使用 None 而不是 0 作为外键，避免约束报错
-            session.add(root_folder)
+            new_id = ingest_history_item(session, data, backup, root_id=root_id)
             session.commit()
-            
-            # 更新根收藏夹的path（自引用需要）
-            # 路径格式为 /ID/，例如 /1/
-            root_folder.path = f"/{root_folder.id}/"
-            session.add(root_folder)
-            session.commit()
-    
-    return engine
+        from db_writer import mark_changed
+        mark_changed()
+        return new_id
+    from db_writer import get_writer
+    return get_writer().submit(ingest_history_item, data, backup, None, root_id).result()
+
+###################
+## 收藏夹（闭包表），以下写操作都在写线程中执行
+###################
+
+def _sql(session, sql: str, **params):
+    """在会话中执行原生 SQL；先刷新未提交的修改，执行后让已加载对象过期，避免读到旧的计数"""
+    session.flush()
+    result = session.execute(text(sql), params)
+    session.expire_all()
+    return result
+
+def get_root_folder_id(session) -> int:
+    return session.exec(select(Folder.id).where(Folder.parent_id == None).order_by(Folder.id)).first()
+
+def _get_folder(session, folder_id: Optional[int]) -> Folder:
+    folder = session.get(Folder, folder_id or get_root_folder_id(session))
+    if folder is None:
+        raise ValueError(f"收藏夹不存在: {folder_id}")
+    return folder
+
+def _adjust_total_counts(session, folder_id: int, delta: int):
+    """本收藏夹及所有祖先的 total_count 加 delta（一条索引查询）"""
+    if delta:
+        _sql(session,
+             "UPDATE folder SET total_count = total_count + :delta "
+             "WHERE id IN (SELECT ancestor_id FROM folder_closure WHERE descendant_id = :folder_id)",
+             delta=delta, folder_id=folder_id)
+
+def create_folder(session, name: str, parent_id: Optional[int] = None) -> int:
+    """新建收藏夹，返回ID"""
+    parent = _get_folder(session, parent_id)
+    folder = Folder(name=name, parent_id=parent.id)
+    session.add(folder)
+    session.flush()
+    folder.path = f"{parent.path}{folder.id}/"
+    folder_id = folder.id
+    _sql(session,
+         "INSERT INTO folder_closure (ancestor_id, descendant_id, depth) "
+         "SELECT ancestor_id, :new_id, depth + 1 FROM folder_closure WHERE descendant_id = :parent_id "
+         "UNION ALL SELECT :new_id, :new_id, 0",
+         new_id=folder_id, parent_id=parent.id)
+    return folder_id
+
+def move_folder(session, folder_id: int, new_parent_id: Optional[int]) -> bool:
+    """把收藏夹（连同子树）移动到新的父收藏夹下"""
+    folder = _get_folder(session, folder_id)
+    parent = _get_folder(session, new_parent_id)
+    if folder.parent_id is None:
+        raise ValueError("根收藏夹不能移动")
+    if session.get(FolderClosure, (folder.id, parent.id)) is not None:
+        raise ValueError("不能移动到自身或子收藏夹下")
+    if folder.parent_id == parent.id:
+        return False
+
+    delta, old_parent_id, old_path = folder.total_count, folder.parent_id, folder.path
+    new_path = f"{parent.path}{folder.id}/"
+    _adjust_total_counts(session, old_parent_id, -delta)
+    # 断开子树与原祖先的关系，再与新祖先做笛卡尔积连接
+    _sql(session,
+         "DELETE FROM folder_closure "
+         "WHERE descendant_id IN (SELECT descendant_id FROM folder_closure WHERE ancestor_id = :id) "
+         "AND ancestor_id NOT IN (SELECT descendant_id FROM folder_closure WHERE ancestor_id = :id)",
+         id=folder_id)
+    _sql(session,
+         "INSERT INTO folder_closure (ancestor_id, descendant_id, depth) "
+         "SELECT sup.ancestor_id, sub.descendant_id, sup.depth + sub.depth + 1 "
+         "FROM folder_closure sup JOIN folder_closure sub ON sub.ancestor_id = :id "
+         "WHERE sup.descendant_id = :parent_id",
+         id=folder_id, parent_id=parent.id)
+    _adjust_total_counts(session, parent.id, delta)
+    _sql(session,
+         "UPDATE folder SET path = :new_path || substr(path, :cut) "
+         "WHERE id IN (SELECT descendant_id FROM folder_closure WHERE ancestor_id = :id)",
+         new_path=new_path, cut=len(old_path) + 1, id=folder_id)
+    _sql(session, "UPDATE folder SET parent_id = :parent_id WHERE id = :id", parent_id=parent.id, id=folder_id)
+    return True
+
+def delete_folder(session, folder_id: int) -> int:
+    """删除收藏夹及其子树（只删除收藏关系，不删除历史记录），返回删除的收藏夹数"""
+    folder = _get_folder(session, folder_id)
+    if folder.parent_id is None:
+        raise ValueError("根收藏夹不能删除")
+    _adjust_total_counts(session, folder.parent_id, -folder.total_count)
+    subtree = "SELECT descendant_id FROM folder_closure WHERE ancestor_id = :id"
+    affected = [row[0] for row in _sql(session, f"SELECT DISTINCT history_uuid FROM favorites WHERE folder_id IN ({subtree})", id=folder_id)]
+    _sql(session, f"DELETE FROM favorites WHERE folder_id IN ({subtree})", id=folder_id)
+    _unstar_if_unfiled(session, affected)
+    ids = [row[0] for row in _sql(session, subtree, id=folder_id)]
+    _sql(session, f"DELETE FROM folder_closure WHERE descendant_id IN ({subtree})", id=folder_id)
+    session.exec(delete(Folder).where(Folder.id.in_(ids)))
+    return len(ids)
+
+def _unstar_if_unfiled(session, uuids: list):
+    """不在任何收藏夹中的记录取消星标"""
+    if uuids:
+        unfiled = (ClipboardHistory.uuid.in_(uuids), ClipboardHistory.uuid.not_in(select(Favorite.history_uuid)))
+        _rollup_set_starred(session, False, *unfiled)
+        session.exec(ClipboardHistory.__table__.update().where(*unfiled).values(starred=False))
+        session.expire_all()
+
+def add_favorite(session, folder_id: Optional[int], history_id: int) -> bool:
+    """收藏到指定收藏夹（默认根收藏夹），同时加星标；已收藏返回 False"""
+    item = session.get(ClipboardHistory, history_id)
+    if item is None:
+        raise ValueError(f"记录不存在: {history_id}")
+    folder = _get_folder(session, folder_id)
+    exists = session.exec(
+        select(Favorite.id).where(Favorite.history_uuid == item.uuid, Favorite.folder_id == folder.id)
+    ).first()
+    if not item.starred:
+        _bump_rollup(session, *_rollup_key(item), starred=1)
+    item.starred = True
+    if exists is not None:
+        return False
+    session.add(Favorite(history_uuid=item.uuid, folder_id=folder.id))
+    folder.item_count += 1
+    _adjust_total_counts(session, folder.id, 1)
+    return True
 
-def add_history_item_from_json(data: dict, engine=None):
+def remove_favorite(session, folder_id: Optional[int], history_id: int) -> bool:
+    """从收藏夹移除；不再属于任何收藏夹时取消星标"""
+    item = session.get(ClipboardHistory, history_id)
+    folder = _get_folder(session, folder_id)
+    if item is None:
+        return False
+    favorite = session.exec(
+        select(Favorite).where(Favorite.history_uuid == item.uuid, Favorite.folder_id == folder.id)
+    ).first()
+    if favorite is None:
+        return False
+    session.delete(favorite)
+    folder.item_count -= 1
+    _adjust_total_counts(session, folder.id, -1)
+    _unstar_if_unfiled(session, [item.uuid])
+    return True
+
+def set_starred(session, history_id: int, starred: bool) -> bool:
+    """星标即收藏到根收藏夹；取消星标会从所有收藏夹移除"""
+    if starred:
+        add_favorite(session, None, history_id)
+        return True
+    item = session.get(ClipboardHistory, history_id)
+    if item is None:
+        raise ValueError(f"记录不存在: {history_id}")
+    folder_ids = session.exec(select(Favorite.folder_id).where(Favorite.history_uuid == item.uuid)).all()
+    for folder_id in folder_ids:
+        remove_favorite(session, folder_id, history_id)
+    item = session.get(ClipboardHistory, history_id)
+    if item.starred:
+        _bump_rollup(session, *_rollup_key(item), starred=-1)
+    item.starred = False
+    return False
+
+def toggle_star(session, history_id: int) -> bool:
+    item = session.get(ClipboardHistory, history_id)
+    if item is None:
+        raise ValueError(f"记录不存在: {history_id}")
+    return set_starred(session, history_id, not item.starred)
+
+###################
+## 统计汇总：按 (根目录, 日期, 来源设备, 类型) 增量维护，都在写线程的同一事务中执行
+###################
+
+_ROLLUP_DAY = func.strftime('%Y-%m-%d', ClipboardHistory.ts // 1000, 'unixepoch')
+_ROLLUP_EQUIPMENT = func.coalesce(ClipboardHistory.from_equipment, "")
+
+# 由历史表直接汇总（全表扫描，只在迁移和校验时使用）
+_ROLLUP_FROM_HISTORY = (
+    "SELECT root_id, strftime('%Y-%m-%d', ts / 1000, 'unixepoch'), COALESCE(from_equipment, ''), type, "
+    "COUNT(*), COALESCE(SUM(content_length), 0), COALESCE(SUM(starred), 0) "
+    "FROM clipboardhistory GROUP BY 1, 2, 3, 4"
+)
+
+def _partition_rollup_rows(conn) -> list:
+    """各个分区按汇总键分组的结果（归档的记录仍然计入汇总）"""
+    if conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'history_partition'"
+    ).first() is None:
+        return []  # 迁移 11 之前
+    rows = []
+    for (path,) in conn.exec_driver_sql("SELECT path FROM history_partition").fetchall():
+        with partition_engine(path).connect() as part:
+            rows.extend(part.exec_driver_sql(_ROLLUP_FROM_HISTORY).fetchall())
+    return rows
+
+def rebuild_rollups(conn):
+    """由历史表与各分区整体重建统计汇总（迁移与 cli.py stats --rebuild 使用）"""
+    conn.exec_driver_sql("DELETE FROM history_rollup")
+    conn.exec_driver_sql(
+        "INSERT INTO history_rollup (root_id, day, from_equipment, type, count, bytes, starred_count) " + _ROLLUP_FROM_HISTORY
+    )
+    for row in _partition_rollup_rows(conn):
+        conn.exec_driver_sql(
+            "INSERT INTO history_rollup (root_id, day, from_equipment, type, count, bytes, starred_count) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (root_id, day, from_equipment, type) DO UPDATE SET "
+            "count = count + excluded.count, bytes = bytes + excluded.bytes, "
+            "starred_count = starred_count + excluded.starred_count", tuple(row)
+        )
+
+def verify_rollups(conn) -> list:
+    """对比增量维护的汇总与由历史表（及各分区）重新汇总的结果，返回不一致的 (键, 汇总值, 实际值)"""
+    stored = {tuple(row[:4]): tuple(row[4:]) for row in conn.exec_driver_sql(
+        "SELECT root_id, day, from_equipment, type, count, bytes, starred_count FROM history_rollup")}
+    actual = {}
+    for row in conn.exec_driver_sql(_ROLLUP_FROM_HISTORY).fetchall() + _partition_rollup_rows(conn):
+        previous = actual.get(tuple(row[:4]), (0, 0, 0))
+        actual[tuple(row[:4])] = tuple(a + b for a, b in zip(previous, row[4:]))
+    return [(key, stored.get(key), actual.get(key)) for key in sorted(stored.keys() | actual.keys())
+            if stored.get(key) != actual.get(key)]
+
+def _rollup_key(item: ClipboardHistory) -> tuple:
+    return item.root_id or DEFAULT_ROOT, ms_to_day(item.ts), item.from_equipment or "", item.type
+
+def _bump_rollup(session, root_id: str, day: str, equipment: str, item_type: str,
+                 count: int = 0, size: int = 0, starred: int = 0):
+    """汇总行累加（不存在时插入），条数减到 0 的行删除"""
+    if not (count or size or starred):
+        return
+    key = {'root': root_id, 'day': day, 'equipment': equipment, 'type': item_type}
+    # 汇总表不经过 ORM，不需要像 _sql 那样刷新和过期会话中的对象
+    session.execute(text(
+        "INSERT INTO history_rollup (root_id, day, from_equipment, type, count, bytes, starred_count) "
+        "VALUES (:root, :day, :equipment, :type, :count, :size, :starred) "
+        "ON CONFLICT (root_id, day, from_equipment, type) DO UPDATE SET count = count + excluded.count, "
+        "bytes = bytes + excluded.bytes, starred_count = starred_count + excluded.starred_count"
+    ), dict(key, count=count, size=size, starred=starred))
+    if count < 0:
+        session.execute(text(
+            "DELETE FROM history_rollup WHERE root_id = :root AND day = :day AND from_equipment = :equipment "
+            "AND type = :type AND count <= 0"
+        ), key)
+
+def _rollup_item(session, item: ClipboardHistory, sign: int):
+    """把一条记录计入（sign=1）或移出（sign=-1）汇总"""
+    _bump_rollup(session, *_rollup_key(item), count=sign, size=sign * (item.content_length or 0),
+                 starred=sign * int(bool(item.starred)))
+
+def _rollup_groups(session, *conditions) -> list:
+    """满足条件的记录按汇总键分组：[(根目录, 日期, 设备, 类型, 条数, 字节数, 星标数)]"""
+    return session.exec(
+        select(ClipboardHistory.root_id, _ROLLUP_DAY, _ROLLUP_EQUIPMENT, ClipboardHistory.type, func.count(),
+               func.coalesce(func.sum(ClipboardHistory.content_length), 0),
+               func.coalesce(func.sum(ClipboardHistory.starred), 0))
+        .where(*conditions).group_by(ClipboardHistory.root_id, _ROLLUP_DAY, _ROLLUP_EQUIPMENT, ClipboardHistory.type)
+    ).all()
+
+def _rollup_remove_rows(session, ids: list):
+    """删除记录之前，把它们移出汇总"""
+    for *key, count, size, starred in _rollup_groups(session, ClipboardHistory.id.in_(ids)):
+        _bump_rollup(session, *key, -count, -size, -starred)
+
+def _rollup_set_starred(session, starred: bool, *conditions):
+    """批量修改星标之前，按实际会变化的记录调整星标数"""
+    sign = 1 if starred else -1
+    for *key, count, _, _ in _rollup_groups(session, ClipboardHistory.starred != starred, *conditions):
+        _bump_rollup(session, *key, starred=sign * count)
+
+def _rollup_query(columns: list, filters: dict = None):
+    """在汇总表上按筛选条件（root / type / source / start_date / end_date）查询"""
+    filters = filters or {}
+    query = select(*columns)
+    if filters.get('root'):
+        query = query.where(HistoryRollup.root_id == filters['root'])
+    if filters.get('type'):
+        query = query.where(HistoryRollup.type == filters['type'])
+    if filters.get('source'):
+        query = query.where(HistoryRollup.from_equipment == filters['source'])
+    if filters.get('start_date'):
+        date_to_ms(filters['start_date'])  # 与 build_history_query 一样，格式错误时抛出 ValueError
+        query = query.where(HistoryRollup.day >= filters['start_date'])
+    if filters.get('end_date'):
+        date_to_ms(filters['end_date'])
+        query = query.where(HistoryRollup.day <= filters['end_date'])
+    return query
+
+def count_history(session, filters: dict = None) -> int:
+    """符合筛选条件的准确条数，只读汇总表（不执行 COUNT(*)）"""
+    column = HistoryRollup.starred_count if (filters or {}).get('starred') else HistoryRollup.count
+    return session.exec(_rollup_query([func.coalesce(func.sum(column), 0)], filters)).one()
+
+def history_stats(session, filters: dict = None) -> dict:
     """
-    将SyncClipboard.json的内容写入数据库，自动处理文本、文件、图片类型。
-    :param data: 解析后的JSON字典
-    :param engine: 可选，传入SQLModel数据库引擎，否则自动init_db
+    统计：总计、按根目录、按类型、按来源设备、按天（热力图），都直接来自汇总表。
+    starred 条件不参与筛选，每一项都单独给出星标数
+    """
+    columns = [HistoryRollup.root_id, HistoryRollup.day, HistoryRollup.from_equipment, HistoryRollup.type,
+               HistoryRollup.count, HistoryRollup.bytes, HistoryRollup.starred_count]
+    rows = session.exec(_rollup_query(columns, filters).order_by(HistoryRollup.day)).all()
+
+    def add(groups: dict, key, count, size, starred):
+        group = groups.setdefault(key, {'count': 0, 'bytes': 0, 'starred': 0})
+        group['count'] += count
+        group['bytes'] += size
+        group['starred'] += starred
+
+    totals, by_root, by_type, by_source, by_day = {}, {}, {}, {}, {}
+    for root_id, day, equipment, item_type, count, size, starred in rows:
+        add(totals, "all", count, size, starred)
+        add(by_root, root_id, count, size, starred)
+        add(by_type, item_type, count, size, starred)
+        add(by_source, equipment, count, size, starred)
+        add(by_day, day, count, size, starred)
+    return {
+        'totals': totals.get("all", {'count': 0, 'bytes': 0, 'starred': 0}),
+        'by_root': by_root,
+        'by_type': by_type,
+        'by_source': by_source,
+        'days': [dict(day=day, **values) for day, values in by_day.items()],
+    }
+
+###################
+## 批量操作：整批在写线程的一个事务中完成
+###################
+
+BULK_ACTIONS = ("star", "unstar", "tag", "move", "delete")
+_IN_CHUNK = 500  # IN 列表分块，避免超过 SQLite 参数个数上限
+
+def _chunks(values: list, size: int = _IN_CHUNK):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def _resolve_ids(session, ids: Optional[list], filters: Optional[dict]) -> list:
+    """ID 列表与筛选表达式二选一（都给出时取交集）"""
+    if filters:
+        query = build_history_query(filters).with_only_columns(ClipboardHistory.id)
+        matched = list(session.exec(query).all())
+        if ids is None:
+            return matched
+        wanted = set(ids)
+        return [item_id for item_id in matched if item_id in wanted]
+    return list(dict.fromkeys(ids or []))
+
+def _uuids_of(session, ids: list) -> list:
+    uuids = []
+    for chunk in _chunks(ids):
+        uuids.extend(session.exec(select(ClipboardHistory.uuid).where(ClipboardHistory.id.in_(chunk))).all())
+    return uuids
+
+def _remove_favorites_of(session, uuids: list):
+    """把记录从所有收藏夹移除，并按收藏夹批量扣减计数"""
+    per_folder = {}
+    for chunk in _chunks(uuids):
+        rows = session.exec(
+            select(Favorite.folder_id, func.count()).where(Favorite.history_uuid.in_(chunk)).group_by(Favorite.folder_id)
+        ).all()
+        for folder_id, count in rows:
+            per_folder[folder_id] = per_folder.get(folder_id, 0) + count
+    for folder_id, count in per_folder.items():
+        _sql(session, "UPDATE folder SET item_count = item_count - :n WHERE id = :id", n=count, id=folder_id)
+        _adjust_total_counts(session, folder_id, -count)
+    for chunk in _chunks(uuids):
+        session.exec(delete(Favorite).where(Favorite.history_uuid.in_(chunk)))
+
+def _file_into(session, folder_id: Optional[int], uuids: list):
+    """批量收藏到指定收藏夹（已在其中的跳过）"""
+    folder = _get_folder(session, folder_id)
+    target_id = folder.id
+    existing = set()
+    for chunk in _chunks(uuids):
+        existing.update(session.exec(
+            select(Favorite.history_uuid).where(Favorite.folder_id == target_id, Favorite.history_uuid.in_(chunk))
+        ).all())
+    new_uuids = [uuid for uuid in uuids if uuid not in existing]
+    session.add_all([Favorite(history_uuid=uuid, folder_id=target_id) for uuid in new_uuids])
+    if new_uuids:
+        _sql(session, "UPDATE folder SET item_count = item_count + :n WHERE id = :id", n=len(new_uuids), id=target_id)
+        _adjust_total_counts(session, target_id, len(new_uuids))
+
+def _update_history(session, ids: list, **values):
+    for chunk in _chunks(ids):
+        if 'starred' in values:
+            _rollup_set_starred(session, values['starred'], ClipboardHistory.id.in_(chunk))
+        session.exec(ClipboardHistory.__table__.update().where(ClipboardHistory.id.in_(chunk)).values(**values))
+    session.expire_all()
+
+def delete_history_rows(session, ids: list):
+    """删除历史记录（连同收藏关系）；备份文件按校验和共享，不在这里删除"""
+    _remove_favorites_of(session, _uuids_of(session, ids))
+    for chunk in _chunks(ids):
+        _rollup_remove_rows(session, chunk)
+        session.exec(delete(PendingFile).where(PendingFile.history_id.in_(chunk)))
+        session.exec(delete(ClipboardHistory).where(ClipboardHistory.id.in_(chunk)))
+    session.expire_all()
+
+def bulk_update(session, action: str, ids: Optional[list] = None, filters: Optional[dict] = None,
+                tag: Optional[str] = None, folder_id: Optional[int] = None) -> list:
     """
+    对一批记录执行同一操作，返回受影响的记录ID
+    :param action: star / unstar / tag / move（移动到 folder_id 收藏夹）/ delete
+    """
+    if action not in BULK_ACTIONS:
+        raise ValueError(f"不支持的批量操作: {action}")
+    target = _resolve_ids(session, ids, filters)
+    if not target:
+        return []
+    if action == "star":
+        _file_into(session, None, _uuids_of(session, target))
+        _update_history(session, target, starred=True)
+    elif action == "unstar":
+        _remove_favorites_of(session, _uuids_of(session, target))
+        _update_history(session, target, starred=False)
+    elif action == "tag":
+        _update_history(session, target, tag=tag or None)
+    elif action == "move":
+        uuids = _uuids_of(session, target)
+        _remove_favorites_of(session, uuids)
+        _file_into(session, folder_id, uuids)
+        _update_history(session, target, starred=True)
+    elif action == "delete":
+        delete_history_rows(session, target)
+    return target
+
+###################
+## 查询构建
+###################
+
+def encode_cursor(item) -> str:
+    """游标格式为 "ts:id"，对应排序键 (ts, id)"""
+    return f"{item.ts}:{item.id}"
+
+def decode_cursor(cursor: str) -> tuple:
+    """解析游标，格式错误时抛出 ValueError"""
+    ts, _, item_id = cursor.partition(":")
+    return int(ts), int(item_id)
+
+def build_history_query(filters: dict = None, cursor: Optional[str] = None):
+    """
+    根据筛选条件构建按 (ts, id) 倒序的查询
+    :param filters: root / type / source / start_date / end_date（YYYY-MM-DD，含当天）/ starred
+    :param cursor: 上一页最后一条的游标，只返回排在它之后的记录
+    """
+    filters = filters or {}
+    query = select(ClipboardHistory)
+    if filters.get('root'):
+        query = query.where(ClipboardHistory.root_id == filters['root'])
+    if filters.get('type'):
+        query = query.where(ClipboardHistory.type == filters['type'])
+    if filters.get('source'):
+        query = query.where(ClipboardHistory.from_equipment == filters['source'])
+    if filters.get('start_date'):
+        query = query.where(ClipboardHistory.ts >= date_to_ms(filters['start_date']))
+    if filters.get('end_date'):
+        query = query.where(ClipboardHistory.ts < date_to_ms(filters['end_date']) + DAY_MS)
+    if filters.get('starred'):
+        query = query.where(ClipboardHistory.starred == True)
+    if cursor:
+        query = query.where(tuple_(ClipboardHistory.ts, ClipboardHistory.id) < tuple_(*decode_cursor(cursor)))
+    return query.order_by(ClipboardHistory.ts.desc(), ClipboardHistory.id.desc())
+
+###################
+## 历史分区：旧月份的只读分区文件（由 archive.py 生成），查询时与主表合并
+###################
+
+_partition_engines = {}
+_partition_lock = threading.Lock()
+
+def _column_default_sql(column) -> str:
+    """分区文件中缺少的列（分区生成之后才新增的）在视图中的取值"""
+    default = column.server_default.arg if column.server_default is not None else None
+    return "NULL" if default is None else "'" + str(default).replace("'", "''") + "'"
+
+def _open_partition(path: str):
+    """
+    内存库中以只读、不可变方式附加分区文件，再建一个与 clipboardhistory 同名的临时视图：
+    查询与主表完全相同（同一个模型、同一个 build_history_query），分区生成后新增的列在视图中取默认值
+    """
+    conn = sqlite3.connect(":memory:", uri=True, check_same_thread=False)
+    conn.execute("ATTACH DATABASE ? AS part", (f"file:{quote(path)}?mode=ro&immutable=1",))
+    existing = {row[1] for row in conn.execute("PRAGMA part.table_info(clipboardhistory)")}
+    columns = ", ".join(
+        column.name if column.name in existing else f"{_column_default_sql(column)} AS {column.name}"
+        for column in ClipboardHistory.__table__.columns
+    )
+    conn.execute(f"CREATE TEMP VIEW clipboardhistory AS SELECT {columns} FROM part.clipboardhistory")
+    return conn
+
+def partition_engine(path: str):
+    """分区文件的只读引擎（按路径缓存）"""
+    engine = _partition_engines.get(path)
     if engine is None:
-        engine = init_db()
+        with _partition_lock:
+            engine = _partition_engines.get(path)
+            if engine is None:
+                engine = create_engine("sqlite://", creator=lambda: _open_partition(path))
+                _partition_engines[path] = engine
+    return engine
+
+def list_partitions(session, filters: dict = None, cursor: Optional[str] = None) -> list:
+    """
+    可能包含符合条件记录的分区，按最晚记录从新到旧；
+    分区中没有星标记录，只看星标时不需要读取任何分区
+    """
+    filters = filters or {}
+    if filters.get('starred'):
+        return []
+    query = select(HistoryPartition)
+    if filters.get('start_date'):
+        query = query.where(HistoryPartition.max_ts >= date_to_ms(filters['start_date']))
+    if filters.get('end_date'):
+        query = query.where(HistoryPartition.min_ts < date_to_ms(filters['end_date']) + DAY_MS)
+    if cursor:
+        query = query.where(HistoryPartition.min_ts <= decode_cursor(cursor)[0])
+    return session.exec(query.order_by(HistoryPartition.max_ts.desc(), HistoryPartition.max_id.desc())).all()
+
+# 列表查询不加载的列：完整文本可能有几十 MB，列表只需要预览
+_LIST_DEFERRED = (defer(ClipboardHistory.clipboard), defer(ClipboardHistory.body))
+
+def _sort_key(item) -> tuple:
+    return item.ts, item.id
+
+def query_history(session, filters: dict = None, cursor: Optional[str] = None, limit: int = 30, offset: int = 0) -> list:
+    """
+    主表与分区合并后按 (ts, id) 倒序的一页记录。先查主表，再按从新到旧的顺序查分区，
+    已经凑够、且都比下一个分区的最晚记录更新时就停止，不读取更早的分区。
+    主表的记录不加载完整文本（列表只用预览，见 records_to_dicts）
+    """
+    wanted = offset + limit
+    results = list(session.exec(build_history_query(filters, cursor).options(*_LIST_DEFERRED).limit(wanted)).all())
+    for partition in list_partitions(session, filters, cursor):
+        if len(results) >= wanted and _sort_key(results[wanted - 1]) > (partition.max_ts, partition.max_id):
+            break
+        with Session(partition_engine(partition.path)) as part:
+            rows = part.exec(build_history_query(filters, cursor).limit(wanted)).all()
+        metrics.inc("history.partitions_read")
+        results = sorted(results + list(rows), key=_sort_key, reverse=True)[:wanted]
+    return results[offset:]
+
+def iter_history(engine, query, batch_size: int = 500):
+    """按批次遍历主表与所有分区上的同一查询（各自按 (ts, id) 倒序），合并为一个倒序的流"""
+    def iterate(source_engine):
+        with Session(source_engine) as session:
+            for item in session.exec(query.execution_options(yield_per=batch_size)):
+                yield item
+
     with Session(engine) as session:
-        item_type = data.get("Type", "")
-        file_name = data.get("File", "")
-        clipboard = data.get("Clipboard", "")
-        from_equipment = data.get("From", None)
-        tag = data.get("Tag", None)
-        raw_content = json.dumps(data, ensure_ascii=False)
-        checksum = None
-
-        # 处理文件/图片类型
-        if item_type in ["File", "Image"] and file_name:
-            # clipboard字段本身就是MD5，无需再算
-            checksum = clipboard
-            src_path = os.path.join(os.path.dirname(Config.SYNC_CLIPBOARD_JSON_PATH), "file", file_name)
-            exists = session.exec(select(BackupFile).where(BackupFile.checksum == checksum)).first()
-            backup_name = file_name
-            backup_path = os.path.join(Config.BACKUP_DIR, backup_name)
-            os.makedirs(Config.BACKUP_DIR, exist_ok=True)
-            if not exists and os.path.exists(src_path):
-                # 文件名冲突且内容不同，加后缀
-                base, ext = os.path.splitext(file_name)
-                count = 1
-                while os.path.exists(backup_path):
-                    # 检查已存在的文件内容是否相同
-                    with open(backup_path, "rb") as f:
-                        if hashlib.md5(f.read()).hexdigest() == checksum:
-                            break
-                    backup_name = f"{base}_{count}{ext}"
-                    backup_path = os.path.join(Config.BACKUP_DIR, backup_name)
-                    count += 1
-                if not os.path.exists(backup_path):
-                    shutil.copy2(src_path, backup_path)
-                size = os.path.getsize(backup_path)
-                backup = BackupFile(
-                    checksum=checksum,
-                    filepath=backup_path,
-                    size=size
-                )
-                session.add(backup)
-            elif not os.path.exists(src_path):
-                print(f"文件未找到: {src_path}")
+        paths = session.exec(select(HistoryPartition.path)).all()
+    sources = [iterate(engine)] + [iterate(partition_engine(path)) for path in paths]
+    return heapq.merge(*sources, key=_sort_key, reverse=True)
 
-        # group类型（多文件压缩包），需要计算MD5
-        elif item_type == "Group" and file_name:
-            src_path = os.path.join(os.path.dirname(Config.SYNC_CLIPBOARD_JSON_PATH), "file", file_name)
-            if os.path.exists(src_path):
-                with open(src_path, "rb") as f:
-                    file_bytes = f.read()
-                    checksum = hashlib.md5(file_bytes).hexdigest()
-                exists = session.exec(select(BackupFile).where(BackupFile.checksum == checksum)).first()
-                backup_name = file_name
-                backup_path = os.path.join(Config.BACKUP_DIR, backup_name)
-                os.makedirs(Config.BACKUP_DIR, exist_ok=True)
-                if not exists:
-                    base, ext = os.path.splitext(file_name)
-                    count = 1
-                    while os.path.exists(backup_path):
-                        with open(backup_path, "rb") as f:
-                            if hashlib.md5(f.read()).hexdigest() == checksum:
-                                break
-                        backup_name = f"{base}_{count}{ext}"
-                        backup_path = os.path.join(Config.BACKUP_DIR, backup_name)
-                        count += 1
-                    if not os.path.exists(backup_path):
-                        shutil.copy2(src_path, backup_path)
-                    size = os.path.getsize(backup_path)
-                    backup = BackupFile(
-                        checksum=checksum,
-                        filepath=backup_path,
-                        size=size
-                    )
-                    session.add(backup)
-            else:
-                print(f"文件未找到: {src_path}")
-
-        # 写入历史表
-        history = ClipboardHistory(
-            raw_content=raw_content,
-            clipboard=clipboard,
-            type=item_type,
-            from_equipment=from_equipment,
-            tag=tag,
-            checksum=checksum
-        )
-        session.add(history)
-        session.commit()
-        return history.id
+def get_history_item(session, item_id: int) -> Optional[ClipboardHistory]:
+    """按ID取一条记录，主表中没有时到ID范围包含它的分区中找（分区中的记录只读）"""
+    item = session.get(ClipboardHistory, item_id)
+    if item is not None:
+        return item
+    partitions = session.exec(
+        select(HistoryPartition.path).where(HistoryPartition.min_id <= item_id, HistoryPartition.max_id >= item_id)
+    ).all()
+    for path in partitions:
+        with Session(partition_engine(path)) as part:
+            item = part.get(ClipboardHistory, item_id)
+        if item is not None:
+            return item
+    return None
+
+def records_to_dicts(session, items) -> list:
+    """将历史记录转换为前端可用格式（收藏状态、渲染分类各一次查询完成）"""
+    uuids = [item.uuid for item in items]
+    favorite_uuids = set()
+    if uuids:
+        favorite_uuids = set(session.exec(
+            select(Favorite.history_uuid).where(Favorite.history_uuid.in_(uuids))
+        ).all())
+    hashes = [item.content_hash for item in items if item.content_hash]
+    render_kinds = {}
+    if hashes:
+        render_kinds = dict(session.exec(
+            select(RenderCache.content_hash, RenderCache.kind).where(RenderCache.content_hash.in_(hashes))
+        ).all())
+
+    records = []
+    for item in items:
+        # 解析文件名（从原始JSON）
+        file_name = None
+        try:
+            raw_data = json.loads(item.raw_content)
+            file_name = raw_data.get("File", None)
+        except (json.JSONDecodeError, TypeError):
+            pass
+
+        preview = stored_preview(item) if item.type == 'Text' else None
+        records.append({
+            'id': item.id,
+            'uuid': item.uuid,
+            'type': item.type,
+            'root': item.root_id,
+            'timestamp': ms_to_str(item.ts),
+            'source': item.from_equipment,
+            'tag': item.tag,  # 添加标签信息
+            'is_starred': item.starred,
+            'is_favorite': item.starred or item.uuid in favorite_uuids,
+            'occurrences': item.occurrences,
+            'content': preview,  # 文本只返回预览，完整内容见 /api/history/<id>/content
+            'content_length': item.content_length,
+            'content_truncated': preview is not None and (item.content_length or 0) > len(preview.encode("utf-8")),
+            'render_kind': render_kinds.get(item.content_hash),
+            'file_name': file_name,
+            'checksum': item.checksum
+        })
+    return records
 
 class ServerGet:
     def __init__(self):
-        self.engine = create_engine(f"sqlite:///{Config.DB_PATH}", echo=False)
+        self.engine = get_engine()
+        self._first_pages = {}  # (每页条数, 根目录) -> (变更序号, 结果)，首页缓存
+
+    # 主页列表专用查询（仅按时间排序，可以只看一个根目录）
+    def get_history_paginated(self, limit: int = 30, offset: int = 0, root: Optional[str] = None) -> dict:
+        """仅按时间倒序返回指定偏移量和数量的记录，包含总条数；首页在数据没有变化时直接用缓存"""
+        if offset == 0:
+            return self.get_first_page(limit, root)
+        return self._query_paginated(limit, offset, root)
+
+    def get_first_page(self, limit: int = 30, root: Optional[str] = None) -> dict:
+        """
+        首页（主页直出与 /api/history 共用）。
+        按变更序号缓存（db_writer.change_sequence）：序号没变说明数据没变，不再查询。返回值是共享的，调用方不要修改
+        """
+        from db_writer import change_sequence
 
-    # 主页列表专用查询（仅按时间排序，无筛选）
-    def get_history_paginated(self, limit: int = 30, offset: int = 0) -> dict:
-        """仅按时间倒序返回指定偏移量和数量的记录，包含总条数"""
+        sequence = change_sequence()  # 先取序号再查询：查询期间有提交时，缓存会在下次请求时失效
+        cached = self._first_pages.get((limit, root))
+        if cached and cached[0] == sequence:
+            metrics.inc("first_page.cache_hits")
+            return cached[1]
+        result = self._query_paginated(limit, 0, root)
+        self._first_pages[(limit, root)] = (sequence, result)
+        metrics.inc("first_page.cache_misses")
+        return result
+
+    def _query_paginated(self, limit: int, offset: int, root: Optional[str] = None) -> dict:
         with Session(self.engine) as session:
-            # 基础查询：按时间倒序（最新在前）
-            base_query = select(ClipboardHistory).order_by(ClipboardHistory.timestamp.desc())
+            # 按时间倒序（最新在前），主表不够时接着读取分区
+            filters = {'root': root}
             
-            # 获取总记录数
-            total_count = session.exec(select(func.count()).select_from(base_query.subquery())).first()
+            # 总记录数来自统计汇总，不扫描历史表
+            total_count = count_history(session, filters)
             
             # 获取分页数据
-            results = session.exec(base_query.offset(offset).limit(limit)).all()
-            
-            # 转换为前端可用格式
-            records = []
-            for item in results:
-                # 解析文件名（从原始JSON）
-                file_name = None
-                try:
-                    raw_data = json.loads(item.raw_content)
-                    file_name = raw_data.get("File", None)
-                except json.JSONDecodeError:
-                    pass
-                
-                # 检查是否为收藏
-                is_favorite = session.exec(
-                    select(Favorite).where(Favorite.history_uuid == item.uuid)
-                ).first() is not None
-                
-                records.append({ # for 循环中添加代码
-                    'id': item.id,
-                    'uuid': item.uuid,
-                    'type': item.type,
-                    'timestamp': item.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-                    'source': item.from_equipment,
-                    'tag': item.tag,  # 添加标签信息
-                    'is_favorite': is_favorite,
-                    'content': item.clipboard if item.type == 'Text' else None,
-                    'file_name': file_name,
-                    'checksum': item.checksum
-                })
+            results = query_history(session, filters, limit=limit, offset=offset)
             
             return {
-                'records': records,
+                'records': records_to_dicts(session, results),
                 'total': total_count,
                 'limit': limit,
                 'offset': offset
             }
 
+    # 筛选查询（类型、来源、日期范围、星标），使用游标分页
+    def get_history(self, filters: dict = None, cursor: Optional[str] = None, limit: int = 30) -> dict:
+        """
+        按筛选条件倒序返回记录；cursor 为上一页返回的 next_cursor，
+        为空时从最新一条开始。每个条件组合都能命中组合索引，无需全表扫描；
+        total 为符合条件的准确条数，来自统计汇总
+        """
+        with Session(self.engine) as session:
+            results = query_history(session, filters, cursor, limit + 1)
+            has_more = len(results) > limit
+            results = results[:limit]
+            return {
+                'records': records_to_dicts(session, results),
+                'next_cursor': encode_cursor(results[-1]) if has_more else None,
+                'total': count_history(session, filters),
+                'limit': limit
+            }
+
+    # 统计（总计、按类型、按来源、按天），只读汇总表
+    def get_stats(self, filters: dict = None) -> dict:
+        with Session(self.engine) as session:
+            return history_stats(session, filters)
+
+    # 按ID批量获取记录，保持传入顺序，不存在的ID忽略
+    def get_history_by_ids(self, ids: list) -> list:
+        with Session(self.engine) as session:
+            items = {}
+            for chunk in _chunks(list(dict.fromkeys(ids))):
+                for item in session.exec(select(ClipboardHistory).options(*_LIST_DEFERRED)
+                                         .where(ClipboardHistory.id.in_(chunk))).all():
+                    items[item.id] = item
+            # 主表中没有的可能已经归档
+            for item_id in dict.fromkeys(ids):
+                if item_id not in items:
+                    item = get_history_item(session, item_id)
+                    if item is not None:
+                        items[item_id] = item
+            return records_to_dicts(session, [items[i] for i in ids if i in items])
+
+    # 推送变更时按视图分发用：{ID: {'root', 'type', 'device', 'folders'}}，只读主表（分区中的记录不会再变更）
+    def get_history_routing(self, ids: list) -> dict:
+        with Session(self.engine) as session:
+            routing = {}
+            uuids = {}
+            for chunk in _chunks(list(dict.fromkeys(ids))):
+                rows = session.exec(
+                    select(ClipboardHistory.id, ClipboardHistory.uuid, ClipboardHistory.root_id,
+                           ClipboardHistory.type, ClipboardHistory.from_equipment)
+                    .where(ClipboardHistory.id.in_(chunk))
+                ).all()
+                for item_id, item_uuid, root_id, item_type, device in rows:
+                    routing[item_id] = {'root': root_id, 'type': item_type, 'device': device, 'folders': set()}
+                    uuids[item_uuid] = item_id
+            for chunk in _chunks(list(uuids)):
+                for item_uuid, folder_id in session.exec(
+                    select(Favorite.history_uuid, Favorite.folder_id).where(Favorite.history_uuid.in_(chunk))
+                ).all():
+                    routing[uuids[item_uuid]]['folders'].add(folder_id)
+            return routing
+
+    # 收藏夹列表（含预先维护的计数），按路径排序即为树的先序遍历
+    def get_folders(self) -> list:
+        with Session(self.engine) as session:
+            folders = session.exec(select(Folder).order_by(Folder.path)).all()
+            return [folder_to_dict(folder) for folder in folders]
+
+    # 收藏夹子树（闭包表一次查询，与深度无关）
+    def get_folder_subtree(self, folder_id: int) -> list:
+        with Session(self.engine) as session:
+            rows = session.exec(
+                select(Folder, FolderClosure.depth)
+                .join(FolderClosure, FolderClosure.descendant_id == Folder.id)
+                .where(FolderClosure.ancestor_id == folder_id)
+                .order_by(Folder.path)
+            ).all()
+            return [dict(folder_to_dict(folder), depth=depth) for folder, depth in rows]
+
+    # 收藏夹中直接收藏的条目，按收藏时间倒序游标分页
+    def get_folder_items(self, folder_id: int, cursor: Optional[int] = None, limit: int = 30) -> dict:
+        with Session(self.engine) as session:
+            query = (
+                select(ClipboardHistory, Favorite.id).options(*_LIST_DEFERRED)
+                .join(Favorite, Favorite.history_uuid == ClipboardHistory.uuid)
+                .where(Favorite.folder_id == folder_id)
+            )
+            if cursor:
+                query = query.where(Favorite.id < cursor)
+            rows = session.exec(query.order_by(Favorite.id.desc()).limit(limit + 1)).all()
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            return {
+                'records': records_to_dicts(session, [item for item, _ in rows]),
+                'next_cursor': rows[-1][1] if has_more else None,
+                'limit': limit
+            }
+
+    # 文本记录的完整内容（/api/history/<id>/content 分段读取用）
+    def get_text_source(self, history_id: int) -> Optional[dict]:
+        """{'clipboard', 'body', 'codec', 'length'（UTF-8 字节数）, 'hash'}，不是文本记录时返回 None"""
+        with Session(self.engine) as session:
+            item = get_history_item(session, history_id)
+            if item is None or item.type != 'Text':
+                return None
+            length = item.content_length
+            if length is None:
+                length = len(text_content(item).encode("utf-8"))
+            return {'clipboard': item.clipboard, 'body': item.body, 'codec': item.body_codec,
+                    'length': length, 'hash': item.content_hash}
 
     # 下载接口，根据checksum获取文件路径
     def get_file_path_by_checksum(self, checksum: str) -> Optional[str]:
         """根据文件校验和获取文件路径"""
         with Session(self.engine) as session:
             backup = session.exec(select(BackupFile).where(BackupFile.checksum == checksum)).first()
-            if backup and os.path.exists(backup.filepath):
+            if backup and backup.pack_id is None and os.path.exists(backup.filepath):
                 return backup.filepath
             return None
 
+    def get_backup_location(self, checksum: str) -> Optional[dict]:
+        """
+        备份内容的位置 {'path', 'offset', 'size', 'name'}：未打包的是备份文件本身（offset 为 None），
+        已打包的是打包文件与内容的起始偏移；文件不存在时返回 None
+        """
+        with Session(self.engine) as session:
+            backup = session.exec(select(BackupFile).where(BackupFile.checksum == checksum)).first()
+            if backup is None:
+                return None
+            name = os.path.basename(backup.filepath)
+            if backup.pack_id is None:
+                if not os.path.exists(backup.filepath):
+                    return None
+                return {'path': backup.filepath, 'offset': None, 'size': backup.size, 'name': name}
+            pack = session.get(BackupPack, backup.pack_id)
+            if pack is None or not os.path.exists(pack.path):
+                return None
+            return {'path': pack.path, 'offset': backup.pack_offset, 'size': backup.size, 'name': name}
+
     # 根据 ID 获取历史记录
     def get_history_by_id(self, history_id: int):
         with Session(self.engine) as session: # 通过 Session 类创建一个数据库会话（session），self.engine 是数据库引擎（已在类中初始化），用于建立与数据库的连接。with 语句确保会话使用完毕后自动关闭，释放资源。
-            # 使用 SQLModel 的 select 方法构建查询语句，指定查询 ClipboardHistory 模型（对应数据库表），并通过 where 条件筛选出 id 等于 history_id 的记录。
-            statement = select(ClipboardHistory).where(ClipboardHistory.id == history_id)
-            result = session.exec(statement).first() # 通过会话的 exec 方法执行查询语句，first() 方法获取查询结果中的第一条记录（因为 id 通常是唯一的，所以最多只有一条结果）。
+            # 主表中没有时到分区中找（已经归档的旧记录同样可以按ID查看）
+            result = get_history_item(session, history_id)
             
             if result:
                 # 将结果转换为字典格式
@@ -323,18 +1793,56 @@ class ServerGet:
                     'id': result.id,
                     'uuid': result.uuid,
                     'type': result.type,
-                    'clipboard': result.clipboard,
+                    'clipboard': text_content(result),
                     'from_equipment': result.from_equipment,
                     'tag': result.tag,
                     'timestamp': result.timestamp.isoformat(),
                     'checksum': result.checksum,
-                    'raw_content': result.raw_content
+                    'raw_content': json.dumps(full_raw_content(result), ensure_ascii=False)
                 }
             return None
 
+def folder_to_dict(folder: Folder) -> dict:
+    return {
+        'id': folder.id,
+        'name': folder.name,
+        'parent_id': folder.parent_id,
+        'path': folder.path,
+        'level': folder.path.count('/') - 2 if folder.path else 0,
+        'item_count': folder.item_count,
+        'total_count': folder.total_count,
+    }
+
 class ServerSet:
+    """所有修改都交给写线程执行"""
     def __init__(self):
-        self.engine = create_engine(f"sqlite:///{Config.DB_PATH}", echo=False)
+        self.engine = get_engine()
+
+    def _write(self, op, *args):
+        from db_writer import get_writer
+        return get_writer().submit(op, *args).result()
+
+    def toggle_star(self, history_id: int) -> bool:
+        return self._write(toggle_star, history_id)
+
+    def create_collection(self, name: str, parent_id: Optional[int] = None) -> int:
+        return self._write(create_folder, name, parent_id)
+
+    def move_collection(self, collection_id: int, parent_id: Optional[int]) -> bool:
+        return self._write(move_folder, collection_id, parent_id)
+
+    def delete_collection(self, collection_id: int) -> int:
+        return self._write(delete_folder, collection_id)
+
+    def add_to_collection(self, collection_id: Optional[int], history_id: int) -> bool:
+        return self._write(add_favorite, collection_id, history_id)
+
+    def remove_from_collection(self, collection_id: Optional[int], history_id: int) -> bool:
+        return self._write(remove_favorite, collection_id, history_id)
+
+    def bulk_update(self, action: str, ids: Optional[list] = None, filters: Optional[dict] = None,
+                    tag: Optional[str] = None, folder_id: Optional[int] = None) -> list:
+        return self._write(bulk_update, action, ids, filters, tag, folder_id)
 
 
 def print_all_tables(engine):
@@ -0,0 +1,185 @@
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from sqlmodel import Session
+from config import Config
+from database import get_engine
+from metrics import metrics
+
+"""
+单写线程：所有数据库修改都通过 submit() 提交到有界队列，
+由唯一的写线程批量取出，在一个事务中执行后统一提交（组提交），
+结果（通常是新记录ID）通过 Future 返回给调用方。
+队列满时提交方阻塞（背压），阻塞次数与时长记入 metrics；停止后不再接受新的操作。
+每次成功提交后变更序号加一（change_sequence），读取方据此判断缓存或 ETag 是否过期。
+"""
+
+_STOP = object()  # 停止标记
+
+class DBWriter:
+    def __init__(self, engine=None, queue_size: int = None, batch_size: int = None, max_delay_ms: float = None):
+        self.engine = engine or get_engine()
+        self.queue = queue.Queue(maxsize=queue_size or Config.WRITER_QUEUE_SIZE)
+        self.batch_size = batch_size or Config.WRITER_BATCH_SIZE
+        self.max_delay = (Config.WRITER_MAX_DELAY_MS if max_delay_ms is None else max_delay_ms) / 1000
+        self.thread = None
+        self.stopping = False
+        # 统计信息
+        self.batches = 0
+        self.items = 0
+        self.failures = 0
+        self.sequence = 0  # 本写线程成功提交的次数
+        self.max_commit_seconds = 0.0  # 自上次 take_max_commit_seconds() 以来单次提交的最长耗时
+
+    def start(self):
+        """启动写线程；停止或意外退出后可以再次启动，队列中未处理的操作继续处理"""
+        if self.thread and self.thread.is_alive():
+            return
+        self.stopping = False
+        self.thread = threading.Thread(target=self._run, name="DBWriter", daemon=True)
+        self.thread.start()
+        metrics.register("writer.queue_depth", self.queue.qsize)
+
+    def submit(self, op, *args, **kwargs) -> Future:
+        """
+        提交一个写操作，op(session, *args, **kwargs) 在写线程中执行，
+        不要在 op 内提交事务。队列满时阻塞（背压）；写线程已停止时抛出 RuntimeError
+        """
+        if self.stopping:
+            raise RuntimeError("写线程已停止，不再接受写操作")
+        future = Future()
+        job = (op, args, kwargs, future)
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            metrics.inc("writer.backpressure")
+            began = time.perf_counter()
+            self.queue.put(job)
+            metrics.observe("writer.backpressure.seconds", time.perf_counter() - began)
+        return future
+
+    def stop(self, timeout: float = 5.0) -> bool:
+        """处理完队列中已有的操作后停止写线程，返回是否在 timeout 秒内处理完"""
+        self.stopping = True
+        if not self.thread or not self.thread.is_alive():
+            return True
+        self.queue.put(_STOP)
+        self.thread.join(timeout=timeout)
+        return not self.thread.is_alive()
+
+    def _collect_batch(self, first) -> tuple:
+        """取出已排队的操作组成一批，最多等待 max_delay 秒凑批"""
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.batch_size:
+            try:
+                remaining = deadline - time.monotonic()
+                job = self.queue.get_nowait() if remaining <= 0 else self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if job is _STOP:
+                return batch, True
+            batch.append(job)
+        return batch, False
+
+    def _run(self):
+        while True:
+            first = self.queue.get()
+            if first is _STOP:
+                break
+            batch, stopping = self._collect_batch(first)
+            self._commit_batch(batch)
+            if stopping:
+                break
+
+    def _commit_batch(self, batch: list):
+        """整批在一个事务中执行；有操作失败时回滚并逐个单独重试，隔离出错的操作"""
+        batch = [job for job in batch if job[3].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        began = time.perf_counter()
+        try:
+            with Session(self.engine) as session:
+                results = [op(session, *args, **kwargs) for op, args, kwargs, _ in batch]
+                session.commit()
+        except Exception:
+            self._commit_one_by_one(batch)
+            return
+        self._record_commit(time.perf_counter() - began)
+        self.batches += 1
+        self.items += len(batch)
+        self.sequence += 1
+        mark_changed()
+        for (_, _, _, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def _commit_one_by_one(self, batch: list):
+        for op, args, kwargs, future in batch:
+            began = time.perf_counter()
+            try:
+                with Session(self.engine) as session:
+                    result = op(session, *args, **kwargs)
+                    session.commit()
+            except Exception as e:
+                self.failures += 1
+                future.set_exception(e)
+            else:
+                self.batches += 1
+                self.items += 1
+                self.sequence += 1
+                mark_changed()
+                self._record_commit(time.perf_counter() - began)
+                future.set_result(result)
+
+    def _record_commit(self, seconds: float):
+        metrics.observe("writer.commit.seconds", seconds)
+        self.max_commit_seconds = max(self.max_commit_seconds, seconds)
+
+    def take_max_commit_seconds(self) -> float:
+        """取出并清零自上次调用以来的最长提交耗时（用于统计某段时间内写入被阻塞的最长时间）"""
+        value, self.max_commit_seconds = self.max_commit_seconds, 0.0
+        return value
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_writer() -> DBWriter:
+    """获取进程内唯一的写线程，首次调用时启动"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = DBWriter()
+            _writer.start()
+        return _writer
+
+# 进程启动标识：变更序号每次启动都从 0 开始，版本号带上它，重启前的 ETag 不会误命中
+BOOT_ID = uuid.uuid4().hex[:8]
+_changes = 0
+_changes_lock = threading.Lock()
+
+def mark_changed():
+    """
+    变更序号加一。写线程每次成功提交后调用；不经过写线程直接提交的（脚本、测试），
+    以及得知其他进程修改了数据库时（如单独运行的监控服务报告新记录）也要调用
+    """
+    global _changes
+    with _changes_lock:
+        _changes += 1
+
+def change_sequence() -> int:
+    """当前进程内数据库的变更序号（只在内存中，启动时为 0）"""
+    return _changes
+
+def data_version() -> str:
+    """数据版本号 "启动标识-变更序号"：数据有任何修改或进程重启后都会变化"""
+    return f"{BOOT_ID}-{_changes}"
+
+def healthy() -> bool:
+    """写线程没有启动过，或者正在运行"""
+    return _writer is None or _writer.stopping or (_writer.thread is not None and _writer.thread.is_alive())
+
+def running_writer():
+    """已经启动的写线程；本进程还没有写入过时返回 None（不会因此启动写线程）"""
+    return _writer
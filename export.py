@@ -0,0 +1,149 @@
+import csv
+import io
+import json
+import os
+import zipfile
+from sqlmodel import Session, select
+from config import Config
+from database import BackupFile, BackupPack, ClipboardHistory, build_history_query, get_engine, iter_history, ms_to_str, text_content
+from packfile import read_range
+
+"""
+流式导出历史记录：NDJSON / CSV / ZIP（NDJSON + 备份文件）
+
+- 查询按批次从数据库游标中取出（yield_per），边读边输出，内存占用与导出总量无关
+- 筛选条件与 build_history_query 相同，压缩存储的文本在导出时解压
+- 已归档的记录在分区文件中，与主表按时间合并后一起导出（见 database.iter_history）
+- ZIP 写入一个不可 seek 的缓冲区，zipfile 会改用数据描述符，每写满一块就交给调用方
+"""
+
+FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "zip": ("application/zip", "zip"),
+}
+
+EXPORT_FIELDS = ["id", "uuid", "type", "ts", "timestamp", "source", "tag", "starred", "occurrences",
+                 "content", "file_name", "checksum"]
+
+def export_record(item: ClipboardHistory) -> dict:
+    """单条记录的导出格式"""
+    try:
+        file_name = json.loads(item.raw_content).get("File")
+    except (json.JSONDecodeError, TypeError, AttributeError):
+        file_name = None
+    return {
+        "id": item.id,
+        "uuid": item.uuid,
+        "type": item.type,
+        "ts": item.ts,
+        "timestamp": ms_to_str(item.ts),
+        "source": item.from_equipment,
+        "tag": item.tag,
+        "starred": item.starred,
+        "occurrences": item.occurrences,
+        "content": text_content(item) if item.type == "Text" else None,
+        "file_name": file_name,
+        "checksum": item.checksum,
+    }
+
+def _iter_items(engine, query):
+    """按批次遍历主表与各分区的查询结果（按时间倒序合并）"""
+    yield from iter_history(engine, query, Config.EXPORT_BATCH_SIZE)
+
+def _ndjson_line(item) -> bytes:
+    return (json.dumps(export_record(item), ensure_ascii=False) + "\n").encode("utf-8")
+
+def iter_ndjson(engine, query):
+    lines, size = [], 0
+    for item in _iter_items(engine, query):
+        line = _ndjson_line(item)
+        lines.append(line)
+        size += len(line)
+        if size >= Config.EXPORT_CHUNK_SIZE:
+            yield b"".join(lines)
+            lines, size = [], 0
+    yield b"".join(lines)
+
+def iter_csv(engine, query):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    buffer.write("\ufeff")  # BOM，Excel 才能正确识别 UTF-8
+    writer.writeheader()
+    for item in _iter_items(engine, query):
+        writer.writerow(export_record(item))
+        if buffer.tell() >= Config.EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+class _StreamSink:
+    """只追加的写入目标（没有 tell/seek），写入的数据由生成器取走"""
+
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        self.size = 0
+        return data
+
+def iter_zip(engine, query):
+    """
+    history.ndjson 放在压缩包开头，随后是引用到的备份文件 files/<校验和>/<文件名>。
+    zipfile 同一时间只能写一个条目，所以分两遍遍历查询（都是流式）
+    """
+    sink = _StreamSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        with archive.open("history.ndjson", "w", force_zip64=True) as entry:
+            for item in _iter_items(engine, query):
+                entry.write(_ndjson_line(item))
+                if sink.size >= Config.EXPORT_CHUNK_SIZE:
+                    yield sink.drain()
+        yield sink.drain()
+
+        written = set()  # 已写入的校验和（多条记录可能引用同一个文件）
+        file_query = query.where(ClipboardHistory.checksum != None)
+        with Session(engine) as session:
+            for item in _iter_items(engine, file_query):
+                if not item.checksum or item.checksum in written:
+                    continue
+                written.add(item.checksum)
+                backup = session.exec(select(BackupFile).where(BackupFile.checksum == item.checksum)).first()
+                if backup is None:
+                    continue
+                # 已打包的备份从打包文件中按偏移读取
+                pack = session.get(BackupPack, backup.pack_id) if backup.pack_id is not None else None
+                path, offset = (pack.path, backup.pack_offset) if pack else (backup.filepath, 0)
+                if not os.path.exists(path):
+                    continue
+                name = os.path.basename(export_record(item)["file_name"] or backup.filepath)
+                # 已压缩的图片/压缩包再压缩收益很小，直接存储
+                with archive.open(zipfile.ZipInfo(f"files/{item.checksum}/{name}"), "w", force_zip64=True) as entry:
+                    for chunk in read_range(path, offset, 0, backup.size, Config.EXPORT_CHUNK_SIZE):
+                        entry.write(chunk)
+                        yield sink.drain()
+    yield sink.drain()
+
+def export_stream(fmt: str, filters: dict = None, engine=None):
+    """
+    构建导出流；筛选条件在这里就会校验（格式错误立即抛出 ValueError，而不是在响应中途出错）
+    :return: (字节块生成器, MIME 类型, 文件扩展名)
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"不支持的导出格式: {fmt}")
+    query = build_history_query(filters)
+    generator = {"ndjson": iter_ndjson, "csv": iter_csv, "zip": iter_zip}[fmt]
+    mimetype, extension = FORMATS[fmt]
+    return generator(engine or get_engine(), query), mimetype, extension
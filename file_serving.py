@@ -0,0 +1,89 @@
+import mimetypes
+import os
+import unicodedata
+from urllib.parse import quote
+from flask import Response, request, send_file
+from werkzeug.datastructures import ContentRange
+from config import Config
+
+"""
+备份文件下载的几种发送方式（Config.DOWNLOAD_OFFLOAD）：
+
+- ""：Flask send_file，支持条件请求与 Range；文件通过 WSGI 服务器的 wsgi.file_wrapper 发送，
+  服务器支持时（如 gunicorn）由它用 sendfile 在内核中拷贝，否则由 Python 分块读取
+- "x-accel-redirect"：只返回 X-Accel-Redirect 头，由前置 nginx 发送文件，
+  nginx 需要一个 internal location 把 Config.DOWNLOAD_ACCEL_PREFIX 映射到 Config.BACKUP_DIR
+- "x-sendfile"：只返回 X-Sendfile 头（Apache mod_xsendfile / lighttpd）
+
+已打包的备份（见 packfile.py）只是打包文件中的一段，前置代理无法只发送其中一段，
+总是由 packed_response 用 pread 读取，支持 Range
+"""
+
+OFFLOAD_MODES = ("", "x-accel-redirect", "x-sendfile")
+
+def _header_offload(file_path: str, download_name: str, mode: str):
+    """只生成响应头，文件内容由前置代理发送"""
+    response = send_file(file_path, as_attachment=True, download_name=download_name)
+    response.close()  # send_file 已打开文件，这里不需要
+    response.response = []
+    response.content_length = 0
+    if mode == "x-accel-redirect":
+        relative = os.path.relpath(file_path, Config.BACKUP_DIR).replace(os.sep, "/")
+        response.headers["X-Accel-Redirect"] = quote(Config.DOWNLOAD_ACCEL_PREFIX.rstrip("/") + "/" + relative)
+    else:
+        response.headers["X-Sendfile"] = file_path
+    return response
+
+def download_response(file_path: str, download_name: str = None):
+    """按 Config.DOWNLOAD_OFFLOAD 生成下载响应，未知的方式（包括已移除的 "sendfile"）按 send_file 处理"""
+    download_name = download_name or os.path.basename(file_path)
+    mode = Config.DOWNLOAD_OFFLOAD
+    if mode == "x-accel-redirect" and os.path.relpath(file_path, Config.BACKUP_DIR).startswith(".."):
+        mode = ""  # 不在备份目录下，nginx 的 location 映射不到
+    if mode in ("x-accel-redirect", "x-sendfile"):
+        return _header_offload(file_path, download_name, mode)
+    return send_file(file_path, as_attachment=True, download_name=download_name)
+
+def _attachment_names(download_name: str) -> dict:
+    """Content-Disposition 的文件名参数，非 ASCII 文件名另加 filename*（与 send_file 相同）"""
+    try:
+        download_name.encode("ascii")
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize("NFKD", download_name).encode("ascii", "ignore").decode("ascii")
+        return {"filename": simple, "filename*": f"UTF-8''{quote(download_name, safe='!#$&+^`|~')}"}
+    return {"filename": download_name}
+
+def ranged_response(read, size: int, mimetype: str, etag: str = None) -> Response:
+    """
+    长度为 size 的内容的响应，支持单个 Range 与 If-None-Match；
+    read(start, end) 返回 [start, end) 的分块迭代器，只在需要发送内容时调用
+    """
+    response = Response(mimetype=mimetype)
+    response.accept_ranges = "bytes"
+    if etag:
+        response.set_etag(etag)
+        if request.if_none_match.contains(etag):
+            response.status_code = 304
+            return response
+    start, end = 0, size
+    if request.range:
+        window = request.range.range_for_length(size)
+        if window is None:
+            response.status_code = 416
+            response.content_range = ContentRange("bytes", None, None, size)
+            return response
+        start, end = window
+        response.status_code = 206
+        response.content_range = ContentRange("bytes", start, end, size)
+    response.response = read(start, end)
+    response.content_length = end - start
+    return response
+
+def packed_response(pack_path: str, offset: int, size: int, download_name: str, etag: str = None):
+    """打包文件中 [offset, offset + size) 这段内容的下载响应，支持单个 Range 与 If-None-Match"""
+    from packfile import read_range
+
+    response = ranged_response(lambda start, end: read_range(pack_path, offset, start, end), size,
+                               mimetypes.guess_type(download_name)[0] or "application/octet-stream", etag)
+    response.headers.set("Content-Disposition", "attachment", **_attachment_names(download_name))
+    return response
@@ -0,0 +1,172 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from watchdog.events import PatternMatchingEventHandler
+from config import Config
+from metrics import metrics
+from sync_roots import root_of
+import database
+
+"""
+file/ 目录的文件预处理：上传的文件一落地就开始计算校验和并备份，不等 SyncClipboard.json 更新
+
+- 文件事件只记录路径，写入停止 Config.FILE_SETTLE_SECONDS 秒（签名不再变化）后才处理
+- 处理时计算 MD5、复制进备份目录、通过写线程登记，并补全已经在等待这个文件的记录
+- 校验和按文件签名缓存，之后 JSON 引用该文件时 link 阶段不用再读文件，只提交元数据
+"""
+
+_CACHE_SIZE = 1024  # 缓存校验和的文件数
+
+def _signature(path: str):
+    """(mtime_ns, size, inode)；文件不存在时返回 None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+class FileStager:
+    def __init__(self, writer=None, settle: float = None):
+        self.writer = writer
+        self.settle = Config.FILE_SETTLE_SECONDS if settle is None else settle
+        self._waiting = {}  # 路径 -> (最近一次变化的时间, 签名)
+        self._checksums = OrderedDict()  # 路径 -> (签名, MD5)
+        self._cond = threading.Condition()
+        self._stopped = False
+        self.thread = None
+        metrics.register("stager.waiting", lambda: len(self._waiting))
+
+    def start(self):
+        """启动预处理线程；停止后可以再次启动，等待中的文件继续处理"""
+        if self.thread and self.thread.is_alive():
+            return
+        self._stopped = False
+        self.thread = threading.Thread(target=self._run, name="FileStager", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout: float = 2.0):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self.thread:
+            self.thread.join(timeout=timeout)
+
+    def touch(self, path: str):
+        """文件有变化（watchdog 线程中调用，只记录，不读文件）"""
+        path = os.path.abspath(path)
+        with self._cond:
+            self._waiting[path] = (time.monotonic(), _signature(path))
+            self._cond.notify()
+
+    def cached_checksum(self, path: str):
+        """文件自预处理以来没有变化时返回缓存的 MD5，否则返回 None"""
+        path = os.path.abspath(path)
+        with self._cond:
+            cached = self._checksums.get(path)
+        if cached and cached[0] == _signature(path):
+            metrics.inc("stager.cache_hits")
+            return cached[1]
+        return None
+
+    def _remember(self, path: str, signature, checksum: str):
+        with self._cond:
+            self._checksums[path] = (signature, checksum)
+            self._checksums.move_to_end(path)
+            while len(self._checksums) > _CACHE_SIZE:
+                self._checksums.popitem(last=False)
+
+    def stage(self, path: str, checksum: str = None, link: bool = False) -> int:
+        """
+        计算校验和、备份并登记，补全等待该文件的记录，返回补全的记录数
+        :param checksum: 已经算好的 MD5（如 WebDAV 接收时边收边算的）
+        :param link: 用硬链接代替复制（源文件只会被整体替换时）
+        """
+        path = os.path.abspath(path)
+        signature = _signature(path)
+        if signature is None:
+            return 0
+        began = time.perf_counter()
+        checksum = checksum or self.cached_checksum(path) or database.file_md5(path)
+        self._remember(path, signature, checksum)
+        name = os.path.basename(path)
+        backup = {'checksum': checksum, 'filepath': None, 'size': None}
+        if not database.backup_exists(checksum):
+            backup['filepath'] = database.copy_to_backup(path, name, checksum, link=link)
+            backup['size'] = os.path.getsize(backup['filepath'])
+        resolved = self._write(database.resolve_pending_files, name, backup, root_of(path))
+        metrics.inc("stager.staged")
+        metrics.observe("stager.seconds", time.perf_counter() - began)
+        if resolved:
+            metrics.inc("stager.resolved", resolved)
+            print(f"文件已到达，补全 {resolved} 条记录: {name}")
+        return resolved
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped and not self._due():
+                    timeout = None
+                    if self._waiting:
+                        earliest = min(changed for changed, _ in self._waiting.values())
+                        timeout = max(0.0, earliest + self.settle - time.monotonic())
+                    self._cond.wait(timeout)
+                if self._stopped:
+                    return
+                due = self._due()
+                for path, _ in due:
+                    del self._waiting[path]
+            for path, signature in due:
+                current = _signature(path)
+                if current is None:
+                    continue  # 已被删除或改名
+                if current != signature:
+                    # 还在写入，重新计时
+                    with self._cond:
+                        self._waiting.setdefault(path, (time.monotonic(), current))
+                    continue
+                try:
+                    self.stage(path)
+                except Exception as e:
+                    metrics.inc("stager.errors")
+                    print(f"预处理文件出错 {path}: {e}")
+
+    def _due(self) -> list:
+        """已经静止够久的 [(路径, 签名)]（调用方持有锁）"""
+        now = time.monotonic()
+        return [(path, signature) for path, (changed, signature) in self._waiting.items()
+                if now - changed >= self.settle]
+
+    def _write(self, op, *args):
+        if self.writer is None:
+            from db_writer import get_writer
+            self.writer = get_writer()
+        return self.writer.submit(op, *args).result()
+
+class FileStageHandler(PatternMatchingEventHandler):
+    """file/ 目录的监控处理器：忽略隐藏文件（WebDAV 上传的临时文件以 . 开头）"""
+
+    def __init__(self, stager: FileStager):
+        super().__init__(ignore_patterns=[".*"], ignore_directories=True)
+        self.stager = stager
+
+    def on_created(self, event):
+        self.stager.touch(event.src_path)
+
+    def on_modified(self, event):
+        self.stager.touch(event.src_path)
+
+    def on_moved(self, event):
+        self.stager.touch(event.dest_path)
+
+_stager = None
+_stager_lock = threading.Lock()
+
+def get_stager() -> FileStager:
+    """获取进程内唯一的文件预处理器，首次调用时启动"""
+    global _stager
+    with _stager_lock:
+        if _stager is None:
+            _stager = FileStager()
+            _stager.start()
+        return _stager
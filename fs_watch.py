@@ -0,0 +1,138 @@
+import fnmatch
+import os
+import threading
+from watchdog.events import FileCreatedEvent, FileDeletedEvent, FileModifiedEvent, FileMovedEvent
+from watchdog.observers import Observer
+from config import Config
+from metrics import metrics
+
+"""
+文件监控的观察者选择：
+
+- 本地文件系统用 watchdog 默认的 Observer（inotify 等），只订阅需要的事件类型
+- NFS / SMB 等网络文件系统上 inotify 收不到其他机器的写入，改用 AdaptivePollingObserver：
+  只 stat 与处理器模式匹配的路径（有通配符时才列目录），用缓存的签名比对变化；
+  有变化后立即加快轮询，空闲时逐步退避到最长间隔，没有活动时几乎不占 CPU
+"""
+
+WATCH_EVENTS = [FileCreatedEvent, FileModifiedEvent, FileMovedEvent]  # 关心的事件类型（在订阅时就过滤）
+
+def mount_fstype(path: str) -> str:
+    """路径所在挂载点的文件系统类型（读取 /proc/mounts，取最长匹配的挂载点）；无法判断时返回空字符串"""
+    path = os.path.realpath(path)
+    best, fstype = "", ""
+    try:
+        with open("/proc/mounts", encoding="utf-8") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point = fields[1].replace("\\040", " ")
+                inside = path == mount_point or path.startswith(mount_point.rstrip("/") + "/")
+                if inside and len(mount_point) >= len(best):
+                    best, fstype = mount_point, fields[2]
+    except OSError:
+        pass
+    return fstype
+
+def is_network_filesystem(path: str) -> bool:
+    fstype = mount_fstype(path)
+    return fstype in Config.NETWORK_FS_TYPES or fstype.startswith("fuse.")
+
+def create_observer(*paths: str):
+    """
+    按 Config.WATCH_MODE 创建观察者：inotify / polling / auto（网络文件系统上自动改用轮询）。
+    多个同步目录共用一个观察者，其中任何一个在网络文件系统上时都用轮询
+    """
+    mode = Config.WATCH_MODE
+    if mode == "auto":
+        mode = "polling" if any(is_network_filesystem(path) for path in paths) else "inotify"
+    print(f"文件监控方式: {mode}（{', '.join(paths)}）")
+    return AdaptivePollingObserver() if mode == "polling" else Observer()
+
+def _signature(stat: os.stat_result) -> tuple:
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+class _PollWatch:
+    """一个被轮询的目录：只关心与处理器模式匹配的文件"""
+
+    def __init__(self, handler, path: str):
+        self.handler = handler
+        self.path = os.path.abspath(path)
+        self.patterns = list(getattr(handler, "patterns", None) or ["*"])
+        # 模式都不含通配符时逐个 stat 即可，不必列出整个目录
+        self.literal = all(not any(c in p for c in "*?[") for p in self.patterns)
+        self.signatures = self.scan()
+
+    def scan(self) -> dict:
+        """当前匹配文件的签名 {路径: (mtime_ns, size, inode)}"""
+        result = {}
+        if self.literal:
+            for name in self.patterns:
+                path = os.path.join(self.path, os.path.basename(name))
+                try:
+                    result[path] = _signature(os.stat(path))
+                except OSError:
+                    pass
+            return result
+        try:
+            with os.scandir(self.path) as entries:
+                for entry in entries:
+                    if entry.is_file() and any(fnmatch.fnmatch(entry.name, p) for p in self.patterns):
+                        result[entry.path] = _signature(entry.stat())
+        except OSError:
+            pass
+        return result
+
+    def poll(self) -> int:
+        """比对签名并分发事件，返回变化的文件数"""
+        current = self.scan()
+        changes = 0
+        for path, signature in current.items():
+            previous = self.signatures.get(path)
+            if previous == signature:
+                continue
+            changes += 1
+            # inode 变化说明文件被整体替换（临时文件改名），与 inotify 一样报告为修改
+            self.handler.dispatch(FileCreatedEvent(path) if previous is None else FileModifiedEvent(path))
+        for path in self.signatures.keys() - current.keys():
+            changes += 1
+            self.handler.dispatch(FileDeletedEvent(path))
+        self.signatures = current
+        return changes
+
+class AdaptivePollingObserver(threading.Thread):
+    """与 watchdog Observer 接口一致（schedule / start / stop / join）的自适应轮询观察者"""
+
+    def __init__(self, min_interval: float = None, max_interval: float = None):
+        super().__init__(name="PollingObserver", daemon=True)
+        self.min_interval = Config.POLL_MIN_INTERVAL if min_interval is None else min_interval
+        self.max_interval = Config.POLL_MAX_INTERVAL if max_interval is None else max_interval
+        self.interval = self.min_interval
+        self.watches = []
+        self._stop_event = threading.Event()
+        metrics.register("watch.poll_interval", lambda: round(self.interval, 3))
+
+    def schedule(self, event_handler, path: str, *, recursive: bool = False, event_filter=None):
+        """只支持非递归监控（同步目录与 file/ 都是单层）"""
+        watch = _PollWatch(event_handler, path)
+        self.watches.append(watch)
+        return watch
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            changes = 0
+            for watch in self.watches:
+                try:
+                    changes += watch.poll()
+                except Exception as e:
+                    print(f"轮询监控出错: {e}")
+            metrics.inc("watch.polls")
+            if changes:
+                metrics.inc("watch.poll_changes", changes)
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.interval * Config.POLL_BACKOFF, self.max_interval)
+
+    def stop(self):
+        self._stop_event.set()
@@ -1,63 +1,55 @@
 import time
-import json
-import socketio
 import threading
 import os
 import re
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
+from watchdog.events import PatternMatchingEventHandler
+from broadcast import monitor_auth
 from config import Config
-from database import add_history_item_from_json
+from file_stager import FileStageHandler, get_stager
+from fs_watch import WATCH_EVENTS, create_observer
+from ingest_pipeline import get_pipeline
+from sync_roots import files_dir, sync_roots
 
 """
-​主线程​​：通过watchdog监控文件变化（同步阻塞）
-​​子线程​​：专门处理通知队列（异步非阻塞）
+​主线程​​：通过watchdog监控文件变化，只把变化放入写入流水线
+​​流水线线程​​：解析、备份文件、写库、发送通知（见 ingest_pipeline.py）
+​​预处理线程​​：file/ 下的文件落地后即计算校验和并备份（见 file_stager.py）
+多个同步目录（见 sync_roots.py）共用同一个观察者与处理器，按路径区分根目录
+监控、备份文件夹清理的生命周期由 supervisor.py 管理（见 start.py）
 """
 
-SOCKETIO_SERVER = 'http://localhost:5000'
+SOCKETIO_SERVER = f'http://localhost:{Config.WEB_PORT}'
 
-class JSONChangeHandler(FileSystemEventHandler):
+class JSONChangeHandler(PatternMatchingEventHandler):
     def __init__(self):
-        self.last_content = self.get_current_content()
+        # 在分发之前按文件名过滤，同目录下的其他文件不会进入回调
+        super().__init__(patterns=[Config.SYNC_CLIPBOARD_JSON_FILE], ignore_directories=True, case_sensitive=True)
+        import socketio  # 延迟导入：只有真正启动监控时才加载 Socket.IO 客户端
         self.sio = socketio.Client(reconnection=True, reconnection_attempts=5, reconnection_delay=1)
         self.connected = False
-        self.notification_queue = []  # 通知队列
-        self.notification_thread = None
-        self.stop_notification = threading.Event()
-        
-        # 启动后台通知线程
-        self.start_notification_thread()
 
-    def start_notification_thread(self):
-        """启动后台通知线程"""
-        if self.notification_thread and self.notification_thread.is_alive():
-            return
-            
-        self.notification_thread = threading.Thread(
-            target=self.process_notification_queue,
-            daemon=True
-        )
-        self.notification_thread.start()
-
-    def process_notification_queue(self):
-        """在独立的线程中处理通知：处理通知队列的后台线程"""
-        while not self.stop_notification.is_set():
-            if self.notification_queue:
-                event_type = self.notification_queue.pop(0)
-                self._send_notification(event_type)
-            time.sleep(0.1)  # 避免CPU空转
-
-    def _send_notification(self, event_type):
-        """实际发送通知的方法"""
+        # 解析、复制、写库、通知都在流水线的各阶段线程中完成，watchdog 线程只负责入队
+        # 流水线与 WebDAV 上传共用（进程内唯一）
+        self.pipeline = get_pipeline()
+        self.pipeline.add_listener(self._notify_item)
+
+    def _notify_item(self, item):
+        """新记录的根目录、ID、类型与来源设备，服务器据此只推送给相关视图的网页"""
+        data = item.data or {}
+        self._send_notification('history_update', {'root': item.root_id, 'id': item.history_id,
+                                                   'type': data.get('Type'), 'device': data.get('From') or ''})
+
+    def _send_notification(self, event_type, data=None):
+        """实际发送通知的方法（在流水线 notify 阶段线程中执行）"""
         try:
             if not self.connected:
                 # 尝试连接（带超时）
-                self.sio.connect(SOCKETIO_SERVER, wait_timeout=5) # 连接Socket.IO服务器
+                self.sio.connect(SOCKETIO_SERVER, auth=monitor_auth(), wait_timeout=5) # 连接Socket.IO服务器
                 self.connected = True
                 print("Socket.IO 连接成功")
             
             if self.connected:
-                self.sio.emit(event_type) # ⭐发送通知⭐
+                self.sio.emit(event_type, data) # ⭐发送通知⭐（服务器按根目录转发到对应房间）
                 print(f"已发送 {event_type} 通知")
         except Exception as e:
             
@@ -67,51 +59,82 @@ class JSONChangeHandler(FileSystemEventHandler):
             # 短暂延迟后重试连接
             time.sleep(1)
 
-    def get_current_content(self):
-        try:
-            with open(Config.SYNC_CLIPBOARD_JSON_PATH, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"读取JSON文件错误: {e}")
-            return {}
-
-    def on_modified(self, event): # 处理文件修改事件
-        if event.src_path.endswith("SyncClipboard.json"): # 仅处理特定文件
-            try:
-                current_content = self.get_current_content()
-                if current_content != self.last_content:
-                    self.last_content = current_content
-
-                    new_id = add_history_item_from_json(current_content)  # 将JSON内容添加到历史记录
-                    print("已更新历史记录", new_id)
-                    
-                    # 将通知加入队列（非阻塞）
-                    self.notification_queue.append('history_update')
-                    
-            except Exception as e:
-                print(f"处理JSON变更错误: {e}")
+    def on_modified(self, event): # 处理文件修改事件（已按文件名过滤）
+        self.pipeline.submit(event.src_path)  # 只入队，不阻塞 watchdog 线程
+
+    def on_created(self, event): # 删除后重新创建
+        self.pipeline.submit(event.src_path)
+
+    def on_moved(self, event): # 写临时文件再改名覆盖（很多 WebDAV 服务器这样保存）
+        if os.path.basename(event.dest_path) == Config.SYNC_CLIPBOARD_JSON_FILE:
+            self.pipeline.submit(event.dest_path)
 
     def stop(self):
-        """停止后台线程"""
-        self.stop_notification.set()
-        if self.notification_thread and self.notification_thread.is_alive():
-            self.notification_thread.join(timeout=2.0)
+        """断开 Socket.IO 连接（流水线是共享的，由 supervisor 停止）"""
         if self.connected:
             self.sio.disconnect()
+            self.connected = False
+
+class Monitor:
+    """
+    同步目录监控：run() 启动观察者并运行到 stop_event 被设置；观察者线程意外退出时返回，由 supervisor 重启。
+    处理器只创建一次，重启时只重建观察者（流水线的通知回调不会重复注册）
+    """
+
+    def __init__(self):
+        self.event_handler = JSONChangeHandler()
+        self.stage_handler = FileStageHandler(get_stager())
+        self.observer = None
+
+    def _create_observer(self):
+        roots = sync_roots()
+        observer = create_observer(*roots.values())
+        for root_id, watch_dir in roots.items():
+            # 只监控各个 SyncClipboard.json 所在目录（不是当前工作目录）
+            observer.schedule(self.event_handler, path=watch_dir, recursive=False, event_filter=WATCH_EVENTS)
+            # file/ 下的文件一落地就预处理（计算校验和、备份），JSON 引用它时只需提交元数据
+            root_files = files_dir(root_id)
+            os.makedirs(root_files, exist_ok=True)
+            observer.schedule(self.stage_handler, path=root_files, recursive=False, event_filter=WATCH_EVENTS)
+        return observer
+
+    def run(self, stop_event: threading.Event):
+        self.observer = self._create_observer()
+        self.observer.start()
+        print("监控服务已启动...")
+        try:
+            while not stop_event.wait(1):
+                if not self.observer.is_alive():
+                    raise RuntimeError("文件监控线程意外退出")
+        finally:
+            self.observer.stop()
+            self.observer.join(timeout=5)
+
+    def healthy(self) -> bool:
+        return self.observer is not None and self.observer.is_alive()
+
+    def stop(self, timeout: float = 5.0) -> bool:
+        """停止观察者，不再产生新的变化（通知连接保留，排空流水线时还要发送通知）"""
+        if self.observer is None:
+            return True
+        self.observer.stop()
+        self.observer.join(timeout=timeout)
+        return not self.observer.is_alive()
 
 def main():
-    event_handler = JSONChangeHandler()
-    observer = Observer()
-    observer.schedule(event_handler, path='.', recursive=False)
-    observer.start()
+    """单独运行监控，直到 Ctrl+C"""
+    stop_event = threading.Event()
+    monitor = Monitor()
     try:
-        print("监控服务已启动...")
-        while True:
-            time.sleep(1)
+        monitor.run(stop_event)
     except KeyboardInterrupt:
-        observer.stop()
-        event_handler.stop()  # 确保停止后台线程
-    observer.join()
+        stop_event.set()
+    monitor.stop()
+    pipeline = get_pipeline()
+    pipeline.close()
+    pipeline.drain(timeout=Config.SHUTDOWN_DEADLINE)
+    pipeline.stop()
+    monitor.event_handler.stop()
 
 ###################
 ## 监控文件夹大小并删除最旧的文件
@@ -155,9 +178,11 @@ def parse_size(size_str):
     return int(size * units[unit])
 
 def get_folder_size(folder_path):
-    """计算文件夹的总大小（字节）"""
+    """计算文件夹的总大小（字节）；打包文件目录（Config.PACK_DIR）即使配置在其中也不计算，其中的文件不会被删除"""
     total_size = 0
+    pack_dir = os.path.abspath(Config.PACK_DIR)
     for dirpath, dirnames, filenames in os.walk(folder_path):
+        dirnames[:] = [d for d in dirnames if os.path.abspath(os.path.join(dirpath, d)) != pack_dir]
         for f in filenames:
             fp = os.path.join(dirpath, f)
             # 只计算文件大小，忽略符号链接
@@ -212,9 +237,10 @@ def format_size(size_bytes):
     
     return f"{size:.2f} {units[unit_index]}"
 
-def monitor_backup_folder(folder_path, max_size_str, check_interval=60):
+def monitor_backup_folder(folder_path, max_size_str, check_interval=60, stop_event=None):
     """
     监控文件夹大小并删除最旧的文件，直到大小低于指定阈值
+    :param stop_event: 设置后退出（由 supervisor 管理时传入），不传时一直运行到 Ctrl+C
     """
     if not os.path.exists(folder_path):
         print(f"错误: 文件夹 {folder_path} 不存在")
@@ -230,10 +256,12 @@ def monitor_backup_folder(folder_path, max_size_str, check_interval=60):
     print(f"最大允许大小: {max_size_str} ({format_size(max_size)})")
     print(f"检查间隔: {check_interval} 秒")
     
+    stop_event = stop_event or threading.Event()
     try:
         while True:
             delete_oldest_files(folder_path, max_size)
-            time.sleep(check_interval)
+            if stop_event.wait(check_interval):
+                break
     except KeyboardInterrupt:
         print("\n监控已停止")
 
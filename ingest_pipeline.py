@@ -0,0 +1,348 @@
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+from config import Config
+from metrics import metrics
+from sync_roots import DEFAULT_ROOT, json_path, root_of, sync_roots
+import database
+
+"""
+分阶段的剪贴板写入流水线：detect → parse → link → commit → notify
+
+- 每个阶段有自己的有界队列和工作线程，watchdog 回调只负责把路径放进 detect 队列
+- 同一来源（同一个 SyncClipboard.json）的条目总是落在各阶段的同一条工作通道里，按 FIFO 处理
+- 每个根目录（见 sync_roots.py）在各阶段有自己的工作通道和线程，互不阻塞
+- 排序时间戳在 detect 阶段打上；文本不经过 link 阶段，
+  所以即使前一个大文件还在复制，后面的文本也能立即提交，且列表顺序仍与复制顺序一致
+- 每个阶段统计处理数、失败数、耗时和队列长度（见 metrics），队列满、上游被阻塞时记为背压
+- 关闭时先停止接收（close），再在期限内排空已接收的条目（drain），最后停止各阶段线程
+"""
+
+_STOP = object()  # 停止标记
+
+@dataclass
+class IngestItem:
+    path: str  # 发生变化的 JSON 文件（绝对路径）
+    source: str  # 来源键，同一来源在每个阶段内保持顺序
+    root_id: str = DEFAULT_ROOT  # 所属根目录
+    ts: int = 0  # 检测到变化时的毫秒时间戳
+    seq: int = 0  # 检测到变化的顺序号（同一毫秒内的变化也能区分先后）
+    data: Optional[dict] = None  # 解析后的 JSON 内容
+    backup: Optional[dict] = None  # 文件备份结果
+    history_id: Optional[int] = None  # 提交后的记录ID
+
+class Stage:
+    """
+    流水线中的一个阶段：每个根目录一组工作线程（首次用到时创建），
+    根目录内按来源分片到固定的工作线程，每个线程一个有界队列
+    """
+
+    def __init__(self, pipeline, name: str, handler, workers: int = 1, queue_size: int = 256):
+        self.pipeline = pipeline
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.lanes = {}  # 根目录ID -> 该根目录的工作通道
+        self._workers = {}  # 根目录ID -> 各通道的工作线程（与 lanes 一一对应）
+        self._lock = threading.Lock()
+        metrics.register(f"pipeline.{name}.queue_depth", self.depth)
+
+    @property
+    def threads(self) -> list:
+        return [thread for threads in list(self._workers.values()) for thread in threads]
+
+    def start(self, root_ids=()):
+        """创建各根目录的工作通道；停止后再次调用时，重新启动已经退出的线程，通道中未处理的条目继续处理"""
+        for root_id in root_ids:
+            self._lanes_of(root_id)
+        with self._lock:
+            for root_id, lanes in self.lanes.items():
+                threads = self._workers[root_id]
+                for index, lane in enumerate(lanes):
+                    if not threads[index].is_alive():
+                        threads[index] = self._spawn(root_id, index, lane)
+
+    def _spawn(self, root_id: str, index: int, lane: queue.Queue) -> threading.Thread:
+        thread = threading.Thread(target=self._work, args=(lane,),
+                                  name=f"Ingest-{self.name}-{root_id}-{index}", daemon=True)
+        thread.start()
+        return thread
+
+    def _lanes_of(self, root_id: str) -> list:
+        lanes = self.lanes.get(root_id)
+        if lanes is not None:
+            return lanes
+        with self._lock:
+            if root_id not in self.lanes:
+                lanes = [queue.Queue(maxsize=self.queue_size) for _ in range(self.workers)]
+                self._workers[root_id] = [self._spawn(root_id, index, lane) for index, lane in enumerate(lanes)]
+                self.lanes[root_id] = lanes
+            return self.lanes[root_id]
+
+    def _all_lanes(self) -> list:
+        return [lane for lanes in list(self.lanes.values()) for lane in lanes]
+
+    def submit(self, key: str, item: IngestItem):
+        """放入对应通道，队列满时阻塞（背压传给同一根目录的上游阶段）"""
+        lanes = self._lanes_of(item.root_id)
+        lane = lanes[hash(key) % len(lanes)]
+        try:
+            lane.put_nowait((key, item))
+        except queue.Full:
+            metrics.inc(f"pipeline.{self.name}.backpressure")
+            began = time.perf_counter()
+            lane.put((key, item))
+            metrics.observe(f"pipeline.{self.name}.backpressure.seconds", time.perf_counter() - began)
+
+    def depth(self) -> int:
+        return sum(lane.qsize() for lane in self._all_lanes())
+
+    def capacity(self) -> int:
+        return self.queue_size * len(self._all_lanes())
+
+    def join(self, deadline: float = None) -> bool:
+        """等待已放入的条目全部处理完；deadline 为 time.monotonic() 的截止时间，超时返回 False"""
+        for lane in self._all_lanes():
+            with lane.all_tasks_done:
+                while lane.unfinished_tasks:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    lane.all_tasks_done.wait(remaining)
+        return True
+
+    def stop(self, timeout: float = 2.0):
+        # 已经退出的线程不放停止标记，否则重新启动后的线程一取出就会退出
+        workers = [(lane, thread) for root_id, lanes in list(self.lanes.items())
+                   for lane, thread in zip(lanes, self._workers[root_id])]
+        for lane, thread in workers:
+            if thread.is_alive():
+                lane.put(_STOP)
+        for lane, thread in workers:
+            thread.join(timeout=timeout)
+
+    def _work(self, lane: queue.Queue):
+        while True:
+            job = lane.get()
+            if job is _STOP:
+                lane.task_done()
+                break
+            key, item = job
+            began = time.perf_counter()
+            try:
+                routed = self.handler(item)
+                metrics.inc(f"pipeline.{self.name}.processed")
+                if routed:
+                    next_stage, next_item = routed
+                    self.pipeline.stages[next_stage].submit(key, next_item)
+            except Exception as e:
+                metrics.inc(f"pipeline.{self.name}.errors")
+                print(f"写入流水线 {self.name} 阶段出错: {e}")
+            finally:
+                metrics.observe(f"pipeline.{self.name}.seconds", time.perf_counter() - began)
+                lane.task_done()
+
+class IngestPipeline:
+    ORDER = ("detect", "parse", "link", "commit", "notify")
+
+    def __init__(self, notify=None, writer=None, initial_content: dict = None):
+        """
+        :param notify: 提交成功后的回调 notify(item)，也可以之后用 add_listener 添加
+        :param writer: 写线程，默认使用共享写线程
+        :param initial_content: {JSON路径: 当前内容}，启动时已存在的内容不重复写入
+        """
+        self.listeners = [notify] if notify else []
+        self.writer = writer
+        self.closed = False  # 关闭后不再接收新的变化
+        self._signatures = {}  # 路径 -> (mtime_ns, size)，过滤重复的修改事件
+        # 路径 -> 已写入的最新内容（按检测顺序，不按提交先后）及其顺序号；启动时已有的内容顺序号为 0
+        self._last_content = {os.path.abspath(k): v for k, v in (initial_content or {}).items()}
+        self._last_seq = {}
+        self._inflight = {}  # 路径 -> {顺序号: 内容}，已经通过 parse、还没有提交完成的条目
+        self._sequence = itertools.count(1)
+        self._content_lock = threading.Lock()
+        handlers = {
+            "detect": self._detect,
+            "parse": self._parse,
+            "link": self._link,
+            "commit": self._commit,
+            "notify": self._notify,
+        }
+        self.stages = {
+            name: Stage(self, name, handlers[name], Config.PIPELINE_WORKERS.get(name, 1), Config.PIPELINE_QUEUE_SIZE)
+            for name in self.ORDER
+        }
+
+    def start(self):
+        """启动各阶段；停止（close + stop）后再次调用时重新接收变化，只重启已经退出的线程"""
+        if self.writer is None:
+            from db_writer import get_writer
+            self.writer = get_writer()
+        self.closed = False
+        for stage in self.stages.values():
+            stage.start(sync_roots())
+
+    def add_listener(self, notify):
+        """添加提交成功后的回调 notify(item)"""
+        self.listeners.append(notify)
+
+    def submit(self, path: str, source: Optional[str] = None, data: Optional[dict] = None,
+               root_id: Optional[str] = None):
+        """
+        入口：只做入队，立即返回
+        :param data: 已经拿到的 JSON 内容（如 WebDAV 上传），不再从磁盘读取
+        :param root_id: 所属根目录，默认按路径判断
+        """
+        if self.closed:
+            raise RuntimeError("写入流水线正在关闭，不再接收新的变化")
+        path = os.path.abspath(path)
+        item = IngestItem(path=path, source=source or path, root_id=root_id or root_of(path), data=data)
+        self.stages["detect"].submit(item.source, item)
+
+    def drain(self, timeout: float = None, until: str = "notify") -> bool:
+        """
+        等待已接收的变化处理完（条目只会向后流动，按阶段顺序等待即可），
+        timeout 秒内没有处理完时返回 False
+        :param until: 只等到这个阶段，如 "commit"（已经写入数据库，通知不用等）
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        names = self.ORDER[:self.ORDER.index(until) + 1]
+        return all(self.stages[name].join(deadline) for name in names)
+
+    def close(self):
+        """停止接收新的变化（已接收的继续处理）"""
+        self.closed = True
+
+    def backlog(self) -> dict:
+        """各阶段的 {'depth', 'capacity'}"""
+        return {name: {'depth': stage.depth(), 'capacity': stage.capacity()} for name, stage in self.stages.items()}
+
+    def stop(self, timeout: float = 2.0):
+        for name in self.ORDER:
+            self.stages[name].stop(timeout)
+
+    ###################
+    ## 各阶段处理函数，返回 (下一阶段, 条目) 或 None（结束）
+    ###################
+
+    def _detect(self, item: IngestItem):
+        """用文件签名过滤重复事件，并打上排序时间戳"""
+        try:
+            stat = os.stat(item.path)
+        except FileNotFoundError:
+            if item.data is None:
+                return None
+            stat = None
+        signature = (stat.st_mtime_ns, stat.st_size) if stat else None
+        # 自带内容的条目总是继续处理；记下签名，让同一次写入随后触发的文件事件被过滤掉
+        if item.data is None and self._signatures.get(item.path) == signature:
+            return None
+        self._signatures[item.path] = signature
+        item.ts = database.now_ms()
+        item.seq = next(self._sequence)
+        return ("parse", item)
+
+    def _parse(self, item: IngestItem):
+        """读取 JSON，内容未变化则丢弃；带文件的条目进入 link 阶段，文本直接提交"""
+        data = item.data
+        if data is None:
+            try:
+                with open(item.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                # 可能读到写了一半的文件，清除签名让下一个修改事件重新读取
+                self._signatures.pop(item.path, None)
+                print(f"读取JSON文件错误: {e}")
+                return None
+        if not isinstance(data, dict):
+            return None
+        with self._content_lock:
+            # 与之前最新的一次变化比较：还在提交中的条目比已写入的新（同一路径按检测顺序经过 parse）
+            inflight = self._inflight.setdefault(item.path, {})
+            latest = inflight[max(inflight)] if inflight else self._last_content.get(item.path)
+            if data == latest:
+                return None
+            inflight[item.seq] = data
+        item.data = data
+        if data.get("Type") in ("File", "Image", "Group") and data.get("File"):
+            return ("link", item)
+        return ("commit", item)
+
+    def _link(self, item: IngestItem):
+        """复制/计算校验和（文件 IO 都在这里，不占用写线程）"""
+        from file_stager import get_stager
+
+        # 文件落地时已经预处理过的，直接用缓存的校验和
+        src_path = database.source_file_path(item.data["File"], item.root_id)
+        try:
+            item.backup = database.stage_backup_file(item.data, checksum=get_stager().cached_checksum(src_path),
+                                                     root_id=item.root_id)
+        except Exception:
+            self._settle(item, committed=False)
+            raise
+        return ("commit", item)
+
+    def _commit(self, item: IngestItem):
+        """交给写线程组提交，只写元数据"""
+        try:
+            item.history_id = self.writer.submit(
+                database.ingest_history_item, item.data, item.backup, item.ts, item.root_id
+            ).result()
+        except Exception:
+            self._settle(item, committed=False)
+            raise
+        self._settle(item, committed=True)
+        print("已更新历史记录", item.history_id)
+        if item.backup and item.backup.get("pending"):
+            # 文件可能恰好在检查之后、登记等待之前落地，再让预处理器看一次
+            from file_stager import get_stager
+            get_stager().touch(database.source_file_path(item.backup["pending"], item.root_id))
+        return ("notify", item)
+
+    def _settle(self, item: IngestItem, committed: bool):
+        """
+        条目提交完成：成功后才记为已写入的内容（之后相同的内容不再写入）；失败时不记，同样的内容下次变化时还会重新写入。
+        文本不经过 link 阶段，可能比先检测到的文件条目先提交，所以只有比已记录的更新时才替换
+        """
+        with self._content_lock:
+            self._inflight.get(item.path, {}).pop(item.seq, None)
+            if committed and item.seq > self._last_seq.get(item.path, 0):
+                self._last_content[item.path] = item.data
+                self._last_seq[item.path] = item.seq
+
+    def _notify(self, item: IngestItem):
+        for notify in self.listeners:
+            notify(item)
+        return None
+
+def read_json_file(path: str) -> dict:
+    """读取 JSON 文件，不存在或格式错误时返回空字典"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+def get_pipeline() -> IngestPipeline:
+    """
+    获取进程内唯一的写入流水线，首次调用时启动。
+    文件监控与 WebDAV 上传共用它，同一个 JSON 的变化无论从哪里来都按顺序、只写入一次
+    """
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            paths = [json_path(root_id) for root_id in sync_roots()]
+            _pipeline = IngestPipeline(initial_content={path: read_json_file(path) for path in paths})
+            from renderer import get_render_pool
+            _pipeline.add_listener(get_render_pool().submit_item)  # 新文本在后台预先渲染
+            _pipeline.start()
+        return _pipeline
@@ -0,0 +1,56 @@
+import threading
+
+"""
+进程内运行指标：计数器、数值、耗时统计，以及在读取时才计算的动态指标。
+通过 /api/metrics 以 JSON 形式输出。
+"""
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._values = {}
+        self._timings = {}
+        self._providers = {}
+
+    def inc(self, name: str, value: int = 1):
+        """计数器累加"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set(self, name: str, value):
+        """设置当前值（覆盖）"""
+        with self._lock:
+            self._values[name] = value
+
+    def observe(self, name: str, seconds: float):
+        """记录一次耗时，统计次数、总耗时和最大耗时"""
+        with self._lock:
+            timing = self._timings.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0})
+            timing['count'] += 1
+            timing['total'] += seconds
+            timing['max'] = max(timing['max'], seconds)
+
+    def register(self, name: str, provider):
+        """注册动态指标，provider() 在读取指标时调用（如队列长度）"""
+        with self._lock:
+            self._providers[name] = provider
+
+    def snapshot(self) -> dict:
+        """导出当前所有指标"""
+        with self._lock:
+            result = dict(self._counters)
+            result.update(self._values)
+            for name, timing in self._timings.items():
+                result[f"{name}.count"] = timing['count']
+                result[f"{name}.total_seconds"] = round(timing['total'], 6)
+                result[f"{name}.max_seconds"] = round(timing['max'], 6)
+            providers = list(self._providers.items())
+        for name, provider in providers:
+            try:
+                result[name] = provider()
+            except Exception as e:
+                result[name] = f"error: {e}"
+        return dict(sorted(result.items()))
+
+metrics = Metrics()
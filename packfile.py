@@ -0,0 +1,223 @@
+import hashlib
+import os
+import struct
+import threading
+import time
+from sqlmodel import Session, select
+from config import Config
+from metrics import metrics
+from database import BackupFile, BackupPack, get_engine
+
+"""
+小备份文件打包：较早的小文件（截图、小附件）合并进追加写入的打包文件，备份目录不再有几十万个小文件
+
+- 每个文件在打包文件中是 头部 + 内容，头部为 b"SCPK"、16 字节 MD5、8 字节长度，
+  内容的起始偏移记在 backup_files.pack_offset，读取时按偏移 pread，不需要扫描打包文件
+- 增量打包：每批最多 Config.PACK_BATCH_SIZE 个文件，先追加并 fsync，再在写线程中登记偏移，
+  登记成功后才删除原文件
+- backup_packs.size 是已提交的长度；追加前把超出的部分截掉（上次打包在登记前中断留下的），
+  登记后、删除原文件前中断留下的原文件，下次启动时清理
+- 打包文件达到 Config.PACK_MAX_BYTES 后不再追加；已打包的内容不会再移动
+"""
+
+MAGIC = b"SCPK"
+HEADER = struct.Struct(">4s16sQ")  # 标记、MD5、内容长度
+
+def read_range(path: str, offset: int, start: int, end: int, chunk_size: int = None):
+    """
+    文件中 [offset + start, offset + end) 的内容，分块 pread 读取（不移动文件位置）；
+    打包文件中的备份 offset 为内容的起始偏移，未打包的备份 offset 为 0
+    """
+    chunk_size = chunk_size or Config.DOWNLOAD_CHUNK_SIZE
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        position = offset + start
+        stop = offset + end
+        while position < stop:
+            chunk = os.pread(fd, min(chunk_size, stop - position), position)
+            if not chunk:
+                break  # 文件被截断
+            position += len(chunk)
+            yield chunk
+    finally:
+        os.close(fd)
+
+def open_pack(session) -> tuple:
+    """写线程操作：还在追加的打包文件，没有时新建，返回 (ID, 路径, 已提交的长度)"""
+    pack = session.exec(select(BackupPack).where(BackupPack.sealed == False).order_by(BackupPack.id)).first()
+    if pack is None:
+        pack = BackupPack(path="")
+        session.add(pack)
+        session.flush()
+        pack.path = os.path.join(Config.PACK_DIR, f"pack-{pack.id:06d}.pack")
+        session.flush()
+    return pack.id, pack.path, pack.size
+
+def commit_packed(session, pack_id: int, size: int, entries: list, sealed: bool) -> list:
+    """
+    写线程操作：登记一批已写入打包文件的备份 [(backup_files.id, 偏移)] 与新的提交长度，
+    返回可以删除的原文件（期间被删除或已被打包的跳过，它们在打包文件中的内容不再使用）
+    """
+    pack = session.get(BackupPack, pack_id)
+    packed = []
+    for backup_id, offset in entries:
+        backup = session.get(BackupFile, backup_id)
+        if backup is None or backup.pack_id is not None:
+            continue
+        backup.pack_id = pack_id
+        backup.pack_offset = offset
+        packed.append(backup.filepath)
+    pack.size = size
+    pack.count += len(packed)
+    pack.sealed = sealed
+    session.flush()
+    if not packed:
+        return []
+    # 同名的新文件（内容不同）可能用了同一个路径
+    in_use = set(session.exec(
+        select(BackupFile.filepath).where(BackupFile.pack_id == None, BackupFile.filepath.in_(packed))
+    ).all())
+    return [path for path in packed if path not in in_use]
+
+def _truncate_tail(path: str, committed: int):
+    """截掉提交长度之后的内容；打包文件比提交长度短说明已经损坏"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "ab") as f:
+        actual = f.seek(0, os.SEEK_END)
+        if actual < committed:
+            raise RuntimeError(f"打包文件比登记的长度短（{actual} < {committed}），可能已损坏: {path}")
+        if actual > committed:
+            f.truncate(committed)
+            f.flush()
+            os.fsync(f.fileno())
+            metrics.inc("pack.truncated_bytes", actual - committed)
+            print(f"截掉打包文件中未登记的 {actual - committed} 字节: {path}")
+
+class Packer:
+    def __init__(self, engine=None, writer=None, stop_event: threading.Event = None):
+        self.engine = engine or get_engine()
+        self.writer = writer
+        self.stop_event = stop_event or threading.Event()
+
+    def candidates(self, limit: int, last_id: int = 0) -> list:
+        """
+        ID 大于 last_id 的可以打包的备份 [(ID, 路径, 大小, 校验和)]：
+        够小、未校验或校验通过、修改后已经过了 Config.PACK_MIN_AGE
+        """
+        cutoff = time.time() - Config.PACK_MIN_AGE
+        found = []
+        while len(found) < limit:
+            with Session(self.engine) as session:
+                rows = session.exec(
+                    select(BackupFile.id, BackupFile.filepath, BackupFile.size, BackupFile.checksum)
+                    .where(BackupFile.pack_id == None, BackupFile.size <= Config.PACK_MAX_BLOB_BYTES,
+                           BackupFile.status.in_(("unverified", "ok")), BackupFile.id > last_id)
+                    .order_by(BackupFile.id).limit(limit)
+                ).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            for row in rows:
+                try:
+                    if os.path.getmtime(row[1]) <= cutoff:
+                        found.append(tuple(row))
+                except OSError:
+                    continue  # 已丢失，留给校验处理
+        return found[:limit]
+
+    def pack_batch(self, rows: list) -> int:
+        """把一批备份追加进打包文件并登记，返回打包的文件数"""
+        pack_id, path, committed = self._write(open_pack)
+        _truncate_tail(path, committed)
+        entries = []
+        size = committed
+        sealed = False
+        rest = []
+        with open(path, "ab") as f:
+            for index, (backup_id, filepath, expected_size, checksum) in enumerate(rows):
+                try:
+                    with open(filepath, "rb") as src:
+                        data = src.read(Config.PACK_MAX_BLOB_BYTES + 1)
+                except OSError:
+                    continue
+                digest = hashlib.md5(data).digest()
+                if len(data) != expected_size or digest.hex() != checksum:
+                    continue  # 与登记的不符，不打包，留给校验标记
+                if size > 0 and size + HEADER.size + len(data) > Config.PACK_MAX_BYTES:
+                    sealed, rest = True, rows[index:]  # 写满了，其余的放进新的打包文件
+                    break
+                f.write(HEADER.pack(MAGIC, digest, len(data)))
+                f.write(data)
+                entries.append((backup_id, size + HEADER.size))
+                size += HEADER.size + len(data)
+            f.flush()
+            os.fsync(f.fileno())
+        sealed = sealed or size >= Config.PACK_MAX_BYTES
+        removable = self._write(commit_packed, pack_id, size, entries, sealed)
+        for filepath in removable:
+            try:
+                os.remove(filepath)
+            except OSError:
+                pass
+        metrics.inc("pack.files", len(removable))
+        metrics.inc("pack.bytes", size - committed)
+        return len(removable) + (self.pack_batch(rest) if rest else 0)
+
+    def run_once(self, limit: int = None) -> int:
+        """打包到没有可打包的文件（或达到 limit 个），返回打包的文件数"""
+        packed = 0
+        last_id = 0  # 没能打包的（内容不符等）不再重试
+        while not self.stop_event.is_set():
+            batch = Config.PACK_BATCH_SIZE if limit is None else min(Config.PACK_BATCH_SIZE, limit - packed)
+            rows = self.candidates(batch, last_id) if batch > 0 else []
+            if not rows:
+                break
+            packed += self.pack_batch(rows)
+            last_id = rows[-1][0]
+        return packed
+
+    def remove_leftovers(self) -> int:
+        """删除已打包但还留在备份目录中的原文件（登记后、删除前中断留下的），返回删除数"""
+        with Session(self.engine) as session:
+            packed = session.exec(
+                select(BackupFile.filepath, BackupFile.checksum).where(BackupFile.pack_id != None)
+            ).all()
+            in_use = set(session.exec(select(BackupFile.filepath).where(BackupFile.pack_id == None)).all())
+        removed = 0
+        for filepath, checksum in packed:
+            if filepath in in_use or not os.path.exists(filepath):
+                continue
+            try:
+                # 路径可能已被内容不同的同名新文件使用（还没登记）
+                with open(filepath, "rb") as f:
+                    if hashlib.md5(f.read(Config.PACK_MAX_BLOB_BYTES + 1)).hexdigest() != checksum:
+                        continue
+                os.remove(filepath)
+                removed += 1
+            except OSError:
+                continue
+        return removed
+
+    def run(self):
+        """后台循环：启动时清理中断留下的原文件，之后每 Config.PACK_INTERVAL 秒打包一次"""
+        try:
+            removed = self.remove_leftovers()
+            if removed:
+                print(f"清理了 {removed} 个已打包的原文件")
+        except Exception as e:
+            metrics.inc("pack.errors")
+            print(f"清理已打包的原文件出错: {e}")
+        while not self.stop_event.wait(Config.PACK_INTERVAL):
+            try:
+                packed = self.run_once()
+                if packed:
+                    print(f"已打包 {packed} 个备份文件")
+            except Exception as e:
+                metrics.inc("pack.errors")
+                print(f"备份文件打包出错: {e}")
+
+    def _write(self, op, *args):
+        if self.writer is None:
+            from db_writer import get_writer
+            self.writer = get_writer()
+        return self.writer.submit(op, *args).result()
@@ -0,0 +1,207 @@
+import html
+import json
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pygments import highlight
+from pygments.formatters import HtmlFormatter
+from pygments.lexers import JsonLexer, MarkdownLexer, guess_lexer
+from pygments.lexers.special import TextLexer
+from pygments.util import ClassNotFound
+from sqlalchemy import func
+from sqlmodel import Session, select
+from config import Config
+from database import ClipboardHistory, RenderCache, get_engine, get_history_item, now_ms, text_content, text_hash
+from metrics import metrics
+
+"""
+文本记录的预渲染：写入后在后台线程池中分类（代码 / JSON / 链接 / Markdown / 纯文本），
+把渲染好的 HTML 片段按内容哈希存入 render_cache，查看时直接返回，不再消耗高亮的 CPU
+
+- HTML 由 Pygments 生成，文本内容全部经过转义；链接只接受 http/https，不会插入原始 HTML
+- Markdown 没有引入额外的依赖，按 Markdown 语法高亮显示源码
+- 缓存总大小超过 Config.RENDER_CACHE_MAX_BYTES 时从最早生成的开始淘汰，被淘汰的内容再次查看时重新渲染
+"""
+
+KINDS = ("code", "json", "markdown", "url", "plain")
+
+_URL = re.compile(r"^https?://\S+$", re.IGNORECASE)
+_MARKDOWN_SIGNS = [
+    re.compile(r"^#{1,6}\s+\S", re.MULTILINE),  # 标题
+    re.compile(r"^```", re.MULTILINE),  # 代码块
+    re.compile(r"^\s*(?:[-*+]|\d+\.)\s+\S", re.MULTILINE),  # 列表
+    re.compile(r"\[[^\]\n]+\]\([^)\s]+\)"),  # 链接
+    re.compile(r"^>\s", re.MULTILINE),  # 引用
+    re.compile(r"\*\*[^*\n]+\*\*"),  # 粗体
+]
+
+def classify(text: str) -> tuple:
+    """返回 (分类, Pygments 词法分析器或 None)"""
+    stripped = text.strip()
+    if not stripped or len(text.encode("utf-8")) > Config.RENDER_MAX_BYTES:
+        return "plain", None
+    if "\n" not in stripped and _URL.match(stripped):
+        return "url", None
+    if stripped[0] in "{[":
+        try:
+            json.loads(stripped)
+            return "json", JsonLexer()
+        except ValueError:
+            pass
+    # 至少两种 Markdown 特征才算，避免普通文本里偶然出现的列表符号
+    if sum(1 for sign in _MARKDOWN_SIGNS if sign.search(text)) >= 2:
+        return "markdown", MarkdownLexer()
+    sample = text[:Config.RENDER_GUESS_BYTES]
+    try:
+        lexer = guess_lexer(sample)
+    except ClassNotFound:
+        return "plain", None
+    if isinstance(lexer, TextLexer) or lexer.analyse_text(sample) < Config.RENDER_MIN_CONFIDENCE:
+        return "plain", None
+    return "code", lexer
+
+def render(text: str) -> tuple:
+    """分类并渲染，返回 (分类, 语言, HTML 片段)；纯文本不需要渲染，HTML 为空"""
+    kind, lexer = classify(text)
+    if kind == "plain":
+        return kind, None, ""
+    if kind == "url":
+        url = html.escape(text.strip(), quote=True)
+        return kind, None, f'<a href="{url}" target="_blank" rel="noopener noreferrer nofollow">{url}</a>'
+    if kind == "json":
+        text = json.dumps(json.loads(text), ensure_ascii=False, indent=2)
+    return kind, lexer.name, highlight(text, lexer, HtmlFormatter(cssclass="highlight"))
+
+@lru_cache(maxsize=1)
+def stylesheet() -> str:
+    """高亮片段的样式（/api/render.css）"""
+    return HtmlFormatter(style=Config.RENDER_STYLE, cssclass="highlight").get_style_defs(".highlight")
+
+def store_render(session, content_hash: str, kind: str, language, fragment: str) -> int:
+    """写线程操作：保存渲染结果，超过总大小上限时淘汰最早的（不淘汰刚保存的这条），返回淘汰数"""
+    if session.get(RenderCache, content_hash) is not None:
+        return 0
+    session.add(RenderCache(content_hash=content_hash, kind=kind, language=language, html=fragment,
+                            size=len(fragment.encode("utf-8")), created_at=now_ms()))
+    session.flush()
+    total = session.exec(select(func.coalesce(func.sum(RenderCache.size), 0))).one()
+    evicted = 0
+    while total > Config.RENDER_CACHE_MAX_BYTES:
+        oldest = session.exec(
+            select(RenderCache).where(RenderCache.content_hash != content_hash)
+            .order_by(RenderCache.created_at).limit(100)
+        ).all()
+        if not oldest:
+            break
+        for row in oldest:
+            if total <= Config.RENDER_CACHE_MAX_BYTES:
+                break
+            total -= row.size
+            session.delete(row)
+            evicted += 1
+        session.flush()
+    return evicted
+
+def cached_render(session, content_hash: str):
+    """缓存中的渲染结果 {'kind', 'language', 'html'}，没有时返回 None"""
+    row = session.get(RenderCache, content_hash)
+    if row is None:
+        return None
+    return {'kind': row.kind, 'language': row.language, 'html': row.html}
+
+class RenderPool:
+    def __init__(self, engine=None, writer=None, workers: int = None):
+        self.engine = engine or get_engine()
+        self.writer = writer
+        self.executor = ThreadPoolExecutor(max_workers=workers or Config.RENDER_WORKERS, thread_name_prefix="Render")
+        self._inflight = {}  # 内容哈希 -> Future，同一内容只渲染一次
+        self._lock = threading.Lock()
+        metrics.register("render.inflight", lambda: len(self._inflight))
+
+    def submit(self, content_hash: str, text: str):
+        """放入后台渲染，返回 Future（同一内容正在渲染时返回同一个 Future）"""
+        with self._lock:
+            future = self._inflight.get(content_hash)
+            if future is None:
+                future = self.executor.submit(self._render, content_hash, text)
+                self._inflight[content_hash] = future
+            return future
+
+    def submit_item(self, item):
+        """写入流水线的 notify 回调：新写入的文本放入后台渲染"""
+        if item.data and item.data.get("Type") == "Text":
+            text = item.data.get("Clipboard") or ""
+            self.submit(text_hash(text), text)
+
+    def backfill(self, limit: int = None) -> int:
+        """已有的、还没有渲染缓存的文本记录放入后台渲染，返回放入的条数"""
+        query = (select(ClipboardHistory)
+                 .where(ClipboardHistory.type == "Text", ClipboardHistory.content_hash != None)
+                 .where(ClipboardHistory.content_hash.not_in(select(RenderCache.content_hash)))
+                 .order_by(ClipboardHistory.ts.desc()))
+        if limit:
+            query = query.limit(limit)
+        count = 0
+        with Session(self.engine) as session:
+            for item in session.exec(query.execution_options(yield_per=200)):
+                self.submit(item.content_hash, text_content(item))
+                count += 1
+        return count
+
+    def get(self, item_id: int, timeout: float = 10.0):
+        """
+        一条文本记录的渲染结果；缓存中没有时交给后台渲染并等待（之后再查看就直接命中缓存）
+        :return: {'kind', 'language', 'html'}，不是文本记录时返回 None
+        """
+        with Session(self.engine) as session:
+            item = get_history_item(session, item_id)
+            if item is None or item.type != "Text":
+                return None
+            content_hash = item.content_hash or text_hash(text_content(item))
+            cached = cached_render(session, content_hash)
+            if cached is not None:
+                metrics.inc("render.cache_hits")
+                return cached
+            text = text_content(item)
+        metrics.inc("render.cache_misses")
+        self.submit(content_hash, text).result(timeout=timeout)
+        with Session(self.engine) as session:
+            return cached_render(session, content_hash)
+
+    def _render(self, content_hash: str, text: str):
+        try:
+            with Session(self.engine) as session:
+                if session.get(RenderCache, content_hash) is not None:
+                    return
+            began = time.perf_counter()
+            kind, language, fragment = render(text)
+            metrics.observe("render.seconds", time.perf_counter() - began)
+            metrics.inc(f"render.kind.{kind}")
+            evicted = self._write(store_render, content_hash, kind, language, fragment)
+            if evicted:
+                metrics.inc("render.evicted", evicted)
+        except Exception as e:
+            metrics.inc("render.errors")
+            print(f"渲染文本出错: {e}")
+        finally:
+            with self._lock:
+                self._inflight.pop(content_hash, None)
+
+    def _write(self, op, *args):
+        if self.writer is None:
+            from db_writer import get_writer
+            self.writer = get_writer()
+        return self.writer.submit(op, *args).result()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_render_pool() -> RenderPool:
+    """获取进程内唯一的渲染线程池"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = RenderPool()
+        return _pool
@@ -0,0 +1,185 @@
+import hashlib
+import mmap
+import os
+import threading
+import time
+from sqlalchemy import func
+from sqlmodel import Session, select
+from config import Config
+from database import BackupFile, BackupPack, ScrubState, get_engine, now_ms
+from metrics import metrics
+
+"""
+备份文件后台校验：按 backup_files.id 分块遍历，用内存映射计算 MD5，与记录的校验和比对。
+
+- 每块处理完把结果与进度一起交给写线程提交，进程重启后从上次的位置继续
+- 读取速度（MB/s）与 IO 次数（IOPS）都有上限，不与剪贴板写入争抢磁盘
+- 文件丢失标记为 missing，大小或内容不符标记为 corrupt，结果同时写入 metrics
+- 已打包的备份只映射打包文件中的那一段（见 packfile.py）
+"""
+
+class _Budget:
+    """令牌桶限速：每秒补充 rate 个令牌，最多积攒 1 秒；rate 为 0 表示不限速"""
+
+    def __init__(self, rate: float, wait):
+        self.rate = rate
+        self.wait = wait  # wait(seconds)，可被停止事件提前唤醒
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def take(self, amount: float):
+        if not self.rate:
+            return
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        if self.tokens < 0:
+            self.wait(-self.tokens / self.rate)
+
+def mmap_md5(path: str, chunk_size: int, on_chunk=None, offset: int = 0, length: int = None) -> str:
+    """
+    用内存映射分块计算文件 MD5；on_chunk(字节数) 在读取每块之前调用（用于限速）
+    :param offset, length: 只计算文件中的一段（打包文件中的一个备份），默认整个文件
+    """
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size - offset if length is None else length
+        if size <= 0:
+            return md5.hexdigest()
+        # 映射的起点必须按分配粒度对齐
+        start = offset - offset % mmap.ALLOCATIONGRANULARITY
+        skip = offset - start
+        with mmap.mmap(f.fileno(), skip + size, access=mmap.ACCESS_READ, offset=start) as mapped:
+            if hasattr(mapped, "madvise"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            view = memoryview(mapped)
+            try:
+                for position in range(skip, skip + size, chunk_size):
+                    part = view[position:min(position + chunk_size, skip + size)]
+                    if on_chunk:
+                        on_chunk(len(part))
+                    md5.update(part)
+                    part.release()
+            finally:
+                view.release()
+    return md5.hexdigest()
+
+def record_scrub_results(session, results: list, last_id: int, finished: bool):
+    """写线程操作：保存一块的校验结果与进度"""
+    ts = now_ms()
+    for backup_id, status in results:
+        backup = session.get(BackupFile, backup_id)
+        if backup is not None:
+            backup.status = status
+            backup.verified_at = ts
+    state = session.get(ScrubState, 1)
+    if state is None:
+        state = ScrubState(id=1)
+        session.add(state)
+    if state.pass_started_at is None:
+        state.pass_started_at = ts
+    if finished:
+        state.last_id = 0
+        state.passes += 1
+        state.pass_started_at = None
+    else:
+        state.last_id = last_id
+    session.flush()
+
+def status_counts(session) -> dict:
+    """各校验状态的文件数"""
+    rows = session.exec(select(BackupFile.status, func.count()).group_by(BackupFile.status)).all()
+    return {status: count for status, count in rows}
+
+class BackupScrubber:
+    def __init__(self, engine=None, writer=None, stop_event: threading.Event = None,
+                 mb_per_sec: float = None, iops: float = None, batch_size: int = None):
+        self.engine = engine or get_engine()
+        self.writer = writer
+        self.stop_event = stop_event or threading.Event()
+        mb_per_sec = Config.SCRUB_MB_PER_SEC if mb_per_sec is None else mb_per_sec
+        self.bytes_budget = _Budget(mb_per_sec * 1024 * 1024, self.stop_event.wait)
+        self.io_budget = _Budget(Config.SCRUB_IOPS if iops is None else iops, self.stop_event.wait)
+        self.batch_size = batch_size or Config.SCRUB_BATCH_SIZE
+
+    def _read_chunk(self, size: int):
+        self.io_budget.take(1)
+        self.bytes_budget.take(size)
+        metrics.inc("scrub.bytes_read", size)
+
+    def check(self, filepath: str, size: int, checksum: str, offset: int = None) -> str:
+        """校验单个备份文件（offset 不为空时是打包文件中的一段），返回状态"""
+        self.io_budget.take(1)  # stat + open
+        try:
+            if offset is None and os.path.getsize(filepath) != size:
+                return "corrupt"
+            if offset is not None and os.path.getsize(filepath) < offset + size:
+                return "corrupt"  # 打包文件被截断
+            digest = mmap_md5(filepath, Config.SCRUB_CHUNK_SIZE, self._read_chunk,
+                              offset=offset or 0, length=size if offset is not None else None)
+        except FileNotFoundError:
+            return "missing"
+        return "ok" if digest == checksum else "corrupt"
+
+    def scrub_chunk(self) -> bool:
+        """校验下一块，返回本轮是否已经完成"""
+        with Session(self.engine) as session:
+            state = session.get(ScrubState, 1)
+            last_id = state.last_id if state else 0
+            rows = session.exec(
+                select(BackupFile.id, BackupFile.filepath, BackupFile.size, BackupFile.checksum,
+                       BackupFile.pack_offset, BackupPack.path)
+                .outerjoin(BackupPack, BackupPack.id == BackupFile.pack_id)
+                .where(BackupFile.id > last_id).order_by(BackupFile.id).limit(self.batch_size)
+            ).all()
+
+        results = []
+        for backup_id, filepath, size, checksum, pack_offset, pack_path in rows:
+            if self.stop_event.is_set():
+                break
+            if pack_path:
+                filepath = pack_path
+            began = time.perf_counter()
+            status = self.check(filepath, size, checksum, pack_offset if pack_path else None)
+            metrics.observe("scrub.file.seconds", time.perf_counter() - began)
+            metrics.inc("scrub.files_checked")
+            if status != "ok":
+                metrics.inc(f"scrub.{status}_found")
+                print(f"备份文件校验失败（{status}）: {filepath}")
+            results.append((backup_id, status))
+
+        # 没有被中途停止，且已经取不满一块，说明本轮到头了
+        finished = len(results) == len(rows) and len(rows) < self.batch_size
+        if results or finished:
+            last_id = results[-1][0] if results else last_id
+            self._write(record_scrub_results, results, last_id, finished)
+        with Session(self.engine) as session:
+            counts = status_counts(session)
+        metrics.set("scrub.corrupt_files", counts.get("corrupt", 0))
+        metrics.set("scrub.missing_files", counts.get("missing", 0))
+        if finished:
+            metrics.inc("scrub.passes")
+        return finished
+
+    def run_pass(self):
+        """从当前进度开始，校验到本轮结束（或被停止）"""
+        while not self.stop_event.is_set():
+            if self.scrub_chunk():
+                return
+
+    def run(self):
+        """后台循环：每轮结束后等待 Config.SCRUB_PASS_INTERVAL 秒再开始下一轮"""
+        while not self.stop_event.is_set():
+            try:
+                self.run_pass()
+            except Exception as e:
+                metrics.inc("scrub.errors")
+                print(f"备份文件校验出错: {e}")
+            self.stop_event.wait(Config.SCRUB_PASS_INTERVAL)
+
+    def _write(self, op, *args):
+        if self.writer is None:
+            from db_writer import get_writer
+            self.writer = get_writer()
+        return self.writer.submit(op, *args).result()
@@ -0,0 +1,179 @@
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from config import Config
+from metrics import metrics
+
+"""
+数据库在线快照：用 SQLite 的在线备份 API 分步复制，不需要停止服务
+
+- 复制前在源连接上开启一个读事务，整个复制过程看到的都是同一个一致的版本；
+  WAL 模式下读事务不阻塞写入，其他连接的写入也不会让复制从头开始
+- 每复制 Config.SNAPSHOT_PAGES 页暂停 Config.SNAPSHOT_PAUSE 秒，把 IO 让给写入和查询
+- 复制完成后 gzip 压缩，按 Config.SNAPSHOT_KEEP 轮换；恢复前先做完整性检查
+- 耗时与快照期间写线程单次提交的最长耗时（写入被阻塞的时间）记入 metrics
+"""
+
+SNAPSHOT_PREFIX = "clipboard_history-"
+SNAPSHOT_SUFFIX = ".db.gz"
+
+def list_snapshots(snapshot_dir: str = None) -> list:
+    """快照文件路径，按时间从旧到新"""
+    snapshot_dir = snapshot_dir or Config.SNAPSHOT_DIR
+    if not os.path.isdir(snapshot_dir):
+        return []
+    names = sorted(name for name in os.listdir(snapshot_dir)
+                   if name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX))
+    return [os.path.join(snapshot_dir, name) for name in names]
+
+def rotate_snapshots(keep: int = None, snapshot_dir: str = None) -> list:
+    """只保留最近 keep 个快照，返回删除的文件"""
+    keep = Config.SNAPSHOT_KEEP if keep is None else keep
+    removed = list_snapshots(snapshot_dir)[:-keep] if keep > 0 else []
+    for path in removed:
+        os.remove(path)
+    return removed
+
+def _online_copy(src_path: str, dst_path: str, pages: int, pause: float) -> int:
+    """分步复制数据库到 dst_path，返回步数"""
+    steps = 0
+
+    def progress(status, remaining, total):
+        nonlocal steps
+        steps += 1
+        if remaining and pause:
+            time.sleep(pause)  # 让出给写线程和请求
+
+    src = sqlite3.connect(src_path, isolation_level=None, check_same_thread=False)
+    dst = sqlite3.connect(dst_path)
+    try:
+        src.execute("PRAGMA busy_timeout = 5000")
+        # 固定读版本：复制期间的写入不可见，也不会让备份重新开始
+        src.execute("BEGIN")
+        src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        src.backup(dst, pages=pages, progress=progress)
+        src.execute("COMMIT")
+        dst.execute("PRAGMA journal_mode=DELETE")  # 快照是单个文件，不需要 WAL
+    finally:
+        dst.close()
+        src.close()
+    return steps
+
+def _gzip_file(src_path: str, dst_path: str):
+    """压缩到同目录的临时文件后改名，快照目录中不会出现写了一半的文件"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dst_path), prefix=".snapshot-")
+    try:
+        with open(src_path, "rb") as src, os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6) as out:
+            shutil.copyfileobj(src, out, 1024 * 1024)
+        os.replace(tmp_path, dst_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def take_snapshot(db_path: str = None, snapshot_dir: str = None, pages: int = None, pause: float = None) -> dict:
+    """
+    生成一个压缩快照并轮换旧快照
+    :return: {'path', 'size', 'db_size', 'steps', 'seconds', 'max_write_stall'}
+    """
+    from db_writer import running_writer
+
+    db_path = db_path or Config.DB_PATH
+    snapshot_dir = snapshot_dir or Config.SNAPSHOT_DIR
+    pages = pages or Config.SNAPSHOT_PAGES
+    pause = Config.SNAPSHOT_PAUSE if pause is None else pause
+    os.makedirs(snapshot_dir, exist_ok=True)
+
+    writer = running_writer()
+    if writer:
+        writer.take_max_commit_seconds()  # 从这里开始统计
+    began = time.perf_counter()
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(snapshot_dir, f"{SNAPSHOT_PREFIX}{stamp}{SNAPSHOT_SUFFIX}")
+    with tempfile.TemporaryDirectory(dir=snapshot_dir, prefix=".copy-") as tmp:
+        copy_path = os.path.join(tmp, "snapshot.db")
+        steps = _online_copy(db_path, copy_path, pages, pause)
+        db_size = os.path.getsize(copy_path)
+        _gzip_file(copy_path, path)
+    seconds = time.perf_counter() - began
+    max_stall = writer.take_max_commit_seconds() if writer else None
+
+    rotate_snapshots(snapshot_dir=snapshot_dir)
+    metrics.inc("snapshot.count")
+    metrics.observe("snapshot.seconds", seconds)
+    metrics.set("snapshot.last_size", os.path.getsize(path))
+    if max_stall is not None:
+        metrics.set("snapshot.max_write_stall_seconds", round(max_stall, 6))
+    return {
+        'path': path,
+        'size': os.path.getsize(path),
+        'db_size': db_size,
+        'steps': steps,
+        'seconds': seconds,
+        'max_write_stall': max_stall,
+    }
+
+def check_integrity(db_path: str) -> list:
+    """PRAGMA integrity_check，并确认是本程序的数据库；返回问题列表（为空表示通过）"""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        problems = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+        problems = [] if problems == ["ok"] else problems
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for table in ("schema_version", "clipboardhistory"):
+            if table not in tables:
+                problems.append(f"缺少表 {table}")
+    except sqlite3.DatabaseError as e:
+        problems = [str(e)]
+    finally:
+        conn.close()
+    return problems
+
+def restore_snapshot(snapshot_path: str, db_path: str = None, check_only: bool = False) -> dict:
+    """
+    解压快照并检查完整性，通过后替换数据库（原数据库改名保留）。替换前必须先停止服务
+    :param check_only: 只检查，不替换
+    :return: {'problems', 'db_path', 'previous'}
+    """
+    db_path = db_path or Config.DB_PATH
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(db_path), prefix=".restore-")
+    try:
+        with gzip.open(snapshot_path, "rb") as src, os.fdopen(fd, "wb") as out:
+            shutil.copyfileobj(src, out, 1024 * 1024)
+        problems = check_integrity(tmp_path)
+        if problems or check_only:
+            os.unlink(tmp_path)
+            return {'problems': problems, 'db_path': db_path, 'previous': None}
+        previous = None
+        if os.path.exists(db_path):
+            previous = f"{db_path}.before-restore-{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')}"
+            os.replace(db_path, previous)
+        # 旧数据库的 WAL 跟着旧数据库保留，不能留给恢复后的数据库
+        if os.path.exists(db_path + "-wal"):
+            if previous:
+                os.replace(db_path + "-wal", previous + "-wal")
+            else:
+                os.remove(db_path + "-wal")
+        if os.path.exists(db_path + "-shm"):
+            os.remove(db_path + "-shm")
+        os.replace(tmp_path, db_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return {'problems': [], 'db_path': db_path, 'previous': previous}
+
+def run_snapshots(stop_event: threading.Event):
+    """后台循环：每 Config.SNAPSHOT_INTERVAL 秒生成一个快照"""
+    while not stop_event.wait(Config.SNAPSHOT_INTERVAL):
+        try:
+            result = take_snapshot()
+            print(f"数据库快照完成: {result['path']}（{result['seconds']:.2f} 秒）")
+        except Exception as e:
+            metrics.inc("snapshot.errors")
+            print(f"数据库快照失败: {e}")
@@ -1,76 +1,239 @@
-import threading
 import time
+_STARTED_AT = time.perf_counter()  # 冷启动计时起点（尽量早）
+
+import argparse
+import threading
 import signal
 import sys
-import web_server
-import history_service
 import database
 from config import Config
 
-# 全局退出标志
-exit_event = threading.Event()
+# web_server（Flask / eventlet / Socket.IO）与 history_service（watchdog / Socket.IO 客户端）
+# 都在各自线程内延迟导入，避免启动时一次性加载所有重量级模块
 
-def start_monitor():
-    """启动剪贴板监控服务（支持优雅退出）"""
-    while not exit_event.is_set():
-        # 替换为您的实际监控逻辑
-        history_service.main()
-        time.sleep(0.1)  # 避免CPU占用过高
+# 全局退出标志（信号处理器只设置它，关闭在主线程中按顺序进行）
+exit_event = threading.Event()
 
-def start_web():
-    """启动 Web 服务"""
+def run_web(stop_event):
+    """启动 Web 服务（阻塞，无法从外部停止，随进程退出）"""
+    import web_server
+    print(f"Web 服务就绪，启动耗时 {time.perf_counter() - _STARTED_AT:.2f} 秒")
     # 关键修复：禁用重载器
     # web_server.socketio.run(web_server.app, port=5000, debug=True)  # 用 socketio.run 启动
-    web_server.socketio.run(web_server.app, host='0.0.0.0', port=5000, debug=True, use_reloader=False)  # 禁用重载器
+    web_server.socketio.run(web_server.app, host=Config.WEB_HOST, port=Config.WEB_PORT, debug=True, use_reloader=False)  # 禁用重载器
+
+def run_ingest(stop_event):
+    """
+    写入流水线、文件预处理与写线程（WebDAV 上传与文件监控共用）。
+    supervisor 重启时 stop_ingest 已经停止了它们：单例原地重新启动（而不是重新创建），
+    监控处理器、后台任务等持有的引用仍然有效
+    """
+    from db_writer import get_writer
+    from file_stager import get_stager
+    from ingest_pipeline import get_pipeline
+    get_writer().start()
+    get_pipeline().start()
+    get_stager().start()
+    stop_event.wait()
+
+def stop_ingest(timeout: float) -> bool:
+    """停止接收新的变化，在期限内排空已接收的写入，再停止写线程"""
+    from db_writer import running_writer
+    from file_stager import get_stager
+    from ingest_pipeline import get_pipeline
+    deadline = time.monotonic() + timeout
+    pipeline = get_pipeline()
+    pipeline.close()
+    drained = pipeline.drain(timeout, until="commit")  # 通知是尽力而为的，不等
+    pipeline.stop(timeout=max(0.0, deadline - time.monotonic()))
+    get_stager().stop(timeout=max(0.0, deadline - time.monotonic()))
+    writer = running_writer()
+    if writer is not None:
+        drained = writer.stop(timeout=max(0.0, deadline - time.monotonic())) and drained
+    if not drained:
+        print("已接收的写入未能在期限内全部完成")
+    return drained
+
+def ingest_healthy() -> bool:
+    import db_writer
+    from ingest_pipeline import get_pipeline
+    threads = [thread for stage in get_pipeline().stages.values() for thread in stage.threads]
+    return db_writer.healthy() and all(thread.is_alive() for thread in threads)
+
+def ingest_backlog() -> dict:
+    from ingest_pipeline import get_pipeline
+    backlog = get_pipeline().backlog()
+    return {'depth': sum(b['depth'] for b in backlog.values()), 'capacity': sum(b['capacity'] for b in backlog.values())}
+
+def writer_backlog() -> dict:
+    from db_writer import running_writer
+    writer = running_writer()
+    return {'depth': writer.queue.qsize() if writer else 0, 'capacity': Config.WRITER_QUEUE_SIZE}
+
+_monitor = None
+
+def run_monitor(stop_event):
+    """剪贴板监控：观察者意外退出时由 supervisor 重建"""
+    global _monitor
+    import history_service
+    if _monitor is None:
+        _monitor = history_service.Monitor()
+    _monitor.run(stop_event)
+
+def stop_monitor(timeout: float) -> bool:
+    return _monitor is None or _monitor.stop(timeout)
+
+def monitor_healthy() -> bool:
+    return _monitor is not None and _monitor.healthy()
+
+def run_backup_folder_monitor(stop_event): # 监控，避免文件夹过大
+    import history_service
+    history_service.monitor_backup_folder(Config.FOLDER_TO_MONITOR, Config.MAX_FOLDER_SIZE, Config.CHECK_INTERVAL,
+                                          stop_event=stop_event)
+
+def run_scrubber(stop_event): # 后台限速校验备份文件
+    from scrubber import BackupScrubber
+    BackupScrubber(stop_event=stop_event).run()
+
+def run_snapshots(stop_event): # 定期在线生成数据库快照
+    from snapshot import run_snapshots
+    run_snapshots(stop_event)
+
+def run_packer(stop_event): # 定期把较早的小备份文件打包
+    from packfile import Packer
+    Packer(stop_event=stop_event).run()
+
+def run_archiver(stop_event): # 定期把旧月份移入只读分区
+    from archive import run_archiver
+    run_archiver(stop_event)
+
+def build_supervisor(background: bool = True):
+    """
+    注册各个服务：Web 优先（尽快可以响应请求），然后是写入与监控，最后是后台任务。
+    关闭时按相反顺序：先停后台任务和监控（不再有新的变化），再排空写入
+    :param background: 是否启动后台任务（文件夹大小监控、校验、快照、打包、归档）
+    """
+    from supervisor import Service, Supervisor
+    supervisor = Supervisor()
+    supervisor.add(Service("web", run_web, detached=True))
+    supervisor.add(Service("ingest", run_ingest, stop=stop_ingest, health=ingest_healthy))
+    supervisor.add(Service("monitor", run_monitor, stop=stop_monitor, health=monitor_healthy))
+    supervisor.add_queue("pipeline", ingest_backlog)
+    supervisor.add_queue("writer", writer_backlog)
+    if not background:
+        return supervisor
+    supervisor.add(Service("backup_folder", run_backup_folder_monitor))
+    if Config.SCRUB_ENABLED:
+        supervisor.add(Service("scrubber", run_scrubber))
+    if Config.SNAPSHOT_ENABLED:
+        supervisor.add(Service("snapshot", run_snapshots))
+    if Config.PACK_ENABLED:
+        supervisor.add(Service("packer", run_packer))
+    if Config.ARCHIVE_ENABLED:
+        supervisor.add(Service("archiver", run_archiver))
+    return supervisor
 
-def start_monitor_backup_folder(): # 监控，避免文件夹过大
-    while not exit_event.is_set():
-        history_service.monitor_backup_folder(Config.FOLDER_TO_MONITOR, Config.MAX_FOLDER_SIZE, Config.CHECK_INTERVAL)
-        time.sleep(0.1)  # 避免CPU占用过高
+def use_data_dir(data_dir: str):
+    """数据库、备份与同步目录都放到 data_dir 下（启动预算检查使用临时目录，不影响正式数据）"""
+    import os
+    Config.BASE_DIR = data_dir
+    Config.SYNC_ROOTS = {}
+    Config.SYNC_CLIPBOARD_JSON_PATH = os.path.join(data_dir, Config.SYNC_CLIPBOARD_JSON_FILE)
+    Config.DB_PATH = os.path.join(data_dir, "db", "clipboard_history.db")
+    Config.BACKUP_DIR = Config.FOLDER_TO_MONITOR = os.path.join(data_dir, Config.BACKUP_DIR_FOLDER)
+    Config.PACK_DIR = os.path.join(data_dir, "packs")
+    Config.SNAPSHOT_DIR = os.path.join(data_dir, "db", "snapshots")
+    Config.ARCHIVE_DIR = os.path.join(data_dir, "db", "archive")
 
 #########################
 
 def signal_handler(sig, frame):
-    """处理中断信号"""
-    print("\n接收到退出信号，正在粗暴的关闭服务...")
-    exit_event.set()  # 设置退出标志
-    
-    # 等待服务关闭（最多1秒）
-    print("等待服务线程结束...")
-    monitor_thread.join(timeout=1.0)
-    web_thread.join(timeout=1.0)
-    web_thread.join(timeout=1.0)
-    
-    # 强制退出（如果线程未正常结束）
-    if monitor_thread.is_alive() or web_thread.is_alive():
-        print("服务线程未及时结束，强制退出")
-        sys.exit(1)
-    else:
-        print("所有服务已安全关闭")
-        sys.exit(0)
+    """处理中断信号：只设置退出标志，不在写入中途退出"""
+    print("\n接收到退出信号，正在关闭服务...")
+    exit_event.set()
+
+#########################
+
+def check_startup_budget(port: int, budget: float = None) -> float:
+    """
+    启动预算检查：以子进程冷启动 start.py（临时数据目录、只监听 127.0.0.1、不启动后台任务），
+    轮询首页直到返回 200，耗时超过 Config.STARTUP_BUDGET_SECONDS 时抛出 AssertionError
+    """
+    import os
+    import subprocess
+    import tempfile
+    import urllib.request
+
+    budget = Config.STARTUP_BUDGET_SECONDS if budget is None else budget
+    url = f"http://127.0.0.1:{port}/"
+    data_dir = tempfile.TemporaryDirectory(prefix="startup-check-")
+    began = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--port", str(port), "--host", "127.0.0.1",
+                             "--data-dir", data_dir.name, "--no-background"], cwd=os.path.dirname(os.path.abspath(__file__)))
+    try:
+        while True:
+            elapsed = time.perf_counter() - began
+            if proc.poll() is not None:
+                raise AssertionError(f"服务进程提前退出，返回码 {proc.returncode}")
+            if elapsed > budget * 3:
+                raise AssertionError(f"等待 {elapsed:.2f} 秒仍未收到首个响应")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as resp:
+                    if resp.status == 200:
+                        elapsed = time.perf_counter() - began
+                        break
+            except OSError:
+                time.sleep(0.02)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=5)
+        data_dir.cleanup()
+
+    print(f"冷启动到首个请求: {elapsed:.2f} 秒（预算 {budget:.2f} 秒）")
+    assert elapsed <= budget, f"启动耗时 {elapsed:.2f} 秒，超过预算 {budget:.2f} 秒"
+    return elapsed
 
 if __name__ == "__main__":
-    # 初始化数据库
+    parser = argparse.ArgumentParser(description="SyncClipboard 历史记录服务")
+    parser.add_argument("--port", type=int, default=Config.WEB_PORT, help="Web 服务端口")
+    parser.add_argument("--host", default=Config.WEB_HOST, help="Web 服务监听地址")
+    parser.add_argument("--data-dir", help="数据库、备份与同步目录都放在该目录下（默认使用 config.py 中的路径）")
+    parser.add_argument("--no-background", action="store_true", help="不启动后台任务（校验、快照、打包、归档等）")
+    parser.add_argument("--check-startup", action="store_true", help="检查冷启动耗时是否在预算内")
+    args = parser.parse_args()
+    Config.WEB_PORT = args.port
+    Config.WEB_HOST = args.host
+    if args.data_dir:
+        use_data_dir(args.data_dir)
+
+    if args.check_startup:
+        try:
+            check_startup_budget(args.port)
+        except AssertionError as e:
+            print(f"启动预算检查失败: {e}")
+            sys.exit(1)
+        sys.exit(0)
+
+    # 初始化数据库（迁移只在这里执行一次）
     db_engine = database.init_db()
-    
+
     # 注册信号处理器
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
 
-    # 创建线程
-    monitor_thread = threading.Thread(target=start_monitor, name="MonitorThread", daemon=True)
-    web_thread = threading.Thread(target=start_web, name="WebThread", daemon=True)
-    monitor_backup_folder = threading.Thread(target=start_monitor_backup_folder, name="BonitorBackupBolder", daemon=True)
-
-    # 启动线程
-    monitor_thread.start()
-    web_thread.start()
-    monitor_backup_folder.start()
+    from supervisor import set_supervisor
+    supervisor = build_supervisor(background=not args.no_background)
+    set_supervisor(supervisor)
+    supervisor.start()
     print("服务已启动，按 Ctrl+C 退出")
 
-    try:
-        # 主线程保持运行
-        while True:
-            time.sleep(1)
-    except KeyboardInterrupt:
-        signal_handler(signal.SIGINT, None)
+    # 主线程等待退出信号（带超时的等待，保证信号能及时处理）
+    while not exit_event.wait(1):
+        pass
+
+    print(f"等待已接收的写入完成（最多 {Config.SHUTDOWN_DEADLINE:.0f} 秒）...")
+    if supervisor.shutdown(Config.SHUTDOWN_DEADLINE):
+        print("所有服务已安全关闭")
+        sys.exit(0)
+    print("部分服务未能在期限内停止")
+    sys.exit(1)
@@ -0,0 +1,182 @@
+import threading
+import time
+from typing import Callable, Optional
+from config import Config
+from metrics import metrics
+
+"""
+服务监管：统一管理各个子系统（写入、Web、监控、后台任务）的启动、健康检查、重启与关闭
+
+- 每个服务在自己的线程中运行 run(stop_event)，直到 stop_event 被设置；
+  提前返回或抛出异常视为崩溃，按指数退避（Config.SUPERVISOR_BACKOFF_*）重启，
+  稳定运行 Config.SUPERVISOR_STABLE_SECONDS 秒后退避从头计算
+- 定期调用各服务的 health()，连续 Config.SUPERVISOR_UNHEALTHY_LIMIT 次不健康时停止并重启该服务
+- 关闭时按注册的相反顺序停止（先停输入、后停写入），所有服务共用一个截止时间（Config.SHUTDOWN_DEADLINE），
+  写入流水线在期限内排空，不在写入中途退出
+- status() 汇总各服务状态与有界队列的积压（/api/health）
+"""
+
+class Service:
+    def __init__(self, name: str, run: Callable, stop: Optional[Callable] = None, health: Optional[Callable] = None,
+                 detached: bool = False):
+        """
+        :param run: run(stop_event)，阻塞运行到 stop_event 被设置
+        :param stop: stop(timeout) -> bool，设置 stop_event 之后调用，用于停止 run 中阻塞的部分或排空队列；
+                     返回 False 表示没有在 timeout 秒内完成
+        :param health: health() -> bool，不提供时只看线程是否在运行
+        :param detached: 无法从外部停止（如 Web 服务器），关闭时不等待，随进程退出
+        """
+        self.name = name
+        self.run = run
+        self.stop = stop
+        self.health = health
+        self.detached = detached
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.state = "new"  # new / running / backoff / stopped
+        self.restarts = 0
+        self.failures = 0  # 连续崩溃次数，决定退避时长
+        self.unhealthy = 0  # 连续不健康的检查次数
+        self.last_error = None
+
+    def healthy(self) -> bool:
+        if self.state != "running" or self.thread is None or not self.thread.is_alive():
+            return False
+        if self.health is None:
+            return True
+        try:
+            return bool(self.health())
+        except Exception as e:
+            self.last_error = f"健康检查出错: {e}"
+            return False
+
+class Supervisor:
+    def __init__(self):
+        self.services = []
+        self.queues = {}  # 名称 -> provider() -> {'depth', 'capacity'}
+        self._shutdown = threading.Event()
+        self._checker = None
+
+    def add(self, service: Service) -> Service:
+        self.services.append(service)
+        return service
+
+    def add_queue(self, name: str, provider: Callable):
+        """登记一个有界队列，status() 中报告积压；队列满说明下游跟不上，上游正在被阻塞（背压）"""
+        self.queues[name] = provider
+
+    def start(self):
+        """按注册顺序启动所有服务与健康检查线程"""
+        for service in self.services:
+            service.thread = threading.Thread(target=self._supervise, args=(service,),
+                                              name=f"Service-{service.name}", daemon=True)
+            service.thread.start()
+        self._checker = threading.Thread(target=self._check_loop, name="Supervisor", daemon=True)
+        self._checker.start()
+
+    def _supervise(self, service: Service):
+        """运行服务，崩溃后退避重启，直到关闭"""
+        while not self._shutdown.is_set():
+            service.stop_event = threading.Event()
+            service.state = "running"
+            service.unhealthy = 0
+            began = time.monotonic()
+            try:
+                service.run(service.stop_event)
+                if not service.stop_event.is_set() and not self._shutdown.is_set():
+                    raise RuntimeError("服务意外结束")
+            except Exception as e:
+                service.last_error = str(e)
+                print(f"服务 {service.name} 出错: {e}")
+            if self._shutdown.is_set():
+                break
+            if time.monotonic() - began >= Config.SUPERVISOR_STABLE_SECONDS:
+                service.failures = 0
+            service.failures += 1
+            delay = min(Config.SUPERVISOR_BACKOFF_MAX, Config.SUPERVISOR_BACKOFF_MIN * 2 ** (service.failures - 1))
+            service.state = "backoff"
+            metrics.inc(f"supervisor.{service.name}.restarts")
+            print(f"服务 {service.name} 将在 {delay:.1f} 秒后重启")
+            if self._shutdown.wait(delay):
+                break
+            service.restarts += 1
+        service.state = "stopped"
+
+    def _check_loop(self):
+        while not self._shutdown.wait(Config.SUPERVISOR_HEALTH_INTERVAL):
+            for service in self.services:
+                if service.state != "running" or service.stop_event.is_set():
+                    continue
+                if service.healthy():
+                    service.unhealthy = 0
+                    continue
+                service.unhealthy += 1
+                metrics.inc(f"supervisor.{service.name}.unhealthy")
+                if service.unhealthy >= Config.SUPERVISOR_UNHEALTHY_LIMIT and not service.detached:
+                    print(f"服务 {service.name} 连续 {service.unhealthy} 次不健康，重启")
+                    service.last_error = "健康检查未通过"
+                    self._stop_service(service, Config.SHUTDOWN_DEADLINE)
+
+    def _stop_service(self, service: Service, timeout: float) -> bool:
+        service.stop_event.set()
+        if service.stop is None:
+            return True
+        try:
+            return service.stop(timeout) is not False
+        except Exception as e:
+            print(f"停止服务 {service.name} 出错: {e}")
+            return False
+
+    def shutdown(self, deadline: float = None) -> bool:
+        """
+        按注册的相反顺序停止所有服务，共用 deadline 秒的期限；
+        返回是否全部在期限内干净地停止（未排空的写入、未结束的线程都算不干净）
+        """
+        deadline = Config.SHUTDOWN_DEADLINE if deadline is None else deadline
+        end = time.monotonic() + deadline
+        self._shutdown.set()
+        clean = True
+        for service in reversed(self.services):
+            remaining = max(0.0, end - time.monotonic())
+            if not self._stop_service(service, remaining):
+                print(f"服务 {service.name} 未能在期限内停止")
+                clean = False
+            if service.detached or service.thread is None:
+                continue
+            service.thread.join(timeout=max(0.0, end - time.monotonic()))
+            if service.thread.is_alive():
+                print(f"服务 {service.name} 的线程未能在期限内结束")
+                clean = False
+        return clean
+
+    def status(self) -> dict:
+        """{'healthy': 全部健康, 'services': {名称: 状态}, 'queues': {名称: 积压}}"""
+        services = {}
+        for service in self.services:
+            services[service.name] = {
+                'state': service.state,
+                'healthy': service.healthy(),
+                'restarts': service.restarts,
+                'last_error': service.last_error,
+            }
+        queues = {}
+        for name, provider in self.queues.items():
+            try:
+                backlog = dict(provider())
+            except Exception as e:
+                backlog = {'error': str(e)}
+            if backlog.get('capacity'):
+                backlog['full'] = backlog['depth'] >= backlog['capacity']
+            queues[name] = backlog
+        return {'healthy': all(s['healthy'] for s in services.values()), 'services': services, 'queues': queues}
+
+_supervisor = None
+
+def set_supervisor(supervisor: Supervisor):
+    """登记本进程的 supervisor（由 start.py 调用），供 /api/health 读取"""
+    global _supervisor
+    _supervisor = supervisor
+
+def current_supervisor() -> Optional[Supervisor]:
+    """本进程的 supervisor；不是由 start.py 启动时（如 cli.py 的基准测试）为 None"""
+    return _supervisor
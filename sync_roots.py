@@ -0,0 +1,54 @@
+import os
+from config import Config
+
+"""
+多个 SyncClipboard 同步目录（根目录）在一个进程中同时监控，按根目录隔离
+
+- Config.SYNC_ROOTS 为 {根目录ID: 同步目录}；为空时只有一个根目录 "default"，即 SYNC_CLIPBOARD_JSON_PATH 所在目录
+- 所有根目录共用一个观察者、一个写线程、一个数据库和一个 Web 服务；历史记录用 root_id 列区分，
+  统计汇总也按根目录维护
+- 写入流水线每个阶段为每个根目录单独开工作通道，一个根目录在复制大文件时不会阻塞其他根目录
+- 新记录的 Socket.IO 推送按根目录分房间；WebDAV 中主根目录在 /dav/，其他根目录在 /dav/<根目录ID>/
+"""
+
+DEFAULT_ROOT = "default"  # 升级前的记录都属于这个根目录
+
+_RESERVED = ("file", Config.SYNC_CLIPBOARD_JSON_FILE)  # 会与 WebDAV 路径冲突的ID
+
+def sync_roots() -> dict:
+    """{根目录ID: 同步目录绝对路径}，按配置顺序"""
+    roots = Config.SYNC_ROOTS or {DEFAULT_ROOT: os.path.dirname(Config.SYNC_CLIPBOARD_JSON_PATH)}
+    for root_id in roots:
+        if not root_id or root_id in _RESERVED or "/" in root_id or "\\" in root_id:
+            raise ValueError(f"无效的根目录ID: {root_id!r}")
+    return {root_id: os.path.abspath(path) for root_id, path in roots.items()}
+
+def primary_root() -> str:
+    """主根目录：有 "default" 时是它，否则是配置中的第一个"""
+    roots = sync_roots()
+    return DEFAULT_ROOT if DEFAULT_ROOT in roots else next(iter(roots))
+
+def root_dir(root_id: str) -> str:
+    """根目录的同步目录，未配置的ID抛出 ValueError"""
+    try:
+        return sync_roots()[root_id]
+    except KeyError:
+        raise ValueError(f"未配置的根目录: {root_id}") from None
+
+def json_path(root_id: str) -> str:
+    """根目录下的 SyncClipboard.json 路径"""
+    return os.path.join(root_dir(root_id), Config.SYNC_CLIPBOARD_JSON_FILE)
+
+def files_dir(root_id: str) -> str:
+    """根目录下的 file/ 目录"""
+    return os.path.join(root_dir(root_id), "file")
+
+def root_of(path: str) -> str:
+    """路径（SyncClipboard.json 或 file/ 中的文件）所属的根目录ID，取最长匹配；都不匹配时为主根目录"""
+    path = os.path.abspath(path)
+    best, best_dir = None, ""
+    for root_id, directory in sync_roots().items():
+        inside = path == directory or path.startswith(directory.rstrip(os.sep) + os.sep)
+        if inside and len(directory) > len(best_dir):
+            best, best_dir = root_id, directory
+    return best or primary_root()
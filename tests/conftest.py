@@ -0,0 +1,63 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: 依赖实际耗时的测试，只在 RUN_SLOW_TESTS=1 时运行")
+
+def pytest_collection_modifyitems(config, items):
+    if os.environ.get("RUN_SLOW_TESTS") == "1":
+        return
+    skip = pytest.mark.skip(reason="设置 RUN_SLOW_TESTS=1 运行")
+    for item in items:
+        if "slow" in item.keywords:
+            item.add_marker(skip)
+
+@pytest.fixture
+def temp_storage(tmp_path, monkeypatch):
+    """数据库、备份、同步目录都放在临时目录中，进程内的单例（引擎、写线程等）每个测试重新创建"""
+    import database
+    import db_writer
+    import file_stager
+    import ingest_pipeline
+    import renderer
+
+    monkeypatch.setattr(Config, "BASE_DIR", str(tmp_path))
+    monkeypatch.setattr(Config, "SYNC_CLIPBOARD_JSON_PATH", str(tmp_path / Config.SYNC_CLIPBOARD_JSON_FILE))
+    monkeypatch.setattr(Config, "SYNC_ROOTS", {})
+    monkeypatch.setattr(Config, "DB_PATH", str(tmp_path / "db" / "clipboard_history.db"))
+    monkeypatch.setattr(Config, "DB_LOG_ENABLED", False)
+    monkeypatch.setattr(Config, "BACKUP_DIR", str(tmp_path / "backup"))
+    monkeypatch.setattr(Config, "FOLDER_TO_MONITOR", str(tmp_path / "backup"))
+    monkeypatch.setattr(Config, "PACK_DIR", str(tmp_path / "packs"))
+    monkeypatch.setattr(Config, "ARCHIVE_DIR", str(tmp_path / "db" / "archive"))
+    monkeypatch.setattr(Config, "SNAPSHOT_DIR", str(tmp_path / "db" / "snapshots"))
+    monkeypatch.setattr(database, "_engine", None)
+    monkeypatch.setattr(db_writer, "_writer", None)
+    monkeypatch.setattr(file_stager, "_stager", None)
+    monkeypatch.setattr(ingest_pipeline, "_pipeline", None)
+    monkeypatch.setattr(renderer, "_pool", None)
+    yield tmp_path
+    if renderer._pool is not None:
+        renderer._pool.executor.shutdown(wait=True)
+    if ingest_pipeline._pipeline is not None:
+        ingest_pipeline._pipeline.close()
+        ingest_pipeline._pipeline.stop(timeout=5)
+    if file_stager._stager is not None:
+        file_stager._stager.stop(timeout=5)
+    if db_writer._writer is not None:
+        db_writer._writer.stop(timeout=5)
+    if database._engine is not None:
+        database._engine.dispose()
+
+@pytest.fixture
+def web_client(temp_storage, monkeypatch):
+    """web_server 的测试客户端，数据在临时数据库中"""
+    import database
+    import web_server
+    monkeypatch.setattr(web_server, "history_db", database.ServerGet())
+    return web_server.app.test_client()
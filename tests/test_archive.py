@@ -0,0 +1,22 @@
+from sqlmodel import Session
+
+import archive
+import database
+
+def test_archived_item_found_by_id(temp_storage):
+    engine = database.init_db()
+    with Session(engine) as session:
+        old_id = database.ingest_history_item(session, {"Type": "Text", "Clipboard": "old", "File": "", "From": "pc"},
+                                              ts=database.date_to_ms("2024-01-15"))
+        # ID 最大的一条总是留在主表
+        database.ingest_history_item(session, {"Type": "Text", "Clipboard": "new", "File": "", "From": "pc"})
+        session.commit()
+
+    result = archive.archive_month("2024-01")
+    assert result['count'] == 1
+
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT COUNT(*) FROM clipboardhistory WHERE id = ?", (old_id,)).scalar() == 0
+    item = database.ServerGet().get_history_by_id(old_id)
+    assert item is not None
+    assert item['clipboard'] == "old"
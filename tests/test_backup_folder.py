@@ -0,0 +1,22 @@
+import os
+
+import history_service
+from config import Config
+
+def _write(path: str, size: int):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+
+def test_pack_dir_is_not_counted_or_evicted(temp_storage, monkeypatch):
+    # 即使打包目录配置在备份目录下，打包文件也不计入大小，不会因此删除单个备份文件
+    monkeypatch.setattr(Config, "PACK_DIR", os.path.join(Config.BACKUP_DIR, "packs"))
+    _write(os.path.join(Config.BACKUP_DIR, "a.txt"), 100)
+    _write(os.path.join(Config.PACK_DIR, "pack-000001.pack"), 10000)
+
+    assert history_service.get_folder_size(Config.BACKUP_DIR) == 100
+    assert history_service.delete_oldest_files(Config.BACKUP_DIR, 1000) is False
+    assert os.path.exists(os.path.join(Config.BACKUP_DIR, "a.txt"))
+
+def test_default_pack_dir_is_outside_backup_dir():
+    assert os.path.relpath(Config.PACK_DIR, Config.BACKUP_DIR).startswith("..")
@@ -0,0 +1,119 @@
+import time
+from sqlmodel import Session
+
+import database
+
+def _ingest(engine, text: str, device: str, ts: int, tag: str = None) -> int:
+    data = {"Type": "Text", "Clipboard": text, "File": "", "From": device}
+    if tag is not None:
+        data["Tag"] = tag
+    with Session(engine) as session:
+        history_id = database.ingest_history_item(session, data, ts=ts)
+        session.commit()
+    return history_id
+
+def test_repeated_text_takes_latest_device_and_tag(temp_storage):
+    engine = database.init_db()
+    ts = database.now_ms()
+    first = _ingest(engine, "same", "pc", ts - 60 * 1000, tag="work")
+    again = _ingest(engine, "same", "phone", ts)
+    assert again == first
+    again = _ingest(engine, "same", "tablet", ts + 1000, tag="home")
+    assert again == first
+
+    with Session(engine) as session:
+        item = session.get(database.ClipboardHistory, first)
+        assert (item.occurrences, item.from_equipment, item.tag, item.ts) == (3, "tablet", "home", ts + 1000)
+    with engine.connect() as conn:
+        assert database.verify_rollups(conn) == []
+        rollups = conn.exec_driver_sql("SELECT from_equipment, count FROM history_rollup").fetchall()
+    assert [tuple(row) for row in rollups] == [("tablet", 1)]
+
+def test_older_repeat_does_not_change_device(temp_storage):
+    engine = database.init_db()
+    ts = database.now_ms()
+    first = _ingest(engine, "same", "pc", ts)
+    _ingest(engine, "same", "phone", ts - 1000)
+    with Session(engine) as session:
+        assert session.get(database.ClipboardHistory, first).from_equipment == "pc"
+    with engine.connect() as conn:
+        assert database.verify_rollups(conn) == []
+
+def test_failed_commit_does_not_suppress_same_content(temp_storage, monkeypatch):
+    from config import Config
+    from ingest_pipeline import IngestPipeline
+
+    engine = database.init_db()
+    ingest = database.ingest_history_item
+    failing = [True]
+    calls = []
+    def flaky(*args):
+        calls.append(args)
+        if failing[0]:
+            raise RuntimeError("disk full")
+        return ingest(*args)
+    monkeypatch.setattr(database, "ingest_history_item", flaky)
+
+    pipeline = IngestPipeline()
+    pipeline.start()
+    try:
+        data = {"Type": "Text", "Clipboard": "retry me", "File": "", "From": "pc"}
+        pipeline.submit(Config.SYNC_CLIPBOARD_JSON_PATH, data=dict(data))
+        assert pipeline.drain(5, until="commit")
+        failing[0] = False
+        attempts = len(calls)
+        # 上次没有写入成功，同样的内容再次到达时要写入；成功之后再到达的才丢弃
+        for _ in range(2):
+            pipeline.submit(Config.SYNC_CLIPBOARD_JSON_PATH, data=dict(data))
+            assert pipeline.drain(5, until="commit")
+    finally:
+        pipeline.close()
+        pipeline.stop(timeout=5)
+
+    assert len(calls) == attempts + 1
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT COUNT(*) FROM clipboardhistory").scalar() == 1
+
+def test_text_committed_before_slower_file_stays_latest(temp_storage, monkeypatch):
+    import threading
+    from config import Config
+    from ingest_pipeline import IngestPipeline
+
+    database.init_db()
+    ingest = database.ingest_history_item
+    written = []
+    def record(session, data, *args):
+        written.append(data["Clipboard"])
+        return ingest(session, data, *args)
+    monkeypatch.setattr(database, "ingest_history_item", record)
+
+    pipeline = IngestPipeline()
+    release = threading.Event()
+    def slow_link(item):
+        release.wait(5)  # 文件还在复制，后到的文本先提交
+        return ("commit", item)
+    pipeline.stages["link"].handler = slow_link
+    pipeline.start()
+    path = Config.SYNC_CLIPBOARD_JSON_PATH
+    file_a = {"Type": "File", "Clipboard": "a.txt", "File": "a.txt", "From": "pc"}
+    text_b = {"Type": "Text", "Clipboard": "b", "File": "", "From": "pc"}
+    try:
+        pipeline.submit(path, data=dict(file_a))
+        pipeline.submit(path, data=dict(text_b))
+        deadline = time.monotonic() + 5
+        while not written and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert written == ["b"]
+        release.set()
+        assert pipeline.drain(5, until="commit")
+        assert written == ["b", "a.txt"]
+
+        # 最新的一次是 B：再次复制 B 不重复写入，再次复制 A 要写入
+        pipeline.submit(path, data=dict(text_b))
+        assert pipeline.drain(5, until="commit")
+        pipeline.submit(path, data=dict(file_a))
+        assert pipeline.drain(5, until="commit")
+    finally:
+        pipeline.close()
+        pipeline.stop(timeout=5)
+    assert written == ["b", "a.txt", "a.txt"]
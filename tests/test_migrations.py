@@ -0,0 +1,77 @@
+import os
+import sqlite3
+from sqlalchemy import inspect
+from sqlmodel import SQLModel
+
+import database
+from config import Config
+
+# 第一个发布版本（迁移机制出现之前）建出的表结构，原样保留，用于验证旧库升级
+BASELINE_SCHEMA = """
+CREATE TABLE clipboardhistory (
+    id INTEGER NOT NULL, raw_content TEXT, uuid VARCHAR NOT NULL, clipboard VARCHAR NOT NULL,
+    type VARCHAR NOT NULL, from_equipment VARCHAR, tag VARCHAR, timestamp DATETIME, checksum VARCHAR,
+    PRIMARY KEY (id), UNIQUE (uuid)
+);
+CREATE INDEX ix_clipboardhistory_checksum ON clipboardhistory (checksum);
+CREATE TABLE backup_files (
+    id INTEGER NOT NULL, checksum VARCHAR NOT NULL, filepath VARCHAR NOT NULL, size INTEGER NOT NULL,
+    PRIMARY KEY (id)
+);
+CREATE UNIQUE INDEX ix_backup_files_checksum ON backup_files (checksum);
+CREATE TABLE folder (
+    id INTEGER NOT NULL, name VARCHAR NOT NULL, parent_id INTEGER NOT NULL, path VARCHAR,
+    PRIMARY KEY (id), FOREIGN KEY(parent_id) REFERENCES folder (id)
+);
+CREATE TABLE favorites (
+    id INTEGER NOT NULL, history_uuid VARCHAR NOT NULL, folder_id INTEGER NOT NULL, created_at DATETIME,
+    PRIMARY KEY (id), CONSTRAINT _favorite_unique UNIQUE (history_uuid, folder_id),
+    FOREIGN KEY(history_uuid) REFERENCES clipboardhistory (uuid), FOREIGN KEY(folder_id) REFERENCES folder (id)
+);
+"""
+
+def _make_baseline_db(path: str, rows: int = 5):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    for i in range(rows):
+        conn.execute(
+            "INSERT INTO clipboardhistory (raw_content, uuid, clipboard, type, from_equipment, timestamp) "
+            "VALUES (?, ?, ?, 'Text', 'pc', ?)",
+            (f'{{"Type": "Text", "Clipboard": "hello {i}", "File": "", "From": "pc"}}', f"uuid-{i}",
+             f"hello {i}", f"2024-01-0{i + 1} 08:00:00.000000"),
+        )
+    conn.execute("INSERT INTO folder (id, name, parent_id, path) VALUES (1, 'Root', 0, '/1/')")
+    conn.execute("INSERT INTO folder (id, name, parent_id, path) VALUES (2, 'Work', 1, '/1/2/')")
+    conn.execute("INSERT INTO favorites (history_uuid, folder_id) VALUES ('uuid-0', 2)")
+    conn.commit()
+    conn.close()
+
+def _columns(engine) -> dict:
+    inspector = inspect(engine)
+    return {table: {col["name"] for col in inspector.get_columns(table)} for table in inspector.get_table_names()}
+
+def test_baseline_database_upgrades_through_every_migration(temp_storage):
+    _make_baseline_db(Config.DB_PATH)
+    engine = database.init_db()
+
+    assert database.run_migrations(engine) == database.MIGRATIONS[-1][0]
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT COUNT(*) FROM clipboardhistory").scalar() == 5
+        assert conn.exec_driver_sql("SELECT COUNT(*) FROM clipboardhistory WHERE ts = 0").scalar() == 0
+        assert conn.exec_driver_sql("SELECT COUNT(*) FROM folder WHERE parent_id IS NULL").scalar() == 1
+        assert conn.exec_driver_sql("SELECT COUNT(*) FROM favorites").scalar() == 1
+        assert database.verify_rollups(conn) == []
+
+    # 升级后的旧库与新库的列一致（都和当前模型一致）
+    expected = {table.name: {col.name for col in table.columns} for table in SQLModel.metadata.sorted_tables}
+    actual = _columns(engine)
+    for table, columns in expected.items():
+        assert actual.get(table) == columns, table
+
+def test_new_database_matches_model(temp_storage):
+    engine = database.init_db()
+    expected = {table.name: {col.name for col in table.columns} for table in SQLModel.metadata.sorted_tables}
+    actual = _columns(engine)
+    for table, columns in expected.items():
+        assert actual.get(table) == columns, table
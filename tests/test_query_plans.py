@@ -0,0 +1,49 @@
+from itertools import combinations
+
+import pytest
+
+import database
+
+# 每种筛选条件的示例取值，任意组合（含/不含游标）都要走索引
+SAMPLES = {
+    'root': {'root': 'alice'},
+    'type': {'type': 'Text'},
+    'source': {'source': 'PC-Desktop'},
+    'date': {'start_date': '2025-01-01', 'end_date': '2025-01-31'},
+    'starred': {'starred': True},
+}
+
+def _combinations():
+    for n in range(len(SAMPLES) + 1):
+        for keys in combinations(SAMPLES, n):
+            for cursor in (None, "1735689600000:10"):
+                yield keys, cursor
+
+def _label(keys, cursor) -> str:
+    return "+".join(keys) + ("+cursor" if cursor else "") or "none"
+
+@pytest.mark.parametrize("keys,cursor", list(_combinations()),
+                         ids=[_label(keys, cursor) for keys, cursor in _combinations()])
+def test_history_filters_use_index(temp_storage, keys, cursor):
+    """
+    EXPLAIN QUERY PLAN 中不出现额外的排序临时表；有筛选条件或游标时必须按索引 SEARCH clipboardhistory，
+    不能退化为扫描整个索引（SCAN ... USING [COVERING] INDEX），只有不带条件的首页允许按 ts 索引顺序扫描
+    """
+    engine = database.init_db()
+    filters = {}
+    for key in keys:
+        filters.update(SAMPLES[key])
+    query = database.build_history_query(filters, cursor).limit(31)
+    sql = str(query.compile(engine, compile_kwargs={"literal_binds": True}))
+    with engine.connect() as conn:
+        plan = [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+    assert not any("TEMP B-TREE" in step for step in plan), plan
+    if not keys and not cursor:
+        assert plan == ["SCAN clipboardhistory USING INDEX ix_history_ts"], plan
+        return
+    assert not any(step.startswith("SCAN") for step in plan), plan
+    searches = [step for step in plan if step.startswith("SEARCH clipboardhistory USING")]
+    assert searches, plan
+    # 有等值条件时索引要用上其中一个等值列，只有时间条件时按 ts 范围查找
+    expected = "=?" if set(keys) - {'date'} else "ts"
+    assert any(expected in step for step in searches), plan
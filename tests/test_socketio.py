@@ -0,0 +1,32 @@
+import pytest
+
+import db_writer
+from broadcast import monitor_auth
+
+@pytest.fixture
+def web(web_client, monkeypatch):
+    import web_server
+    monkeypatch.setattr(web_server.broadcaster, "interval", 0)  # 立即推送，便于检查
+    return web_server
+
+def _updates(client) -> list:
+    return [event['args'][0] for event in client.get_received() if event['name'] == 'history_update']
+
+def test_history_update_only_accepted_from_monitor(web):
+    page = web.socketio.test_client(web.app)
+    page.emit('join', {'root': 'default'}, callback=True)
+    page.get_received()
+    before = db_writer.change_sequence()
+
+    # 网页（没有监控口令）发来的报告被丢弃，不影响变更序号
+    forger = web.socketio.test_client(web.app, auth={'token': 'guess'})
+    forger.emit('history_update', {'root': 'default', 'id': 1, 'type': 'Text', 'device': 'pc'})
+    assert db_writer.change_sequence() == before
+    assert _updates(page) == []
+
+    monitor = web.socketio.test_client(web.app, auth=monitor_auth())
+    monitor.emit('history_update', {'root': 'default', 'id': 7, 'type': 'Text', 'device': 'pc'})
+    assert db_writer.change_sequence() == before + 1
+    assert [update['ids'] for update in _updates(page)] == [[7]]
+    for client in (page, forger, monitor):
+        client.disconnect()
@@ -0,0 +1,44 @@
+import os
+import socket
+import subprocess
+import sys
+
+import pytest
+
+import start
+from config import Config
+
+REPO_DIR = os.path.dirname(os.path.abspath(start.__file__))
+
+# 启动时不应加载的重量级模块：Web 服务、监控服务及其依赖，都应在各自线程内延迟导入
+HEAVY_MODULES = ("web_server", "history_service", "watchdog", "socketio", "flask_socketio", "eventlet")
+
+def _loaded_modules(code: str) -> set:
+    """在新的解释器中执行 code，返回其中已加载的重量级模块"""
+    probe = code + "\nimport sys\nprint(' '.join(m for m in %r if m in sys.modules))" % (HEAVY_MODULES,)
+    result = subprocess.run([sys.executable, "-c", probe], cwd=REPO_DIR, capture_output=True, text=True,
+                            timeout=60, check=True)
+    return set(result.stdout.split())
+
+def test_import_start_is_lightweight():
+    assert _loaded_modules("import start") == set()
+
+def test_build_supervisor_defers_heavy_imports():
+    assert _loaded_modules("import start\nstart.build_supervisor()") == set()
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+@pytest.mark.slow
+def test_cold_start_within_budget(temp_storage):
+    """实际计时，受机器负载影响，只在 RUN_SLOW_TESTS=1 时运行（等同于 start.py --check-startup）"""
+    db_path = os.path.join(REPO_DIR, "db", "clipboard_history.db")
+    before = os.path.getmtime(db_path) if os.path.exists(db_path) else None
+
+    elapsed = start.check_startup_budget(_free_port())
+
+    assert elapsed <= Config.STARTUP_BUDGET_SECONDS
+    # 子进程使用临时数据目录，正式数据库不会被创建或修改
+    assert (os.path.getmtime(db_path) if os.path.exists(db_path) else None) == before
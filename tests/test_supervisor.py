@@ -0,0 +1,59 @@
+import json
+import time
+import pytest
+
+import database
+import start
+from config import Config
+from ingest_pipeline import get_pipeline
+from supervisor import Service, Supervisor
+
+def _wait(condition, timeout: float = 10.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+def _history_count() -> int:
+    with database.get_engine().connect() as conn:
+        return conn.exec_driver_sql("SELECT COUNT(*) FROM clipboardhistory").scalar()
+
+def _copy_text(text: str):
+    with open(Config.SYNC_CLIPBOARD_JSON_PATH, "w", encoding="utf-8") as f:
+        json.dump({"Type": "Text", "Clipboard": text, "File": "", "From": "pc"}, f)
+    get_pipeline().submit(Config.SYNC_CLIPBOARD_JSON_PATH)
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_ingest_resumes_after_stage_thread_dies(temp_storage, monkeypatch):
+    monkeypatch.setattr(Config, "SUPERVISOR_HEALTH_INTERVAL", 0.05)
+    monkeypatch.setattr(Config, "SUPERVISOR_UNHEALTHY_LIMIT", 1)
+    monkeypatch.setattr(Config, "SUPERVISOR_BACKOFF_MIN", 0.01)
+    database.init_db()
+    supervisor = Supervisor()
+    service = supervisor.add(Service("ingest", start.run_ingest, stop=start.stop_ingest, health=start.ingest_healthy))
+    supervisor.start()
+    try:
+        assert _wait(lambda: service.state == "running" and start.ingest_healthy())
+        _copy_text("before")
+        assert get_pipeline().drain(5, until="commit")
+        assert _history_count() == 1
+
+        # parse 阶段的工作线程意外退出（SystemExit 不会被阶段的异常处理拦住）
+        stage = get_pipeline().stages["parse"]
+        handler = stage.handler
+        def crash(item):
+            stage.handler = handler
+            raise SystemExit
+        stage.handler = crash
+        _copy_text("crash")
+        assert _wait(lambda: not all(thread.is_alive() for thread in stage.threads))
+
+        # supervisor 发现不健康，停止并重启写入：同一个流水线、写线程原地恢复
+        assert _wait(lambda: service.restarts >= 1 and service.state == "running" and start.ingest_healthy())
+        _copy_text("after")
+        assert get_pipeline().drain(5, until="commit")
+        assert _wait(lambda: _history_count() == 2)
+    finally:
+        assert supervisor.shutdown(5)
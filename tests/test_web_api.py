@@ -0,0 +1,59 @@
+import database
+from config import Config
+
+def _add_text(text: str, device: str = "pc") -> int:
+    return database.add_history_item_from_json({"Type": "Text", "Clipboard": text, "File": "", "From": device},
+                                               engine=database.get_engine())
+
+def _starred() -> int:
+    with database.get_engine().connect() as conn:
+        return conn.exec_driver_sql("SELECT COUNT(*) FROM clipboardhistory WHERE starred").scalar()
+
+def test_bulk_requires_list_of_ints(web_client):
+    _add_text("hello")
+    for ids in ("123", [1, "2"], [True], {"1": 1}, 5):
+        response = web_client.post("/api/bulk", json={"action": "star", "ids": ids})
+        assert response.status_code == 400, ids
+    assert _starred() == 0
+
+def test_bulk_limits_ids(web_client, monkeypatch):
+    ids = [_add_text(f"text {i}") for i in range(3)]
+    monkeypatch.setattr(Config, "BULK_MAX_IDS", 2)
+    assert web_client.post("/api/bulk", json={"action": "star", "ids": ids}).status_code == 400
+    response = web_client.post("/api/bulk", json={"action": "star", "ids": ids[:2]})
+    assert response.status_code == 200
+    assert sorted(response.get_json()["data"]["ids"]) == sorted(ids[:2])
+    assert _starred() == 2
+
+def test_remove_from_missing_collection(web_client):
+    history_id = _add_text("hello")
+    response = web_client.post("/collection/remove", data={"collection_id": 999, "history_id": history_id})
+    assert response.status_code == 400
+    assert response.get_json()["status"] == "error"
+
+def test_pages_subscribe_to_their_view(web_client):
+    page = web_client.get("/").get_data(as_text=True)
+    assert "socket.io" in page and "subscribeView({ root: ROOT }" in page
+    page = web_client.get("/favorites").get_data(as_text=True)
+    assert "subscribeView({ folder: null }" in page
+
+def test_download_supports_range_and_conditional(web_client, monkeypatch):
+    import os
+    from sqlmodel import Session
+
+    monkeypatch.setattr(Config, "DOWNLOAD_OFFLOAD", "sendfile")  # 已移除的方式按 send_file 处理
+    os.makedirs(Config.BACKUP_DIR, exist_ok=True)
+    path = os.path.join(Config.BACKUP_DIR, "blob.bin")
+    content = os.urandom(200 * 1024)
+    with open(path, "wb") as f:
+        f.write(content)
+    with Session(database.get_engine()) as session:
+        session.add(database.BackupFile(checksum="c" * 32, filepath=path, size=len(content)))
+        session.commit()
+    url = f"/api/download?checksum={'c' * 32}"
+    full = web_client.get(url)
+    assert full.status_code == 200 and full.data == content
+    partial = web_client.get(url, headers={"Range": "bytes=100-199"})
+    assert partial.status_code == 206 and partial.data == content[100:200]
+    cached = web_client.get(url, headers={"If-None-Match": full.headers["ETag"]})
+    assert cached.status_code == 304
@@ -0,0 +1,43 @@
+import base64
+
+import pytest
+from flask import Flask
+
+import webdav
+from config import Config
+from ingest_pipeline import get_pipeline
+
+def _auth(username: str, password: str) -> dict:
+    token = base64.b64encode(f"{username}:{password}".encode()).decode()
+    return {"Authorization": f"Basic {token}"}
+
+@pytest.fixture
+def client(temp_storage, monkeypatch):
+    monkeypatch.setattr(Config, "WEBDAV_USERNAME", "alice")
+    monkeypatch.setattr(Config, "WEBDAV_PASSWORD", "secret")
+    app = Flask(__name__)
+    app.register_blueprint(webdav.bp, url_prefix=Config.WEBDAV_PREFIX)
+    return app.test_client()
+
+def test_requires_credentials(client, monkeypatch):
+    assert client.open("/dav/", method="PROPFIND").status_code == 401
+    assert client.open("/dav/", method="PROPFIND", headers=_auth("alice", "wrong")).status_code == 401
+    assert client.open("/dav/", method="PROPFIND", headers=_auth("alice", "secret")).status_code == 207
+
+    # 没有设置密码时拒绝所有请求，而不是不认证
+    monkeypatch.setattr(Config, "WEBDAV_PASSWORD", "")
+    assert not webdav.credentials_configured()
+    assert client.open("/dav/", method="PROPFIND", headers=_auth("alice", "")).status_code == 401
+
+def test_disabled_by_default():
+    assert Config.WEBDAV_ENABLED is False
+
+def test_every_write_returns_503_while_closing(client):
+    headers = _auth("alice", "secret")
+    assert client.put("/dav/file/a.txt", data=b"hello", headers=headers).status_code == 201
+    get_pipeline().close()
+    assert client.put("/dav/SyncClipboard.json", data=b"{}", headers=headers).status_code == 503
+    assert client.put("/dav/file/b.txt", data=b"hello", headers=headers).status_code == 503
+    assert client.delete("/dav/file/a.txt", headers=headers).status_code == 503
+    assert client.open("/dav/file", method="MKCOL", headers=headers).status_code == 503
+    assert client.get("/dav/file/a.txt", headers=headers).status_code == 200
@@ -1,13 +1,25 @@
-import eventlet
+# eventlet 由 Flask-SocketIO 在 async_mode='eventlet' 时自行导入
 # eventlet.monkey_patch()
-from flask import Flask, render_template, request, jsonify, send_from_directory, g, send_file
-from flask_socketio import SocketIO
+import hashlib
+from functools import wraps
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory, g, send_file, stream_template
+from flask_socketio import SocketIO, join_room, leave_room
 from config import Config
+from broadcast import Broadcaster, is_monitor
 from database import ServerGet, ServerSet
+from file_serving import download_response, packed_response, ranged_response
 
 app = Flask(__name__, template_folder=Config.TEMPLATES_DIR, static_folder=Config.STATIC_DIR)
 socketio = SocketIO(app, async_mode='eventlet')  # 新增
 
+# 内置 WebDAV 同步服务（没有设置用户名和密码时不启用，避免无认证地暴露同步目录）
+if Config.WEBDAV_ENABLED:
+    from webdav import bp as webdav_bp, credentials_configured
+    if credentials_configured():
+        app.register_blueprint(webdav_bp, url_prefix=Config.WEBDAV_PREFIX)
+    else:
+        print("WebDAV 未启用：请先设置 Config.WEBDAV_USERNAME 与 Config.WEBDAV_PASSWORD")
+
 # 创建 ServerGet 实例
 history_db = ServerGet()
 
@@ -20,25 +32,58 @@ def set_db():
 def close_db(exception):
     return 0
 
-# 主页仅渲染模板，数据通过API加载
+def conditional(view):
+    """
+    列表与筛选响应的条件请求：ETag 由数据版本号（启动标识 + 变更序号，见 db_writer.data_version）
+    与请求路径、参数（游标、偏移、筛选条件）组成。If-None-Match 匹配时直接返回 304，不查询数据库；
+    数据有任何修改后所有旧的 ETag 都失效。版本号在查询前取得，查询期间有提交时下次请求会重新查询
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        from db_writer import data_version
+        from metrics import metrics
+        params = repr((request.path, sorted(request.args.items(multi=True)))).encode("utf-8")
+        etag = f"{data_version()}-{hashlib.md5(params).hexdigest()[:16]}"
+        if request.if_none_match.contains(etag):
+            metrics.inc("http.not_modified")
+            response = Response(status=304)
+        else:
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'  # 浏览器每次都带上 If-None-Match 重新验证
+        return response
+    return wrapper
+
+# 主页：边渲染边发送，首页数据以内联 JSON 随页面一起返回，不再等页面加载后另发请求
+# first_page 在模板渲染到数据位置时才调用，页头先发出，浏览器可以同时加载样式和脚本
 @app.route('/')
 # @app.route('/history')
 def index():
-    return render_template('index.html', active_page='history')
+    from sync_roots import sync_roots
+    page_size = Config.HISTORY_PAGE_SIZE
+    roots = list(sync_roots())
+    root = request.args.get('root') if request.args.get('root') in roots else None  # 为空表示所有根目录
+    return stream_template('index.html', active_page='history', page_size=page_size, root=root,
+                           roots=roots if len(roots) > 1 else [],
+                           first_page=lambda: history_db.get_first_page(page_size, root),
+                           stats=lambda: history_db.get_stats({'root': root}))
 
 # 主页列表专用分页API
 @app.route('/api/history')
+@conditional
 def api_history_paginated():
     try:
         # 解析分页参数
-        limit = int(request.args.get('limit', 30))
+        limit = int(request.args.get('limit', Config.HISTORY_PAGE_SIZE))
         offset = int(request.args.get('offset', 0))
         # 限制参数范围
         limit = max(1, min(limit, 100))
         offset = max(0, offset)
         
         # 使用实例调用方法
-        result = history_db.get_history_paginated(limit=limit, offset=offset)
+        result = history_db.get_history_paginated(limit=limit, offset=offset, root=request.args.get('root') or None)
 
         print("::DEBUG::", "API /api/history called with limit:", limit, "offset:", offset)
 
@@ -46,6 +91,22 @@ def api_history_paginated():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# 运行指标（写入流水线各阶段等）
+@app.route('/api/metrics')
+def api_metrics():
+    from metrics import metrics
+    return jsonify(metrics.snapshot())
+
+# 服务健康状态（由 start.py 的 supervisor 管理时才有服务与队列信息）
+@app.route('/api/health')
+def api_health():
+    from supervisor import current_supervisor
+    supervisor = current_supervisor()
+    if supervisor is None:
+        return jsonify({'healthy': True, 'services': {}, 'queues': {}})
+    status = supervisor.status()
+    return jsonify(status), 200 if status['healthy'] else 503
+
 # 添加下载文件的API
 @app.route('/api/download')
 def download_file():
@@ -53,40 +114,153 @@ def download_file():
     if not checksum:
         return "缺少参数", 400
     
-    # 调用数据库层获取文件路径，不直接操作数据库
-    file_path = history_db.get_file_path_by_checksum(checksum)
+    # 调用数据库层获取文件位置，不直接操作数据库
+    location = history_db.get_backup_location(checksum)
     
-    if not file_path:
+    if not location:
         return "文件不存在或已丢失", 404
+    if location['offset'] is not None:
+        # 已打包：从打包文件中直接读取这一段
+        return packed_response(location['path'], location['offset'], location['size'], location['name'], checksum)
         
-    # 发送文件
-    return send_file(file_path, as_attachment=True)
+    # 发送文件（可配置为交给前置代理发送）
+    return download_response(location['path'])
 
 ##############################################################################
 
+def parse_filters(source) -> dict:
+    """从请求参数（或 JSON 对象）中取出筛选条件，与 build_history_query 一致"""
+    return {
+        'root': source.get('root', ''),
+        'type': source.get('type', ''),
+        'source': source.get('source', ''),
+        'start_date': source.get('start_date', ''),
+        'end_date': source.get('end_date', ''),
+        'starred': source.get('starred', '') in ('true', True)
+    }
+
 @app.route('/history')
+@conditional
 def history_api():
-    filters = {
-        'type': request.args.get('type', ''),
-        'source': request.args.get('source', ''),
-        'start_date': request.args.get('start_date', ''),
-        'end_date': request.args.get('end_date', ''),
-        'starred': request.args.get('starred', '') == 'true'
-    }
-    records = history_db.get_history(filters=filters)
-    return jsonify(records)
+    filters = parse_filters(request.args)
+    try:
+        limit = max(1, min(int(request.args.get('limit', 30)), 100))
+        result = history_db.get_history(filters=filters, cursor=request.args.get('cursor') or None, limit=limit)
+    except ValueError as e:
+        # 日期或游标格式错误
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+    return jsonify({'success': True, 'data': result})
+
+# 文本记录的完整内容（列表中只有预览），UTF-8 纯文本，支持 Range 分段读取
+@app.route('/api/history/<int:item_id>/content')
+def history_content(item_id):
+    from database import iter_text_bytes
+    source = history_db.get_text_source(item_id)
+    if source is None:
+        return jsonify({'success': False, 'error': '记录不存在或不是文本'}), 404
+    return ranged_response(
+        lambda start, end: iter_text_bytes(source['clipboard'], source['body'], source['codec'], start, end),
+        source['length'], 'text/plain', source['hash'])
+
+# 文本记录预先渲染好的 HTML 片段（代码高亮、JSON、Markdown、链接），来自渲染缓存
+@app.route('/api/history/<int:item_id>/rendered')
+def rendered_history(item_id):
+    from renderer import get_render_pool
+    rendered = get_render_pool().get(item_id)
+    if rendered is None:
+        return jsonify({'success': False, 'error': '记录不存在或不是文本'}), 404
+    return jsonify({'success': True, 'data': rendered})
+
+# 渲染片段的高亮样式
+@app.route('/api/render.css')
+def render_css():
+    from renderer import stylesheet
+    response = Response(stylesheet(), mimetype='text/css')
+    response.cache_control.max_age = 24 * 60 * 60
+    return response
+
+# 统计：总计、按类型、按来源、按天（热力图）；筛选参数与 /history 相同（starred 除外）
+@app.route('/api/stats')
+@conditional
+def stats_api():
+    try:
+        return jsonify({'success': True, 'data': history_db.get_stats(parse_filters(request.args))})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+# 按ID批量获取记录：GET ?ids=1,2,3 或 POST {"ids": [1, 2, 3]}
+@app.route('/api/history/batch', methods=['GET', 'POST'])
+def history_batch():
+    try:
+        if request.method == 'POST':
+            ids = [int(i) for i in (request.get_json(silent=True) or {}).get('ids', [])]
+        else:
+            ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip()]
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'ids 必须是整数列表'}), 400
+    if len(ids) > Config.BULK_MAX_IDS:
+        return jsonify({'success': False, 'error': f'一次最多获取 {Config.BULK_MAX_IDS} 条'}), 400
+    return jsonify({'success': True, 'data': history_db.get_history_by_ids(ids)})
+
+# 流式导出：/api/export?format=ndjson|csv|zip，筛选参数与 /history 相同
+@app.route('/api/export')
+def export_history():
+    from export import export_stream
+    fmt = request.args.get('format', 'ndjson')
+    try:
+        chunks, mimetype, extension = export_stream(fmt, parse_filters(request.args))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return Response(chunks, mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=clipboard_history.{extension}'})
+
+# 批量操作：{"action": "star|unstar|tag|move|delete", "ids": [...] 或 "filter": {...}, "tag": "...", "folder_id": 1}
+# 整批在一个事务中完成，完成后推送一次合并的 history_delta 事件
+@app.route('/api/bulk', methods=['POST'])
+def bulk_action():
+    body = request.get_json(silent=True) or {}
+    ids = body.get('ids')
+    filters = parse_filters(body['filter']) if isinstance(body.get('filter'), dict) else None
+    # 必须是整数列表：字符串 "123" 逐字符转换会变成 [1, 2, 3]
+    if ids is not None and not (isinstance(ids, list)
+                                and all(isinstance(i, int) and not isinstance(i, bool) for i in ids)):
+        return jsonify({'success': False, 'error': 'ids 必须是整数列表'}), 400
+    if ids and len(ids) > Config.BULK_MAX_IDS:
+        return jsonify({'success': False, 'error': f'一次最多操作 {Config.BULK_MAX_IDS} 条'}), 400
+    if not ids and not (filters and any(filters.values())):
+        return jsonify({'success': False, 'error': '需要 ids 或非空的 filter'}), 400
+    try:
+        ids = ids or None
+        affected = set_db().bulk_update(body.get('action'), ids, filters,
+                                        tag=body.get('tag'), folder_id=body.get('folder_id'))
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    notify_history_delta(body.get('action'), affected)
+    return jsonify({'success': True, 'data': {'action': body.get('action'), 'ids': affected}})
 
 @app.route('/favorites')
 def favorites():
-    """展示收藏页面"""
-    
+    """展示收藏页面：默认显示所有星标记录，指定 folder 时显示该收藏夹中的条目"""
+    folder_id = request.args.get('folder', type=int)
+    if folder_id:
+        records = history_db.get_folder_items(folder_id, limit=100)['records']
+    else:
+        records = history_db.get_history(filters={'starred': True}, limit=100)['records']
     return render_template('favorites.html', 
                           records=records, 
+                          folders=history_db.get_folders(),
+                          current_folder=folder_id,
                           active_page='favorites')
 
 @app.route('/star/<int:item_id>', methods=['POST'])
 def toggle_star(item_id):
-    new_status = get_db().toggle_star(item_id)
+    try:
+        new_status = set_db().toggle_star(item_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
+    notify_history_delta('star' if new_status else 'unstar', [item_id])
     return jsonify({'starred': new_status})
 
 # @app.route('/download/<path:filename>')
@@ -118,42 +292,120 @@ def settings():
     return render_template('settings.html', settings=settings_data)
 
 
-# 网页服务添加路由
+# 收藏夹（闭包表维护层级与计数）
 @app.route('/collections', methods=['GET', 'POST'])
 def collections():
     if request.method == 'POST':
         name = request.form['name']
-        parent_id = request.form.get('parent_id', None)
-        get_db().create_collection(name, parent_id)
-        return jsonify({'status': 'success'})
+        parent_id = request.form.get('parent_id', None, type=int)
+        try:
+            folder_id = set_db().create_collection(name, parent_id)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'error': str(e)}), 400
+        return jsonify({'status': 'success', 'id': folder_id})
     
-    collections = get_db().get_collections()
-    return render_template('collections.html', collections=collections)
+    return jsonify({'status': 'success', 'collections': history_db.get_folders()})
 
 @app.route('/collection/<int:collection_id>')
+@conditional
 def view_collection(collection_id):
-    items = get_db().get_collection_items(collection_id)
-    return render_template('collection.html', items=items, collection_id=collection_id)
+    cursor = request.args.get('cursor', None, type=int)
+    return jsonify({
+        'status': 'success',
+        'subtree': history_db.get_folder_subtree(collection_id),
+        'items': history_db.get_folder_items(collection_id, cursor=cursor)
+    })
+
+@app.route('/collection/<int:collection_id>/move', methods=['POST'])
+def move_collection(collection_id):
+    parent_id = request.form.get('parent_id', None, type=int)
+    try:
+        set_db().move_collection(collection_id, parent_id)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
+    return jsonify({'status': 'success'})
+
+@app.route('/collection/<int:collection_id>/delete', methods=['POST'])
+def delete_collection(collection_id):
+    try:
+        deleted = set_db().delete_collection(collection_id)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
+    return jsonify({'status': 'success', 'deleted': deleted})
 
 @app.route('/collection/add', methods=['POST'])
 def add_to_collection():
-    collection_id = request.form['collection_id']
-    history_id = request.form['history_id']
-    get_db().add_to_collection(collection_id, history_id)
+    collection_id = request.form.get('collection_id', None, type=int)
+    history_id = request.form.get('history_id', type=int)
+    try:
+        set_db().add_to_collection(collection_id, history_id)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
+    notify_history_delta('collect', [history_id])
     return jsonify({'status': 'success'})
 
 @app.route('/collection/remove', methods=['POST'])
 def remove_from_collection():
-    collection_id = request.form['collection_id']
-    history_id = request.form['history_id']
-    get_db().remove_from_collection(collection_id, history_id)
+    collection_id = request.form.get('collection_id', None, type=int)
+    history_id = request.form.get('history_id', type=int)
+    try:
+        removed = set_db().remove_from_collection(collection_id, history_id)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
+    if removed:
+        notify_history_delta('uncollect', [history_id])
     return jsonify({'status': 'success'})
 
 
+# Socket.IO 推送：网页按视图订阅（根目录、类型、来源设备、收藏夹），事件合并后定时发送（见 broadcast.py）
+broadcaster = Broadcaster(socketio, lookup=history_db.get_history_routing)
+_monitor_sids = set()  # 带了监控口令连接的客户端，只有它们可以报告新记录
+
+@socketio.on('connect')
+def on_connect(auth=None):
+    if is_monitor(auth):
+        _monitor_sids.add(request.sid)
+
+@socketio.on('join')
+def join_view(data=None):
+    """
+    客户端订阅一个视图：{"root", "type", "device", "folder"} 的任意组合，都不指定时接收全部；
+    切换时离开原来的房间
+    """
+    try:
+        old, room = broadcaster.subscribe(request.sid, data)
+    except (TypeError, ValueError):
+        return {'success': False, 'error': 'folder 必须是整数'}
+    if old and old != room:
+        leave_room(old)
+    join_room(room)
+    return {'success': True, 'room': room}
+
+@socketio.on('disconnect')
+def leave_view(reason=None):
+    _monitor_sids.discard(request.sid)
+    broadcaster.unsubscribe(request.sid)
+
+@socketio.on('history_update')
+def relay_history_update(data=None):
+    """
+    监控服务（Socket.IO 客户端）报告新记录 {'root', 'id', 'type', 'device'}，合并后转发给相关视图的网页。
+    其他客户端（网页）发来的丢弃：否则任何人都可以让所有 ETag 失效并推送伪造的新记录
+    """
+    from db_writer import mark_changed
+    if request.sid not in _monitor_sids:
+        return
+    mark_changed()  # 监控服务单独运行时由它的进程写入，本进程的变更序号不会变
+    data = data or {}
+    notify_history_update(data.get('root'), {field: data.get(field) for field in ('id', 'type', 'device')})
+
 # 提供一个通知接口，供监控服务调用
-def notify_history_update():
-    socketio.emit('history_update')  # 向所有客户端推送事件
+def notify_history_update(root_id=None, event: dict = None):
+    broadcaster.publish_update(dict(event or {}, root=root_id))
 
+def notify_history_delta(action: str, ids: list):
+    """推送变更增量（合并后每个视图一个事件），客户端只需更新或移除这些记录"""
+    broadcaster.publish_delta(action, ids)
 
 if __name__ == '__main__':
     socketio.run(app, host='0.0.0.0', port=5000, debug=True)  # 用 socketio.run 启动
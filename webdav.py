@@ -0,0 +1,211 @@
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+from email.utils import formatdate
+from urllib.parse import quote
+from xml.sax.saxutils import escape
+from flask import Blueprint, Response, request, send_file
+from config import Config
+from sync_roots import files_dir, json_path, primary_root, root_dir, sync_roots
+
+"""
+内置 WebDAV 服务：实现 SyncClipboard 用到的子集，客户端的服务器地址填 http://<主机>:<端口>/dav
+
+- 只有 SyncClipboard.json 与 file/ 目录下的文件两类资源
+- PUT SyncClipboard.json：原子替换磁盘文件，并把内容直接交给写入流水线（不等待文件监控、不再读盘）
+- PUT file/<名称>：边接收边计算 MD5，写入临时文件后整体替换，再硬链接进备份目录并立即登记
+  （见 file_stager.py），随后到达的 SyncClipboard.json 不用再复制文件
+- 文件总是整体替换而不是原地修改，所以硬链接的备份不会被后续上传改坏
+- 配置了多个同步目录（见 sync_roots.py）时，主根目录在 /dav/，其他根目录在 /dav/<根目录ID>/
+- 总是要求 HTTP Basic 认证，没有设置用户名和密码时不启用（见 web_server.py）
+- 关闭期间（写入流水线已停止接收）所有写操作返回 503，客户端稍后重试
+"""
+
+bp = Blueprint("webdav", __name__)
+
+DAV_METHODS = ["OPTIONS", "GET", "HEAD", "PUT", "DELETE", "PROPFIND", "MKCOL"]
+WRITE_METHODS = ("PUT", "DELETE", "MKCOL")
+
+def credentials_configured() -> bool:
+    """是否设置了用户名和密码（没有设置时不提供 WebDAV 服务）"""
+    return bool(Config.WEBDAV_USERNAME and Config.WEBDAV_PASSWORD)
+
+def resolve(path: str):
+    """
+    把请求路径解析为 (种类, 磁盘路径, 根目录ID)，种类为 root / json / files / file；不支持的路径返回 None
+    """
+    path = path.strip("/")
+    root_id = primary_root()
+    head, _, rest = path.partition("/")
+    if head in sync_roots() and head != root_id:
+        root_id, path = head, rest
+    if path == "":
+        return "root", root_dir(root_id), root_id
+    if path == Config.SYNC_CLIPBOARD_JSON_FILE:
+        return "json", json_path(root_id), root_id
+    if path == "file":
+        return "files", files_dir(root_id), root_id
+    if path.startswith("file/"):
+        name = path[len("file/"):]
+        if name in ("", ".", "..") or "/" in name or "\\" in name or "\0" in name:
+            return None
+        return "file", os.path.join(files_dir(root_id), name), root_id
+    return None
+
+def _same(given, expected: str) -> bool:
+    """常数时间比较，不因提前返回泄露匹配了多少字符"""
+    return hmac.compare_digest((given or "").encode("utf-8"), expected.encode("utf-8"))
+
+@bp.before_request
+def check_auth():
+    """要求 HTTP Basic 认证；没有设置用户名和密码时拒绝所有请求"""
+    auth = request.authorization
+    if credentials_configured() and auth is not None and auth.type == "basic":
+        # 两项都比较完再判断，用户名错误与密码错误的耗时相同
+        if _same(auth.username, Config.WEBDAV_USERNAME) & _same(auth.password, Config.WEBDAV_PASSWORD):
+            return None
+    return Response("需要认证", 401, {"WWW-Authenticate": 'Basic realm="SyncClipboard"'})
+
+@bp.route("/", defaults={"path": ""}, methods=DAV_METHODS, strict_slashes=False)
+@bp.route("/<path:path>", methods=DAV_METHODS)
+def dav(path):
+    if request.method == "OPTIONS":
+        return Response(status=200, headers={"DAV": "1", "Allow": ", ".join(DAV_METHODS), "MS-Author-Via": "DAV"})
+    resource = resolve(path)
+    if resource is None:
+        return Response("不支持的路径", 403)
+    kind, disk_path, root_id = resource
+    if request.method in WRITE_METHODS:
+        from ingest_pipeline import get_pipeline
+        if get_pipeline().closed:
+            # 关闭期间写了盘却没有写入历史，重启后就不会再补上
+            return Response("服务正在关闭，请稍后重试", 503)
+    handler = {
+        "GET": dav_get,
+        "HEAD": dav_get,
+        "PUT": dav_put,
+        "DELETE": dav_delete,
+        "PROPFIND": dav_propfind,
+        "MKCOL": dav_mkcol,
+    }[request.method]
+    return handler(kind, disk_path, root_id)
+
+def dav_get(kind: str, disk_path: str, root_id: str):
+    if kind in ("root", "files"):
+        return Response("目录不能直接下载", 405)
+    if not os.path.isfile(disk_path):
+        return Response("未找到", 404)
+    return send_file(disk_path, max_age=0)
+
+def _body_chunks():
+    """按块读取请求体；chunked 上传没有 Content-Length，werkzeug 的 request.stream 会读不到，直接读 wsgi.input"""
+    stream = request.stream
+    if "chunked" in request.headers.get("Transfer-Encoding", "").lower():
+        stream = request.environ["wsgi.input"]
+    while chunk := stream.read(Config.WEBDAV_CHUNK_SIZE):
+        yield chunk
+
+def _receive_to(disk_path: str, chunks) -> tuple:
+    """把数据块写入同目录的临时文件后原子替换，返回 (MD5, 大小)"""
+    os.makedirs(os.path.dirname(disk_path), exist_ok=True)
+    md5 = hashlib.md5()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(disk_path), prefix=".upload-")
+    try:
+        os.chmod(tmp_path, 0o644)  # mkstemp 默认只有所有者可读写
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                md5.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(tmp_path, disk_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return md5.hexdigest(), size
+
+def dav_put(kind: str, disk_path: str, root_id: str):
+    if kind in ("root", "files"):
+        return Response("不能上传到目录", 405)
+    existed = os.path.exists(disk_path)
+    if kind == "json":
+        from ingest_pipeline import get_pipeline
+
+        # 先取得流水线再写盘：流水线首次创建时会把磁盘上已有的内容当作已写入
+        pipeline = get_pipeline()
+        body = b"".join(_body_chunks())
+        _receive_to(disk_path, [body])
+        _ingest_json(pipeline, disk_path, body, root_id)
+    else:
+        checksum, _ = _receive_to(disk_path, _body_chunks())
+        _store_file(disk_path, checksum)
+    return Response(status=204 if existed else 201)
+
+def _ingest_json(pipeline, disk_path: str, body: bytes, root_id: str):
+    """把刚上传的内容直接交给写入流水线（与文件监控共用，同一内容只写入一次）"""
+    try:
+        data = json.loads(body.decode("utf-8-sig"))
+    except ValueError as e:
+        print(f"WebDAV 上传的 JSON 无法解析: {e}")
+        return
+    if isinstance(data, dict):
+        pipeline.submit(disk_path, data=data, root_id=root_id)
+
+def _store_file(disk_path: str, checksum: str):
+    """硬链接进备份目录并立即登记，补全在等待这个文件的记录（校验和已在接收时算好）"""
+    from file_stager import get_stager
+
+    get_stager().stage(disk_path, checksum, link=True)
+
+def dav_delete(kind: str, disk_path: str, root_id: str):
+    if kind != "file":
+        return Response("只能删除 file/ 下的文件", 403)
+    try:
+        os.remove(disk_path)  # 备份目录中的硬链接不受影响
+    except FileNotFoundError:
+        return Response("未找到", 404)
+    return Response(status=204)
+
+def dav_mkcol(kind: str, disk_path: str, root_id: str):
+    if kind != "files":
+        return Response("只支持创建 file/ 目录", 403)
+    if os.path.isdir(disk_path):
+        return Response("已存在", 405)
+    os.makedirs(disk_path)
+    return Response(status=201)
+
+def _propstat(href: str, disk_path: str) -> str:
+    stat = os.stat(disk_path)
+    is_dir = os.path.isdir(disk_path)
+    props = [
+        f"<D:displayname>{escape(os.path.basename(disk_path.rstrip(os.sep)))}</D:displayname>",
+        f"<D:getlastmodified>{formatdate(stat.st_mtime, usegmt=True)}</D:getlastmodified>",
+        f"<D:resourcetype>{'<D:collection/>' if is_dir else ''}</D:resourcetype>",
+    ]
+    if not is_dir:
+        props += [
+            f"<D:getcontentlength>{stat.st_size}</D:getcontentlength>",
+            f'<D:getetag>"{stat.st_mtime_ns:x}-{stat.st_size:x}"</D:getetag>',
+        ]
+    return (f"<D:response><D:href>{escape(quote(href))}</D:href>"
+            f"<D:propstat><D:prop>{''.join(props)}</D:prop><D:status>HTTP/1.1 200 OK</D:status></D:propstat>"
+            f"</D:response>")
+
+def dav_propfind(kind: str, disk_path: str, root_id: str):
+    if not os.path.exists(disk_path):
+        return Response("未找到", 404)
+    base = request.path if request.path.endswith("/") or kind in ("json", "file") else request.path + "/"
+    responses = [_propstat(base, disk_path)]
+    if request.headers.get("Depth", "1") != "0":
+        if kind == "root":
+            children = [(Config.SYNC_CLIPBOARD_JSON_FILE, json_path(root_id)), ("file/", files_dir(root_id))]
+        elif kind == "files":
+            children = [(entry.name, entry.path) for entry in os.scandir(disk_path)
+                        if entry.is_file() and not entry.name.startswith(".upload-")]
+        else:
+            children = []
+        responses += [_propstat(base + name, child) for name, child in children if os.path.exists(child)]
+    body = '<?xml version="1.0" encoding="utf-8"?>\n<D:multistatus xmlns:D="DAV:">' + "".join(responses) + "</D:multistatus>"
+    return Response(body, 207, mimetype="application/xml")